@@ -0,0 +1,231 @@
+import os
+import threading
+from bisect import bisect_right
+
+import recommender
+from defaults import ALS_FACTORS, ALS_ITERATIONS, ALS_REGULARIZATION
+from lazy import lazy_import
+
+# Optional, only the als engine needs it
+np = lazy_import("numpy", optional=True)
+
+# Factor files are written as <MODEL_PREFIX>.users.npy, .items.npy (both
+# memory-mappable) and .ids.npz (the id maps and settings)
+MODEL_PREFIX = "als_model"
+
+FACTORS, ITERATIONS, REGULARIZATION = ALS_FACTORS, ALS_ITERATIONS, ALS_REGULARIZATION
+# Implicit mode: confidence of an observed review is 1 + ALPHA * rating
+ALPHA = 10.0
+# Padded ratings per batched solve; bounds the (rows x ratings x factors) scratch arrays
+BLOCK_RATINGS = 65536
+
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError("The als engine needs NumPy: pip install numpy")
+
+
+def _by_row(rows, cols, values, n_rows):
+    """Sort (row, col, value) triples by row. Returns (indptr, cols, values)."""
+    order = np.argsort(rows, kind="stable")
+    indptr = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=n_rows))))
+    return indptr, cols[order], values[order]
+
+
+def _solve_side(indptr, cols, values, fixed, regularization, implicit, alpha):
+    """Least-squares solve every row's factors against the ``fixed`` side.
+
+    Rows are sorted by their number of ratings and batched so each batch,
+    padded to its longest row, holds about BLOCK_RATINGS ratings. A batch's
+    Gram matrices are then one batched matmul and its solves one batched
+    np.linalg.solve.
+    """
+    n_rows, k = len(indptr) - 1, fixed.shape[1]
+    solved = np.zeros((n_rows, k), dtype=np.float64)
+    identity = np.eye(k)
+    shared = fixed.T @ fixed if implicit else None
+
+    counts = np.diff(indptr)
+    order = np.argsort(counts, kind="stable")
+    order = order[counts[order] > 0]
+    sorted_counts = counts[order].tolist()
+
+    start = 0
+    while start < len(order):
+        # Grow the batch while batch size x longest row stays within BLOCK_RATINGS
+        stop = start + bisect_right(range(start, len(order)), BLOCK_RATINGS,
+                                    key=lambda j: (j - start + 1) * sorted_counts[j])
+        stop = max(stop, start + 1)
+        rows = order[start:stop]
+        width = sorted_counts[stop - 1]
+
+        offsets = np.arange(width)
+        mask = offsets[None, :] < counts[rows][:, None]
+        positions = np.where(mask, indptr[rows][:, None] + offsets[None, :], 0)
+        gathered = fixed[cols[positions]] * mask[..., None]
+        rated = np.where(mask, values[positions], 0.0)
+
+        if implicit:
+            confidence = 1.0 + alpha * rated
+            weighted = gathered * (confidence - 1.0)[..., None]
+            target = confidence * mask
+        else:
+            weighted = gathered
+            target = rated
+        gram = weighted.transpose(0, 2, 1) @ gathered
+        rhs = np.einsum("blk,bl->bk", gathered, target)
+        if implicit:
+            gram += shared + regularization * identity
+        else:
+            gram += regularization * counts[rows][:, None, None] * identity
+        solved[rows] = np.linalg.solve(gram, rhs[..., None])[..., 0]
+        start = stop
+    return solved
+
+
+class ALSModel:
+    """User and media factor matrices; a user's scores are one matrix-vector product."""
+
+    def __init__(self, user_ids, media_ids, user_factors, item_factors, mean=0.0, implicit=False,
+                 regularization=REGULARIZATION):
+        self.user_ids = user_ids
+        self.media_ids = media_ids
+        self.user_factors = user_factors
+        self.item_factors = item_factors
+        self.mean = float(mean)
+        self.implicit = bool(implicit)
+        self.regularization = float(regularization)
+        self._user_row = {int(user_id): row for row, user_id in enumerate(user_ids)}
+        self._item_row = {int(media_id): row for row, media_id in enumerate(media_ids)}
+
+    def __len__(self):
+        return len(self.media_ids)
+
+    def save(self, prefix=MODEL_PREFIX):
+        # Each file is written aside and renamed into place
+        for suffix, array in ((".users.npy", self.user_factors), (".items.npy", self.item_factors)):
+            np.save(prefix + suffix + ".tmp.npy", np.ascontiguousarray(array, dtype=np.float32))
+            os.replace(prefix + suffix + ".tmp.npy", prefix + suffix)
+        np.savez(prefix + ".ids.tmp.npz", user_ids=self.user_ids, media_ids=self.media_ids,
+                 mean=self.mean, implicit=self.implicit, regularization=self.regularization)
+        os.replace(prefix + ".ids.tmp.npz", prefix + ".ids.npz")
+
+    @classmethod
+    def load(cls, prefix=MODEL_PREFIX, mmap=True):
+        """Load a saved model; with ``mmap`` the factor matrices stay on disk and are paged in."""
+        mode = "r" if mmap else None
+        with np.load(prefix + ".ids.npz") as ids:
+            return cls(ids["user_ids"], ids["media_ids"],
+                       np.load(prefix + ".users.npy", mmap_mode=mode), np.load(prefix + ".items.npy", mmap_mode=mode),
+                       ids["mean"], ids["implicit"], ids["regularization"])
+
+    def fold_in(self, ratings):
+        """Solve factors for a user the model wasn't trained on, from {media_id: rating}."""
+        known = [(self._item_row[media_id], rating) for media_id, rating in ratings.items() if media_id in self._item_row]
+        if not known:
+            return None
+        rows = np.array([row for row, _ in known])
+        rated = np.array([rating for _, rating in known], dtype=np.float64)
+        indptr = np.array([0, len(rows)])
+        if self.implicit:
+            # Needs the full item Gram matrix
+            fixed, cols, values = np.asarray(self.item_factors, dtype=np.float64), rows, rated
+        else:
+            fixed, cols, values = np.asarray(self.item_factors[rows], dtype=np.float64), np.arange(len(rows)), rated - self.mean
+        return _solve_side(indptr, cols, values, fixed, self.regularization, self.implicit, ALPHA)[0]
+
+    def recommend(self, user_id, ratings, limit=5):
+        """Return [(media_id, score)] for media not in ``ratings`` ({media_id: rating}).
+
+        Explicit models score predicted ratings; implicit ones a preference
+        strength.
+        """
+        row = self._user_row.get(user_id)
+        vector = self.user_factors[row] if row is not None else self.fold_in(ratings)
+        if vector is None:
+            return []
+        scores = self.item_factors @ np.asarray(vector, dtype=self.item_factors.dtype)
+        if not self.implicit:
+            scores = scores + self.mean
+        seen = [self._item_row[media_id] for media_id in ratings if media_id in self._item_row]
+        scores[seen] = -np.inf
+
+        limit = min(limit, len(scores) - len(seen))
+        if limit <= 0:
+            return []
+        best = np.argpartition(-scores, limit - 1)[:limit]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return [(int(self.media_ids[i]), float(scores[i])) for i in best]
+
+
+def train(user_ids, media_ids, ratings, factors=FACTORS, iterations=ITERATIONS,
+          regularization=REGULARIZATION, implicit=False, alpha=ALPHA, seed=0):
+    """Fit an ALSModel to parallel arrays of user ids, media ids and ratings.
+
+    Explicit mode fits ratings minus their global mean; implicit mode treats
+    every review as an observed preference weighted by its rating.
+    """
+    _require_numpy()
+    users_index, users = np.unique(np.asarray(user_ids, dtype=np.int64), return_inverse=True)
+    media_index, items = np.unique(np.asarray(media_ids, dtype=np.int64), return_inverse=True)
+    ratings = np.asarray(ratings, dtype=np.float64)
+    mean = 0.0 if implicit else float(ratings.mean()) if len(ratings) else 0.0
+    values = ratings if implicit else ratings - mean
+
+    rng = np.random.default_rng(seed)
+    user_factors = rng.normal(0, 0.1, (len(users_index), factors))
+    item_factors = rng.normal(0, 0.1, (len(media_index), factors))
+    by_user = _by_row(users, items, values, len(users_index))
+    by_item = _by_row(items, users, values, len(media_index))
+
+    for _ in range(iterations):
+        user_factors = _solve_side(*by_user, item_factors, regularization, implicit, alpha)
+        item_factors = _solve_side(*by_item, user_factors, regularization, implicit, alpha)
+
+    return ALSModel(users_index, media_index, user_factors.astype(np.float32), item_factors.astype(np.float32),
+                    mean, implicit, regularization)
+
+
+def load_ratings(conn):
+    """Return (user ids, media ids, ratings) arrays, one averaged rating per pair."""
+    _require_numpy()
+    rows = np.array(conn.execute("""
+        SELECT user_id, media_id, AVG(rating) FROM reviews
+        WHERE rating IS NOT NULL
+        GROUP BY user_id, media_id
+    """).fetchall(), dtype=np.float64).reshape(-1, 3)
+    return rows[:, 0].astype(np.int64), rows[:, 1].astype(np.int64), rows[:, 2]
+
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def train_model(conn, prefix=MODEL_PREFIX, **options):
+    """Train on every review, save the factors and make them the served model."""
+    global _model
+    model = train(*load_ratings(conn), **options)
+    model.save(prefix)
+    with _model_lock:
+        _model = ALSModel.load(prefix)
+    return model
+
+
+def get_model(conn, prefix=MODEL_PREFIX):
+    """Return the served model, memory-mapping saved factors or training on first use."""
+    global _model
+    _require_numpy()
+    with _model_lock:
+        if _model is None:
+            if not os.path.exists(prefix + ".ids.npz"):
+                train(*load_ratings(conn)).save(prefix)
+            _model = ALSModel.load(prefix)
+        return _model
+
+
+def recommend(conn, user_id, limit=5):
+    """Return [(media_id, score)] for ``user_id`` from the ALS factors."""
+    ratings = recommender.user_ratings(conn, user_id)
+    if not ratings:
+        return []
+    return get_model(conn).recommend(user_id, ratings, limit)
@@ -0,0 +1,176 @@
+import heapq
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+from db import db_connection
+from fuzzy import normalize
+
+# Prefixes matching more entries than this have their top completions
+# memoized, so short prefixes like "t" don't rank the whole range each time
+SCAN_LIMIT = 256
+MEMO_SIZE = 20
+# Memoized prefixes kept per index, least recently used dropped first
+MEMO_ENTRIES = 4096
+
+_LOAD_QUERIES = {
+    "media": """
+        SELECT media.id, media.title, COUNT(reviews.id)
+        FROM media LEFT JOIN reviews ON reviews.media_id = media.id
+        GROUP BY media.id
+    """,
+    "users": """
+        SELECT users.id, users.name, COUNT(reviews.id)
+        FROM users LEFT JOIN reviews ON reviews.user_id = users.id
+        GROUP BY users.id
+    """,
+}
+KINDS = tuple(_LOAD_QUERIES)
+
+
+def completion_key(text):
+    return " ".join(normalize(text))
+
+
+class PrefixIndex:
+    """Sorted array of normalized names with review counts, searched with bisect.
+
+    Every name starting with a prefix sits in one contiguous slice, found
+    with two binary searches. Completions are the most-reviewed entries in
+    that slice (ties in name order, then id order).
+    """
+
+    def __init__(self, entries=()):
+        rows = sorted((completion_key(name), entry_id, name, count) for entry_id, name, count in entries)
+        self.keys = [row[0] for row in rows]
+        self.ids = array("q", (row[1] for row in rows))
+        self.names = [row[2] for row in rows]
+        self.counts = array("Q", (row[3] for row in rows))
+        self._key_of = {row[1]: row[0] for row in rows}
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _best(self, lo, hi, limit):
+        positions = heapq.nlargest(limit, range(lo, hi), key=self.counts.__getitem__)
+        return [(self.ids[i], self.names[i], self.counts[i]) for i in positions]
+
+    def complete(self, prefix, limit=10):
+        """Return up to ``limit`` (id, name, review count) for names starting with ``prefix``."""
+        key = completion_key(prefix)
+        with self._lock:
+            lo = bisect_left(self.keys, key)
+            hi = bisect_left(self.keys, key + "\U0010ffff", lo)
+            if hi - lo <= SCAN_LIMIT:
+                return self._best(lo, hi, limit)
+
+            best = self._memo.get(key)
+            if best is None or len(best) < min(limit, hi - lo):
+                best = self._memo[key] = self._best(lo, hi, max(limit, MEMO_SIZE))
+                if len(self._memo) > MEMO_ENTRIES:
+                    self._memo.popitem(last=False)
+            self._memo.move_to_end(key)
+            return best[:limit]
+
+    def _rank(self, entry):
+        # The order _best() produces: most reviews first, then position
+        return -entry[2], self._key_of[entry[0]], entry[0]
+
+    def _update_memo(self, key, entry, decreased=False):
+        """Keep the memoized completions of ``key``'s prefixes in step with one
+        changed entry, instead of dropping them; the short prefixes the memo
+        is for contain every name, so dropping would recompute them on every
+        review."""
+        for end in range(len(key) + 1):
+            prefix = key[:end]
+            best = self._memo.get(prefix)
+            if best is None:
+                continue
+            size = len(best)
+            current = next((i for i, (entry_id, _, _) in enumerate(best) if entry_id == entry[0]), None)
+            if current is not None:
+                if decreased:
+                    # Something outside the memo may now outrank it
+                    del self._memo[prefix]
+                    continue
+                best[current] = entry
+            elif self._rank(entry) < self._rank(best[-1]):
+                best.append(entry)
+            else:
+                continue
+            best.sort(key=self._rank)
+            del best[size:]
+
+    def add(self, entry_id, name, count=0):
+        key = completion_key(name)
+        with self._lock:
+            if entry_id in self._key_of:
+                return
+            # Equal keys stay in id order, as when the index was loaded
+            position = bisect_right(self.keys, key)
+            while position and self.keys[position - 1] == key and self.ids[position - 1] > entry_id:
+                position -= 1
+            self.keys.insert(position, key)
+            self.ids.insert(position, entry_id)
+            self.names.insert(position, name)
+            self.counts.insert(position, count)
+            self._key_of[entry_id] = key
+            self._update_memo(key, (entry_id, name, count))
+
+    def bump(self, entry_id, delta=1):
+        """Add to an entry's review count."""
+        with self._lock:
+            key = self._key_of.get(entry_id)
+            if key is None:
+                return
+            position = bisect_left(self.keys, key)
+            while self.ids[position] != entry_id:
+                position += 1
+            self.counts[position] += delta
+            self._update_memo(key, (entry_id, self.names[position], self.counts[position]), decreased=delta < 0)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(kind):
+    """Return the index for "media" or "users", loading it on first use."""
+    with _indexes_lock:
+        index = _indexes.get(kind)
+        if index is None:
+            with db_connection() as conn:
+                index = _indexes[kind] = PrefixIndex(conn.execute(_LOAD_QUERIES[kind]))
+        return index
+
+
+def complete(kind, prefix, limit=10):
+    return get_index(kind).complete(prefix, limit)
+
+
+def add_entry(kind, entry_id, name):
+    """Add a new user or media to its index if that index is loaded."""
+    index = _indexes.get(kind)
+    if index is not None:
+        index.add(entry_id, name)
+
+
+def record_reviews(pairs):
+    """Count new reviews, given as (user_id, media_id) pairs, in the loaded indexes."""
+    users, media = _indexes.get("users"), _indexes.get("media")
+    if users is None and media is None:
+        return
+    for user_id, media_id in pairs:
+        if users is not None:
+            users.bump(user_id)
+        if media is not None:
+            media.bump(media_id)
+
+
+def reset():
+    """Drop the loaded indexes (e.g. after switching databases)."""
+    with _indexes_lock:
+        _indexes.clear()
@@ -0,0 +1,930 @@
+import contextlib
+import io
+import os
+import queue
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+import db
+
+
+def _scratch_db(prefix, **pool_options):
+    """Point the shared pool at a fresh database. Returns its directory."""
+    workdir = tempfile.mkdtemp(prefix=prefix)
+    pool = db.configure_pool(database=os.path.join(workdir, "bench.db"), **pool_options)
+    db.initialize_db()
+    return workdir, pool
+
+
+def _drop_scratch_db(workdir):
+    db.configure_pool()
+    for name in os.listdir(workdir):
+        os.remove(os.path.join(workdir, name))
+    os.rmdir(workdir)
+
+
+def _seed(users, media):
+    with db.db_connection() as conn:
+        conn.executemany("INSERT INTO users (name) VALUES (?)", [(f"user{i}",) for i in range(users)])
+        conn.executemany("INSERT INTO media (title, type) VALUES (?, 'Movie')", [(f"media{i}",) for i in range(media)])
+
+
+def _percentile(samples, pct):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    index = min(len(samples) - 1, int(len(samples) * pct / 100))
+    return samples[index]
+
+
+def bench_concurrency(durability, writers=4, readers=4, seconds=3.0, users=100, media=100):
+    """Run concurrent review writers and readers against a scratch database.
+
+    Every writer commits one review per transaction, which is the pattern
+    `add_reviews_multithreaded` produces. Returns throughput, latency and
+    lock-error counts for the given durability profile.
+    """
+    workdir, pool = _scratch_db("media-bench-", size=writers + readers, durability=durability)
+
+    try:
+        _seed(users, media)
+
+        stop = threading.Event()
+        lock = threading.Lock()
+        results = {"writes": 0, "reads": 0, "locked": 0, "write_latency": [], "read_latency": []}
+
+        def record(kind, latency):
+            with lock:
+                results[kind + "s"] += 1
+                results[kind + "_latency"].append(latency)
+
+        def writer(n):
+            i = 0
+            while not stop.is_set():
+                started = time.perf_counter()
+                try:
+                    with pool.connection() as conn:
+                        conn.execute(
+                            "INSERT INTO reviews (user_id, media_id, rating, comment) VALUES (?, ?, ?, ?)",
+                            (1 + (n + i) % users, 1 + i % media, 1 + i % 5, "benchmark review"),
+                        )
+                except sqlite3.OperationalError:
+                    with lock:
+                        results["locked"] += 1
+                    continue
+                record("write", time.perf_counter() - started)
+                i += 1
+
+        def reader(n):
+            i = 0
+            while not stop.is_set():
+                started = time.perf_counter()
+                try:
+                    with pool.connection() as conn:
+                        conn.execute(
+                            "SELECT COUNT(*), AVG(rating) FROM reviews WHERE media_id = ?", (1 + (n + i) % media,)
+                        ).fetchone()
+                except sqlite3.OperationalError:
+                    with lock:
+                        results["locked"] += 1
+                    continue
+                record("read", time.perf_counter() - started)
+                i += 1
+
+        threads = [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+        threads += [threading.Thread(target=reader, args=(n,)) for n in range(readers)]
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        with pool.connection() as conn:
+            journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+
+        return {
+            "durability": durability,
+            "journal_mode": journal_mode,
+            "writes_per_sec": results["writes"] / seconds,
+            "reads_per_sec": results["reads"] / seconds,
+            "write_p99_ms": _percentile(results["write_latency"], 99) * 1000,
+            "read_p99_ms": _percentile(results["read_latency"], 99) * 1000,
+            "locked_errors": results["locked"],
+        }
+    finally:
+        _drop_scratch_db(workdir)
+
+
+def bench_review_writer(count=50000, max_batch=1000, users=100, media=100):
+    """Push ``count`` reviews through a ReviewWriter and time the group commits."""
+    from review_writer import ReviewWriter
+
+    workdir, _ = _scratch_db("media-bench-writer-")
+    try:
+        _seed(users, media)
+        writer = ReviewWriter(max_batch=max_batch).start()
+
+        started = time.perf_counter()
+        futures = [
+            writer.submit(1 + i % users, 1 + i % media, 1 + i % 5, "benchmark review")
+            for i in range(count)
+        ]
+        for future in futures:
+            future.result()
+        elapsed = time.perf_counter() - started
+        writer.close()
+
+        return {
+            "rows": writer.stats["rows"],
+            "batches": writer.stats["batches"],
+            "seconds": elapsed,
+            "rows_per_sec": count / elapsed,
+        }
+    finally:
+        _drop_scratch_db(workdir)
+
+
+def check_cache_coherence(rounds=200, readers=4, users=10, media=10):
+    """Interleave review writes with concurrent cached reads and count stale reads.
+
+    Runs against a scratch database and an in-process Redis stand-in. After
+    each write (commit, then invalidate, exactly as ``add_review`` does) the
+    writer reads the global, per-media and per-user review lists through
+    ``db.get_reviews``; any list missing the review just committed is stale.
+    Reader threads keep repopulating the same keys to provoke races.
+    """
+    import cache
+    import redis_cache
+
+    previous_client = redis_cache.redis_client
+    redis_cache.redis_client = redis_cache.LocalRedis()
+    workdir, _ = _scratch_db("media-cache-check-", size=readers + 2)
+
+    stop = threading.Event()
+    results = {"reads": 0, "stale_reads": 0, "rounds": rounds}
+
+    def reader():
+        while not stop.is_set():
+            db.get_reviews(media_id=random.randint(1, media))
+            db.get_reviews(user_id=random.randint(1, users))
+            db.get_reviews()
+
+    try:
+        _seed(users, media)
+        with contextlib.redirect_stdout(io.StringIO()):
+            threads = [threading.Thread(target=reader) for _ in range(readers)]
+            for thread in threads:
+                thread.start()
+
+            for i in range(rounds):
+                user_id, media_id = random.randint(1, users), random.randint(1, media)
+                comment = f"probe {i}"
+                with db.db_connection() as conn:
+                    conn.execute(
+                        "INSERT INTO reviews (user_id, media_id, rating, comment) VALUES (?, ?, ?, ?)",
+                        (user_id, media_id, 1 + i % 5, comment),
+                    )
+                cache.invalidate_review(user_id, media_id)
+
+                for reviews in (db.get_reviews(), db.get_reviews(media_id=media_id), db.get_reviews(user_id=user_id)):
+                    results["reads"] += 1
+                    if not any(review[3] == comment for review in reviews):
+                        results["stale_reads"] += 1
+
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+        return results
+    finally:
+        stop.set()
+        redis_cache.redis_client = previous_client
+        _drop_scratch_db(workdir)
+
+
+def check_stampede(callers=32, ttl=1):
+    """Hit one cold key, then one soft-expired key, from many threads at once.
+
+    Returns how many times the (deliberately slow) builder ran in each phase,
+    which should be exactly one, and how long callers waited in the
+    soft-expired phase, which should be ~0 because stale data is served
+    while the rebuild runs.
+    """
+    import cache
+    import redis_cache
+
+    previous_client = redis_cache.redis_client
+    redis_cache.redis_client = redis_cache.LocalRedis()
+    builds = []
+    lock = threading.Lock()
+
+    def builder():
+        with lock:
+            builds.append(time.time())
+        time.sleep(0.2)
+        return list(range(100))
+
+    def run_callers():
+        barrier = threading.Barrier(callers)
+        waits = []
+
+        def caller():
+            barrier.wait()
+            started = time.perf_counter()
+            cache.cached_query("stampede-check", ["stampede"], builder, ttl=ttl)
+            with lock:
+                waits.append(time.perf_counter() - started)
+
+        threads = [threading.Thread(target=caller) for _ in range(callers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return waits
+
+    try:
+        run_callers()
+        cold_builds = len(builds)
+
+        # Let the entry soft-expire (jitter included) but stay within its stale window
+        time.sleep(ttl * (1 + cache.TTL_JITTER) + 0.05)
+        builds.clear()
+        waits = run_callers()
+        deadline = time.time() + 2
+        while not builds and time.time() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.3)  # let the background rebuild finish
+
+        return {
+            "callers": callers,
+            "cold_builds": cold_builds,
+            "stale_builds": len(builds),
+            "stale_max_wait_ms": max(waits) * 1000,
+        }
+    finally:
+        redis_cache.redis_client = previous_client
+
+
+def bench_codecs(rows=200000, users=5000, media=2000, repeat=3):
+    """Compare encode/decode time and bytes on the wire for cached review lists.
+
+    "json" is the previous format (``json.dumps`` of the row list).
+    """
+    import json
+    import zlib
+    import cache_codec
+
+    rng = random.Random(42)
+    reviews = [
+        (f"user{rng.randrange(users)}", f"Media Title {rng.randrange(media)}", rng.randint(1, 5),
+         rng.choice(["Absolutely amazing!", "Not bad, but could've been better.", "Worst movie I've ever seen.",
+                     "Great soundtrack and cinematography.", f"Review number {i}"]))
+        for i in range(rows)
+    ]
+
+    def timed(fn):
+        best = float("inf")
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = fn()
+            best = min(best, time.perf_counter() - started)
+        return result, best
+
+    variants = [
+        ("json", lambda: json.dumps(reviews).encode("utf-8"), json.loads),
+        ("json+zlib", lambda: zlib.compress(json.dumps(reviews).encode("utf-8"), 1),
+         lambda data: json.loads(zlib.decompress(data))),
+        ("rows", lambda: cache_codec.REVIEW_ROWS.encode(reviews), cache_codec.REVIEW_ROWS.decode),
+        ("rows+zlib", lambda: zlib.compress(cache_codec.REVIEW_ROWS.encode(reviews), 1),
+         lambda data: cache_codec.REVIEW_ROWS.decode(zlib.decompress(data))),
+    ]
+    if cache_codec.lz4_frame is not None:
+        lz4 = cache_codec.lz4_frame
+        variants.append(("rows+lz4", lambda: lz4.compress(cache_codec.REVIEW_ROWS.encode(reviews)),
+                         lambda data: cache_codec.REVIEW_ROWS.decode(lz4.decompress(data))))
+
+    results = []
+    for name, encode, decode in variants:
+        payload, encode_time = timed(encode)
+        decoded, decode_time = timed(lambda: decode(payload))
+        assert [tuple(row) for row in decoded] == reviews
+        results.append({"codec": name, "bytes": len(payload), "encode_ms": encode_time * 1000, "decode_ms": decode_time * 1000})
+    return results
+
+
+_TITLE_WORDS = [
+    "dark", "knight", "star", "night", "love", "city", "lost", "river", "secret", "king", "queen", "shadow",
+    "fire", "ice", "dream", "storm", "last", "first", "house", "road", "blue", "red", "golden", "silent",
+    "wild", "broken", "hidden", "empire", "ocean", "mountain", "winter", "summer", "ghost", "legend", "return",
+    "rise", "fall", "heart", "stone", "garden", "machine", "planet", "island", "echo", "midnight", "crown",
+]
+
+
+def _synthetic_titles(count, seed=42):
+    rng = random.Random(seed)
+    types = ("Movie", "WebShow", "Song")
+    for i in range(count):
+        words = rng.sample(_TITLE_WORDS, rng.randint(2, 4))
+        yield (" ".join(words).title() + f" {i}", types[i % 3])
+
+
+def bench_search(titles=1000000, queries=("shadow", "dark kni", "midnight garden", "zzz"), repeat=3):
+    """Compare the FTS5 index with the old ``LIKE '%q%'`` scan on a synthetic catalog.
+
+    Both sides fetch the first 10 matches and the total match count, which is
+    what the `search` command shows.
+    """
+    import search
+
+    workdir, pool = _scratch_db("media-search-", durability="off")
+    try:
+        started = time.perf_counter()
+        with db.db_connection() as conn:
+            conn.executemany("INSERT INTO media (title, type) VALUES (?, ?)", _synthetic_titles(titles))
+        load_seconds = time.perf_counter() - started
+
+        def timed(fn):
+            best = float("inf")
+            for _ in range(repeat):
+                t = time.perf_counter()
+                result = fn()
+                best = min(best, time.perf_counter() - t)
+            return result, best
+
+        results = []
+        with db.db_connection() as conn:
+            for text in queries:
+                def like():
+                    pattern = f"%{text}%"
+                    total = conn.execute("SELECT COUNT(*) FROM media WHERE LOWER(title) LIKE LOWER(?)", (pattern,)).fetchone()[0]
+                    conn.execute("SELECT id, title, type FROM media WHERE LOWER(title) LIKE LOWER(?) LIMIT 10", (pattern,)).fetchall()
+                    return total
+
+                def fts():
+                    total = search.count_matches(conn, "media_fts", text)
+                    search.search_media(conn, text, limit=10)
+                    return total
+
+                like_total, like_time = timed(like)
+                fts_total, fts_time = timed(fts)
+                results.append({
+                    "query": text, "like_matches": like_total, "fts_matches": fts_total,
+                    "like_ms": like_time * 1000, "fts_ms": fts_time * 1000,
+                })
+        return {"titles": titles, "load_seconds": load_seconds, "queries": results}
+    finally:
+        _drop_scratch_db(workdir)
+
+
+def _synthetic_word(rng):
+    """A pronounceable made-up word of 2-4 consonant-vowel(-consonant) syllables."""
+    consonants, vowels, codas = "bcdfghjklmnprstvwz", "aeiou", ["", "", "n", "r", "s", "l", "th"]
+    return "".join(rng.choice(consonants) + rng.choice(vowels) + rng.choice(codas) for _ in range(rng.randint(2, 4)))
+
+
+def _typo(rng, text):
+    i = rng.randrange(len(text))
+    if text[i] == " ":
+        return text
+    return text[:i] + rng.choice("aeiouxyz") + text[i + 1:]
+
+
+def bench_fuzzy(titles=1000000, queries=500, vocabulary=100000, seed=7):
+    """Build, snapshot and query a trigram index over synthetic titles.
+
+    Titles are 1-4 invented words; each query is a real title with one
+    character changed. Reports latency percentiles and how often the
+    original title is among the matches returned.
+    """
+    import statistics
+    import fuzzy
+
+    rng = random.Random(seed)
+    words = [_synthetic_word(rng) for _ in range(vocabulary)]
+    catalog = [(i + 1, " ".join(rng.sample(words, rng.randint(1, 4))).title()) for i in range(titles)]
+
+    started = time.perf_counter()
+    index = fuzzy.TrigramIndex()
+    for media_id, title in catalog:
+        index.add(media_id, title)
+    build_seconds = time.perf_counter() - started
+
+    workdir = tempfile.mkdtemp(prefix="media-fuzzy-")
+    try:
+        path = os.path.join(workdir, "titles.trigrams")
+        index.save(path)
+        snapshot_bytes = os.path.getsize(path)
+        started = time.perf_counter()
+        index = fuzzy.TrigramIndex.load(path)
+        load_seconds = time.perf_counter() - started
+    finally:
+        for name in os.listdir(workdir):
+            os.remove(os.path.join(workdir, name))
+        os.rmdir(workdir)
+
+    timings, examples, found = [], [], 0
+    for _ in range(queries):
+        media_id, title = rng.choice(catalog)
+        query = _typo(rng, title)
+        started = time.perf_counter()
+        matches = index.search(query)
+        timings.append(time.perf_counter() - started)
+
+        found += any(match_id == media_id for match_id, _, _ in matches)
+        if len(examples) < 8:
+            best = matches[0] if matches else (None, None, None)
+            examples.append({"query": query, "match": best[1], "distance": best[2]})
+
+    return {
+        "titles": titles, "build_seconds": build_seconds, "snapshot_bytes": snapshot_bytes,
+        "load_seconds": load_seconds, "examples": examples, "recall": found / queries,
+        "p50_ms": statistics.median(timings) * 1000, "p99_ms": _percentile(timings, 99) * 1000,
+    }
+
+
+def bench_autocomplete(entries=1000000, queries=2000, inserts=200, seed=11):
+    """Time prefix completions and incremental inserts on a synthetic catalog.
+
+    Review counts follow a long-tailed distribution; prefixes are 1-6
+    characters of real titles.
+    """
+    import statistics
+    import autocomplete
+
+    rng = random.Random(seed)
+    words = [_synthetic_word(rng) for _ in range(50000)]
+    catalog = [(i + 1, " ".join(rng.sample(words, rng.randint(1, 3))).title(), int(rng.paretovariate(1.2)) - 1)
+               for i in range(entries)]
+
+    started = time.perf_counter()
+    index = autocomplete.PrefixIndex(catalog)
+    build_seconds = time.perf_counter() - started
+
+    timings = []
+    for _ in range(queries):
+        title = rng.choice(catalog)[1]
+        prefix = title[:rng.randint(1, 6)]
+        started = time.perf_counter()
+        index.complete(prefix, 10)
+        timings.append(time.perf_counter() - started)
+
+    insert_timings = []
+    for i in range(inserts):
+        started = time.perf_counter()
+        index.add(entries + i + 1, " ".join(rng.sample(words, 2)).title())
+        insert_timings.append(time.perf_counter() - started)
+
+    return {
+        "entries": entries, "build_seconds": build_seconds,
+        "p50_us": statistics.median(timings) * 1e6, "p99_us": _percentile(timings, 99) * 1e6,
+        "insert_p50_us": statistics.median(insert_timings) * 1e6,
+    }
+
+
+def _synthetic_ratings(users, media, reviews, genres=20, seed=5):
+    """(user_id, media_id, rating) with taste clusters: each user favours two
+    genres, mostly rates media from them and rates those higher."""
+    rng = random.Random(seed)
+    genre_of = [rng.randrange(genres) for _ in range(media)]
+    by_genre = [[m + 1 for m in range(media) if genre_of[m] == g] or [1] for g in range(genres)]
+    tastes = [rng.sample(range(genres), 2) for _ in range(users)]
+    rows = []
+    for _ in range(reviews):
+        user = rng.randrange(users)
+        if rng.random() < 0.8:
+            media_id = rng.choice(by_genre[rng.choice(tastes[user])])
+        else:
+            media_id = rng.randrange(media) + 1
+        liked = genre_of[media_id - 1] in tastes[user]
+        rating = min(5, max(1, round(rng.gauss(4.3 if liked else 2.2, 0.7))))
+        rows.append((user + 1, media_id, rating))
+    return rows
+
+
+def bench_cf(users=20000, media=5000, reviews=500000, queries=500, seed=5):
+    """Build item-item neighbour lists from synthetic ratings and time recommendations."""
+    import statistics
+    import recommender
+
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE reviews (id INTEGER PRIMARY KEY, user_id INTEGER, media_id INTEGER, rating INTEGER)")
+    conn.execute("CREATE INDEX idx_reviews_user_media ON reviews (user_id, media_id)")
+    conn.executemany("INSERT INTO reviews (user_id, media_id, rating) VALUES (?, ?, ?)",
+                     _synthetic_ratings(users, media, reviews, seed=seed))
+
+    started = time.perf_counter()
+    model = recommender.build_model(conn)
+    build_seconds = time.perf_counter() - started
+
+    workdir = tempfile.mkdtemp(prefix="bench_cf_")
+    path = os.path.join(workdir, "neighbors.npz")
+    try:
+        model.save(path)
+        size = os.path.getsize(path)
+        started = time.perf_counter()
+        model = recommender.ItemNeighbors.load(path)
+        load_seconds = time.perf_counter() - started
+    finally:
+        for name in os.listdir(workdir):
+            os.remove(os.path.join(workdir, name))
+        os.rmdir(workdir)
+
+    rng = random.Random(seed)
+    timings = []
+    for _ in range(queries):
+        user_id = rng.randrange(users) + 1
+        started = time.perf_counter()
+        model.recommend(recommender.user_ratings(conn, user_id), 10)
+        timings.append(time.perf_counter() - started)
+    conn.close()
+
+    return {
+        "reviews": reviews, "media": len(model), "pairs": len(model.neighbors),
+        "build_seconds": build_seconds, "load_ms": load_seconds * 1000, "size_mb": size / 1e6,
+        "p50_ms": statistics.median(timings) * 1000, "p99_ms": _percentile(timings, 99) * 1000,
+    }
+
+
+def evaluate_recommenders(k=10, holdout=0.2, synthetic=0, max_users=2000, relevant_rating=4, seed=3,
+                          engines=("popular", "cf", "als", "als-implicit")):
+    """Offline precision@k of each recommendation engine.
+
+    A ``holdout`` share of every user's reviews (users with 5+) is hidden;
+    engines are trained on the rest and scored on how many of their top-k
+    picks are hidden reviews rated ``relevant_rating`` or more. Uses the
+    live database unless ``synthetic`` gives a number of synthetic reviews.
+    """
+    import numpy as np
+    import als
+    import recommender
+
+    if synthetic:
+        rows = _synthetic_ratings(synthetic // 25, synthetic // 100, synthetic, seed=seed)
+    else:
+        with db.db_connection() as conn:
+            rows = conn.execute(
+                "SELECT user_id, media_id, AVG(rating) FROM reviews WHERE rating IS NOT NULL GROUP BY user_id, media_id"
+            ).fetchall()
+    # One rating per (user, media), repeats averaged like the engines' training
+    # queries do; the database rows come pre-averaged, synthetic ones may repeat
+    totals = {}
+    for user_id, media_id, rating in rows:
+        total = totals.setdefault(user_id, {}).setdefault(media_id, [0, 0])
+        total[0] += rating
+        total[1] += 1
+    ratings = {user_id: {media_id: total / count for media_id, (total, count) in rated.items()}
+               for user_id, rated in totals.items()}
+
+    rng = random.Random(seed)
+    train_rows, hidden = [], {}
+    for user_id, rated in ratings.items():
+        items = list(rated.items())
+        rng.shuffle(items)
+        cut = int(len(items) * holdout) if len(items) >= 5 else 0
+        relevant = {media_id for media_id, rating in items[:cut] if rating >= relevant_rating}
+        if relevant:
+            hidden[user_id] = relevant
+        train_rows.extend((user_id, media_id, rating) for media_id, rating in items[cut:])
+    users = rng.sample(sorted(hidden), min(max_users, len(hidden)))
+    known = {}
+    for user_id, media_id, rating in train_rows:
+        known.setdefault(user_id, {})[media_id] = rating
+
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE reviews (id INTEGER PRIMARY KEY, user_id INTEGER, media_id INTEGER, rating INTEGER)")
+    conn.executemany("INSERT INTO reviews (user_id, media_id, rating) VALUES (?, ?, ?)", train_rows)
+
+    columns = np.array(train_rows, dtype=np.float64).reshape(-1, 3)
+    recommenders = {}
+    timings = {}
+    for engine in engines:
+        started = time.perf_counter()
+        if engine == "popular":
+            counts = {}
+            for _, media_id, rating in train_rows:
+                if rating >= relevant_rating:
+                    counts[media_id] = counts.get(media_id, 0) + 1
+            ranked = sorted(counts, key=counts.get, reverse=True)
+            recommenders[engine] = lambda user_id, rated, ranked=ranked: \
+                [media_id for media_id in ranked if media_id not in rated][:k]
+        elif engine == "cf":
+            model = recommender.build_model(conn)
+            recommenders[engine] = lambda user_id, rated, model=model: \
+                [media_id for media_id, _ in model.recommend(rated, k)]
+        else:
+            model = als.train(columns[:, 0], columns[:, 1], columns[:, 2], implicit=engine == "als-implicit")
+            recommenders[engine] = lambda user_id, rated, model=model: \
+                [media_id for media_id, _ in model.recommend(user_id, rated, k)]
+        timings[engine] = time.perf_counter() - started
+    conn.close()
+
+    results = {}
+    for engine, recommend in recommenders.items():
+        hits = sum(len(set(recommend(user_id, known.get(user_id, {}))) & hidden[user_id]) for user_id in users)
+        results[engine] = {"precision": hits / (k * len(users)) if users else 0.0, "train_seconds": timings[engine]}
+    return {"users": len(users), "k": k, "reviews": len(rows), "engines": results}
+
+
+def bench_notifications(reviews=100000, media=1000, subscribers=5, baseline=2000, seed=13):
+    """Push review notifications through the dispatcher on a scratch database.
+
+    Deliveries are counted instead of logged. ``baseline`` reviews are also
+    sent the old way, one thread and one subscriber query per review, for
+    comparison.
+    """
+    import notifications
+    import redis_cache
+
+    previous_client = redis_cache.redis_client
+    redis_cache.redis_client = redis_cache.LocalRedis()
+    workdir, _ = _scratch_db("bench_notify_", durability="off")
+    try:
+        users = max(subscribers * 10, 100)
+        _seed(users, media)
+        rng = random.Random(seed)
+        with db.db_connection() as conn:
+            conn.executemany("INSERT OR IGNORE INTO subscriptions (user_id, media_id) VALUES (?, ?)",
+                             [(rng.randrange(users) + 1, m + 1) for m in range(media) for _ in range(subscribers)])
+        # Popular media get most reviews
+        events = [(min(media, int(rng.paretovariate(1.0))), f"review {i}") for i in range(reviews)]
+
+        delivered = [0]
+        lock = threading.Lock()
+
+        def count(name, media_id, details):
+            with lock:
+                delivered[0] += 1
+
+        dispatcher = notifications.NotificationDispatcher(sink=count).start()
+        peak_threads = threading.active_count()
+        started = time.perf_counter()
+        for media_id, details in events:
+            dispatcher.submit(media_id, details)
+            peak_threads = max(peak_threads, threading.active_count())
+        dispatcher.close()
+        seconds = time.perf_counter() - started
+        metrics = dispatcher.metrics()
+
+        started = time.perf_counter()
+        baseline_peak = threading.active_count()
+        threads = []
+        for media_id, details in events[:baseline]:
+            thread = threading.Thread(target=notifications._fan_out_sqlite, args=({media_id: [details]}, count))
+            thread.start()
+            threads.append(thread)
+            baseline_peak = max(baseline_peak, threading.active_count())
+        for thread in threads:
+            thread.join()
+        baseline_seconds = time.perf_counter() - started
+    finally:
+        redis_cache.redis_client = previous_client
+        _drop_scratch_db(workdir)
+
+    return {
+        "reviews": reviews, "seconds": seconds, "per_sec": reviews / seconds,
+        "fanouts": metrics["fanouts"], "notifications": metrics["notifications"],
+        "max_depth": metrics["max_depth"], "max_lag_ms": metrics["max_lag_ms"],
+        "blocked_seconds": metrics["blocked_seconds"], "peak_threads": peak_threads,
+        "baseline": baseline, "baseline_per_sec": baseline / baseline_seconds if baseline else 0.0,
+        "baseline_peak_threads": baseline_peak,
+    }
+
+
+def bench_stream_workers(reviews=20000, media=1000, subscribers=5, workers=(1, 2, 4, 8), delivery_ms=0.2, seed=13):
+    """Drain the same notification stream with growing numbers of consumers.
+
+    Runs against the in-process Redis stand-in; each delivered notification
+    sleeps ``delivery_ms`` to stand in for the mail or webhook call a real
+    sink makes, which is the work extra consumers spread out.
+    """
+    import notifications
+    import redis_cache
+
+    previous_client = redis_cache.redis_client
+    workdir, _ = _scratch_db("bench_stream_", durability="off")
+    results = []
+    try:
+        users = max(subscribers * 10, 100)
+        _seed(users, media)
+        rng = random.Random(seed)
+        with db.db_connection() as conn:
+            conn.executemany("INSERT OR IGNORE INTO subscriptions (user_id, media_id) VALUES (?, ?)",
+                             [(rng.randrange(users) + 1, m + 1) for m in range(media) for _ in range(subscribers)])
+        events = [(min(media, int(rng.paretovariate(1.0))), f"review {i}") for i in range(reviews)]
+
+        def deliver(name, media_id, details):
+            time.sleep(delivery_ms / 1000)
+
+        for count in workers:
+            client = redis_cache.redis_client = redis_cache.LocalRedis()
+            started = time.perf_counter()
+            for start in range(0, len(events), 1000):
+                notifications.publish(events[start:start + 1000], client)
+            publish_seconds = time.perf_counter() - started
+
+            consumers = [notifications.StreamWorker(f"bench-{i}", sink=deliver, client=client) for i in range(count)]
+            threads = [threading.Thread(target=consumer.run, kwargs={"drain": True}) for consumer in consumers]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            seconds = time.perf_counter() - started
+
+            metrics = [consumer.metrics() for consumer in consumers]
+            results.append({
+                "workers": count, "seconds": seconds, "per_sec": reviews / seconds,
+                "publish_per_sec": reviews / publish_seconds,
+                "acked": sum(m["acked"] for m in metrics),
+                "notifications": sum(m["notifications"] for m in metrics),
+                "pending": client.xpending(notifications.STREAM_KEY, notifications.GROUP)["pending"],
+            })
+    finally:
+        redis_cache.redis_client = previous_client
+        _drop_scratch_db(workdir)
+    return results
+
+
+def bench_fanout(subscribers=100000, reviews=10, budget=0.02):
+    """Fan out reviews of one media with ``subscribers`` subscribers three ways.
+
+    Compares the SQLite join per review with SSCANning the cached Redis set
+    (on the in-process stand-in), and reports how long a worker is held per
+    call when each call is capped at ``budget`` seconds.
+    """
+    import notifications
+    import redis_cache
+    import subscribers as subscriber_index
+
+    previous_client = redis_cache.redis_client
+    redis_cache.redis_client = redis_cache.LocalRedis()
+    workdir, _ = _scratch_db("bench_fanout_", durability="off")
+    delivered = [0]
+
+    def count(name, media_id, details):
+        delivered[0] += 1
+
+    try:
+        _seed(subscribers, 1)
+        with db.db_connection() as conn:
+            conn.execute("INSERT INTO subscriptions (user_id, media_id) SELECT id, 1 FROM users")
+
+        sql_seconds = []
+        for i in range(reviews):
+            started = time.perf_counter()
+            notifications._fan_out_sqlite({1: [f"review {i}"]}, count)
+            sql_seconds.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        with db.db_connection() as conn:
+            subscriber_index.ensure_loaded(conn, [1])
+        load_seconds = time.perf_counter() - started
+
+        cached_seconds = []
+        for i in range(reviews):
+            started = time.perf_counter()
+            notifications.fan_out({1: [f"review {i}"]}, count, budget=None)
+            cached_seconds.append(time.perf_counter() - started)
+
+        slices = []
+        for i in range(reviews):
+            cursors = None
+            while True:
+                started = time.perf_counter()
+                _, cursors = notifications.fan_out({1: [f"review {i}"]}, count, budget=budget, cursors=cursors)
+                slices.append(time.perf_counter() - started)
+                if not cursors:
+                    break
+    finally:
+        redis_cache.redis_client = previous_client
+        _drop_scratch_db(workdir)
+
+    return {
+        "subscribers": subscribers, "reviews": reviews, "notifications": delivered[0],
+        "sql_ms": sum(sql_seconds) / reviews * 1000, "load_ms": load_seconds * 1000,
+        "cached_ms": sum(cached_seconds) / reviews * 1000,
+        "slices_per_review": len(slices) / reviews, "max_slice_ms": max(slices) * 1000,
+    }
+
+
+def bench_digest(reviews=100000, media=100, subscribers=20, window=3600, max_buffers=100000, overflow="flush", seed=19):
+    """Count the log entries the dispatcher would write for ``reviews``
+    reviews, per review and in digest mode, without touching the log."""
+    import notifications
+    import redis_cache
+
+    previous_client = redis_cache.redis_client
+    redis_cache.redis_client = redis_cache.LocalRedis()
+    workdir, _ = _scratch_db("bench_digest_", durability="off")
+    lock = threading.Lock()
+    entries = {"plain": 0, "digest": 0}
+
+    def plain(name, media_id, details):
+        with lock:
+            # The header line plus one per review
+            entries["plain"] += 1 + len(details)
+
+    def digest(name, media_id, summary):
+        entries["digest"] += 1
+
+    try:
+        users = max(subscribers * 10, 100)
+        _seed(users, media)
+        rng = random.Random(seed)
+        with db.db_connection() as conn:
+            conn.executemany("INSERT OR IGNORE INTO subscriptions (user_id, media_id) VALUES (?, ?)",
+                             [(rng.randrange(users) + 1, m + 1) for m in range(media) for _ in range(subscribers)])
+        events = []
+        for i in range(reviews):
+            media_id = rng.randrange(media) + 1
+            events.append((media_id, notifications.review_details(rng.randrange(users) + 1, media_id,
+                                                                  rng.randint(1, 5), f"review {i}")))
+
+        results = {}
+        for mode in ("plain", "digest"):
+            sink = plain if mode == "plain" else notifications.DigestSink(window, max_buffers, overflow, digest)
+            dispatcher = notifications.NotificationDispatcher(sink=sink).start()
+            started = time.perf_counter()
+            for media_id, details in events:
+                dispatcher.submit(media_id, details)
+            dispatcher.close()
+            if mode == "digest":
+                metrics = sink.metrics()
+                sink.close()
+            results[f"{mode}_seconds"] = time.perf_counter() - started
+    finally:
+        redis_cache.redis_client = previous_client
+        _drop_scratch_db(workdir)
+
+    return dict(results, reviews=reviews, plain_entries=entries["plain"], digest_entries=entries["digest"],
+                events=metrics["events"], early_flushes=metrics["early_flushes"], dropped=metrics["dropped"],
+                max_buffers=metrics["max_buffers"])
+
+
+def bench_logging(threads=8, records=20000, queue_size=None):
+    """Log ``records`` notification-sized lines from each of ``threads``
+    threads, through a plain FileHandler and through the queued writer.
+
+    Returns the wall time and the slowest thread's time per record for
+    each, plus the queued writer's counters.
+    """
+    import logging
+    import logger as log_setup
+
+    workdir = tempfile.mkdtemp(prefix="bench_logging_")
+    message = "Notification: User 'user42', a new review has been added for Media ID 1234."
+    bench_logger = logging.getLogger("bench_logging")
+    bench_logger.propagate = False
+    bench_logger.setLevel(logging.INFO)
+
+    def run(emit):
+        per_record = []
+
+        def worker():
+            started = time.perf_counter()
+            for _ in range(records):
+                emit(message)
+            per_record.append((time.perf_counter() - started) / records)
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        started = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return time.perf_counter() - started, max(per_record)
+
+    try:
+        handler = logging.FileHandler(os.path.join(workdir, "sync.log"))
+        handler.setFormatter(logging.Formatter(log_setup.TEXT_FORMAT))
+        bench_logger.addHandler(handler)
+        sync_seconds, sync_per_record = run(bench_logger.info)
+        bench_logger.removeHandler(handler)
+        handler.close()
+
+        queue_handler = log_setup.DroppingQueueHandler(queue.SimpleQueue(), queue_size or log_setup.QUEUE_SIZE)
+        file_handler = log_setup.BatchFileHandler(os.path.join(workdir, "queued.log"))
+        file_handler.setFormatter(logging.Formatter(log_setup.TEXT_FORMAT))
+        writer = log_setup.BatchLogWriter(queue_handler.queue, file_handler)
+        writer.start()
+        bench_logger.addHandler(queue_handler)
+        queued_seconds, queued_per_record = run(bench_logger.info)
+        started = time.perf_counter()
+        writer.stop()
+        drain_seconds = time.perf_counter() - started
+        bench_logger.removeHandler(queue_handler)
+        file_handler.close()
+    finally:
+        for name in os.listdir(workdir):
+            os.remove(os.path.join(workdir, name))
+        os.rmdir(workdir)
+
+    return {
+        "records": threads * records, "sync_seconds": sync_seconds, "sync_us": sync_per_record * 1e6,
+        "queued_seconds": queued_seconds, "queued_us": queued_per_record * 1e6, "drain_seconds": drain_seconds,
+        "written": writer.written, "batches": writer.batches, "dropped": queue_handler.dropped,
+    }
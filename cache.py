@@ -0,0 +1,477 @@
+import json
+import logging
+import math
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from logger import logger
+import cache_codec
+from redis_cache import get_binary_redis as get_redis, Script
+
+# Generation counters. Every cached query key embeds the current generation of
+# each scope it depends on; bumping a generation makes all of those keys
+# unreachable at once, so invalidation is O(1) and never scans keys. Orphaned
+# entries simply age out through their TTL.
+REVIEWS_SCOPE = "reviews"
+USERS_SCOPE = "users"
+MEDIA_SCOPE = "media"
+DEFAULT_TTL = 3600
+
+# Bumped generations are broadcast here so every process can drop its local copy
+INVALIDATION_CHANNEL = "cache:invalidate"
+
+LOCAL_MAX_BYTES = 64 * 1024 * 1024
+LOCAL_MAX_ITEMS = 10000
+LOCAL_TTL = 300
+# Safety net in case an invalidation message is lost
+LOCAL_GENERATION_TTL = 30
+
+# Stampede protection: soft expiry is jittered by +/-TTL_JITTER, entries stay
+# servable for STALE_TTL seconds past it while one caller rebuilds them.
+TTL_JITTER = 0.1
+STALE_TTL = 300
+EARLY_REFRESH_BETA = 1.0
+REBUILD_LOCK_MS = 10000
+
+_MISSING = object()
+
+
+def media_scope(media_id):
+    return f"media:{media_id}"
+
+
+def user_scope(user_id):
+    return f"user:{user_id}"
+
+
+def _generation_key(scope):
+    return f"gen:{scope}"
+
+
+class LocalTier:
+    """Size-bounded in-process LRU with per-entry TTL."""
+
+    def __init__(self, max_bytes=LOCAL_MAX_BYTES, max_items=LOCAL_MAX_ITEMS):
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        self._entries = OrderedDict()  # key -> (value, size, expires_at)
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[2] <= time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return _MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, size, ttl):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, time.monotonic() + ttl)
+            self.bytes += size
+            while self.bytes > self.max_bytes or len(self._entries) > self.max_items:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.bytes -= size
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+                "evictions": self.evictions,
+                "bytes": self.bytes,
+                "items": len(self._entries),
+            }
+
+
+local_tier = LocalTier()
+redis_stats = {"hits": 0, "misses": 0, "bytes": 0}
+rebuild_stats = {"rebuilds": 0, "deduplicated": 0, "lock_waits": 0, "stale_served": 0, "fenced_out": 0}
+
+# In-flight rebuilds in this process, keyed by cache key
+_flights_lock = threading.Lock()
+_flights = {}
+
+_listener_lock = threading.Lock()
+_listener_client = None
+_listener_ready = threading.Event()
+# Named so its reconnect chatter can be filtered separately
+listener_log = logging.getLogger("cache.listener")
+
+# Bumped on every local invalidation so a reader that fetched a generation
+# just before a bump does not store the old value after the drop.
+_generation_lock = threading.Lock()
+_generation_epoch = 0
+
+
+def _drop_local_generations(scopes):
+    global _generation_epoch
+    with _generation_lock:
+        _generation_epoch += 1
+        for scope in scopes:
+            local_tier.delete(_generation_key(scope))
+
+
+def _clear_local():
+    global _generation_epoch
+    with _generation_lock:
+        _generation_epoch += 1
+        local_tier.clear()
+
+
+def _listen(client):
+    """Drop local generations whenever any process bumps them."""
+    backoff = 1
+    failing = False
+    while _listener_client is client:
+        try:
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(INVALIDATION_CHANNEL)
+            # Anything cached before we were subscribed may have missed a bump
+            _clear_local()
+            _listener_ready.set()
+            backoff = 1
+            if failing:
+                listener_log.info("Cache invalidation listener reconnected")
+                failing = False
+            for message in pubsub.listen():
+                if _listener_client is not client:
+                    break
+                if message.get("type") == "message":
+                    _drop_local_generations(json.loads(message["data"]))
+        except Exception as e:
+            # Once per outage; the retries themselves only at debug level
+            if failing:
+                listener_log.debug(f"Cache invalidation listener still failing: {e}")
+            else:
+                listener_log.warning(f"Cache invalidation listener error, retrying: {e}")
+                failing = True
+        _listener_ready.clear()
+        _clear_local()
+        time.sleep(backoff)
+        backoff = min(backoff * 2, 30)
+
+
+def _ensure_listener():
+    """Start (or restart for a new client) the invalidation subscriber."""
+    global _listener_client
+    client = get_redis()
+    if _listener_client is client:
+        return
+    with _listener_lock:
+        if _listener_client is client:
+            return
+        _listener_ready.clear()
+        _clear_local()
+        _listener_client = client
+        threading.Thread(target=_listen, args=(client,), name="cache-invalidation", daemon=True).start()
+
+
+def get_generations(scopes):
+    """Return the current generation of each scope (0 if never bumped)."""
+    _ensure_listener()
+    # Generations are only trusted locally while we are subscribed to bumps
+    use_local = _listener_ready.is_set()
+
+    generations = {}
+    if use_local:
+        for scope in scopes:
+            value = local_tier.get(_generation_key(scope))
+            if value is not _MISSING:
+                generations[scope] = value
+
+    missing = [scope for scope in scopes if scope not in generations]
+    if missing:
+        epoch = _generation_epoch
+        values = get_redis().mget([_generation_key(scope) for scope in missing])
+        for scope, value in zip(missing, values):
+            generations[scope] = int(value or 0)
+
+        with _generation_lock:
+            if use_local and epoch == _generation_epoch:
+                for scope in missing:
+                    local_tier.set(_generation_key(scope), generations[scope], 16, LOCAL_GENERATION_TTL)
+
+    return [generations[scope] for scope in scopes]
+
+
+def query_key(query, scopes):
+    """Build the versioned cache key for ``query`` depending on ``scopes``."""
+    generations = get_generations(scopes)
+    versions = ":".join(f"{scope}@{generation}" for scope, generation in zip(scopes, generations))
+    return f"cache:{query}:{versions}"
+
+
+def _read_envelope(key):
+    """Return (envelope, tier) for ``key`` from the nearest tier ("local" or
+    "redis"), or (None, None)."""
+    envelope = local_tier.get(key)
+    if envelope is not _MISSING:
+        return envelope, "local"
+
+    envelope = _read_from_redis(get_redis(), key)
+    if envelope is None:
+        redis_stats["misses"] += 1
+        return None, None
+
+    redis_stats["hits"] += 1
+    redis_stats["bytes"] += envelope["size"]
+    _store_local(key, envelope)
+    return envelope, "redis"
+
+
+def _read_from_redis(client, key):
+    frame = client.get(key)
+    if frame is None:
+        return None
+
+    envelope, body = cache_codec.decode_frame(frame)
+    size = len(frame)
+    if envelope["flags"] & cache_codec.FLAG_CHUNKED:
+        chunks = client.mget(cache_codec.chunk_keys(key, body))
+        if any(chunk is None for chunk in chunks):
+            return None  # a chunk expired or was evicted; treat as a miss
+        body = b"".join(chunks)
+        size += len(body)
+
+    envelope["value"] = cache_codec.decode_value(envelope, body)
+    envelope["size"] = size
+    return envelope
+
+
+def _store_local(key, envelope):
+    remaining = envelope["hard"] - time.time()
+    if remaining > 0:
+        local_tier.set(key, envelope, envelope["size"], min(remaining, LOCAL_TTL))
+
+
+def _needs_refresh(envelope, now):
+    """Soft-expired, or picked for probabilistic early refresh (XFetch)."""
+    if now >= envelope["soft"]:
+        return True
+    # The closer to expiry and the slower the rebuild, the likelier we refresh early
+    return now - envelope["delta"] * EARLY_REFRESH_BETA * math.log(1.0 - random.random()) >= envelope["soft"]
+
+
+def cached_query(query, scopes, builder, ttl=DEFAULT_TTL, codec=cache_codec.JSON):
+    """Return (value, tier) for ``query``, building and caching it on a miss.
+
+    ``tier`` is the cache tier that answered, "local" or "redis", or None
+    when ``builder`` ran.
+
+    Lookups go local tier -> Redis -> ``builder``. Versioned keys never change
+    meaning, so a local copy is valid until its generation moves. The key is
+    resolved before ``builder`` runs, so a result computed while a write
+    commits is stored under the old generation and never served.
+
+    Entries carry a jittered soft expiry. Past it (or a little before, at
+    random) the old value is still served while one background rebuild runs.
+    A cold key blocks its callers on a single rebuild across threads and
+    processes.
+
+    ``codec`` picks the wire format; large payloads are compressed and
+    split across several keys (see cache_codec).
+    """
+    key = query_key(query, scopes)
+
+    envelope, tier = _read_envelope(key)
+    if envelope is not None:
+        if _needs_refresh(envelope, time.time()):
+            rebuild_stats["stale_served"] += 1
+            _refresh_in_background(key, builder, ttl, codec)
+        return envelope["value"], tier
+
+    return _single_flight(key, builder, ttl, codec), None
+
+
+def _single_flight(key, builder, ttl, codec):
+    """Run at most one rebuild of ``key`` per process; other callers wait for it."""
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = Future()
+
+    if not leader:
+        rebuild_stats["deduplicated"] += 1
+        return flight.result()
+
+    try:
+        value = _rebuild(key, builder, ttl, codec)
+        flight.set_result(value)
+        return value
+    except BaseException as e:
+        flight.set_exception(e)
+        raise
+    finally:
+        with _flights_lock:
+            _flights.pop(key, None)
+
+
+def _refresh_in_background(key, builder, ttl, codec):
+    with _flights_lock:
+        if key in _flights:
+            return
+    threading.Thread(target=_background_rebuild, args=(key, builder, ttl, codec), daemon=True).start()
+
+
+def _background_rebuild(key, builder, ttl, codec):
+    try:
+        _single_flight(key, builder, ttl, codec)
+    except Exception as e:
+        logger.error(f"Background cache rebuild of {key} failed: {e}")
+
+
+def _rebuild(key, builder, ttl, codec):
+    """Rebuild ``key`` under a Redis lock so only one process hits the database."""
+    client = get_redis()
+    lock_key, fence_key = f"lock:{key}", f"fence:{key}"
+
+    # Fencing token: if our lock expires mid-build and someone else takes
+    # over, their higher token wins and our late write is refused.
+    token = client.incr(fence_key)
+    client.expire(fence_key, ttl + STALE_TTL)
+    if not client.set(lock_key, token, nx=True, px=REBUILD_LOCK_MS):
+        rebuild_stats["lock_waits"] += 1
+        value = _wait_for_rebuild(client, key)
+        if value is not _MISSING:
+            return value
+        # The lock holder died or is very slow; serve fresh data uncached
+        return builder()
+
+    try:
+        started = time.time()
+        value = builder()
+        rebuild_stats["rebuilds"] += 1
+        now = time.time()
+
+        soft_ttl = ttl * random.uniform(1 - TTL_JITTER, 1 + TTL_JITTER)
+        hard_ttl = int(soft_ttl + STALE_TTL)
+        envelope = {"value": value, "soft": now + soft_ttl, "hard": now + hard_ttl, "delta": now - started}
+        frame, _ = cache_codec.encode_frame(value, codec, envelope["soft"], envelope["hard"], envelope["delta"])
+
+        # Chunks are named after our token, so a fenced-out writer's chunks
+        # never mix with the winner's; they just expire.
+        manifest, chunks = cache_codec.split_frame(frame, token)
+        if chunks:
+            pipe = client.pipeline()
+            for chunk_key, chunk in zip(cache_codec.chunk_keys(key, manifest[cache_codec.FRAME_HEADER.size:]), chunks):
+                pipe.setex(chunk_key, hard_ttl, chunk)
+            pipe.execute()
+
+        envelope["size"] = len(frame)
+        if _store_if_fenced(keys=[key, lock_key], args=[token, manifest, hard_ttl], client=client):
+            _store_local(key, envelope)
+        else:
+            rebuild_stats["fenced_out"] += 1
+        return value
+    finally:
+        _release_lock(keys=[lock_key], args=[token], client=client)
+
+
+def _wait_for_rebuild(client, key):
+    deadline = time.monotonic() + REBUILD_LOCK_MS / 1000
+    delay = 0.01
+    while time.monotonic() < deadline:
+        time.sleep(delay)
+        envelope = _read_from_redis(client, key)
+        if envelope is not None:
+            _store_local(key, envelope)
+            return envelope["value"]
+        delay = min(delay * 2, 0.2)
+    return _MISSING
+
+
+def _store_if_fenced_local(client, keys, args):
+    key, lock_key = keys
+    token, payload, ttl = args
+    if client.get(lock_key) != token:
+        return 0
+    client.setex(key, int(ttl), payload)
+    return 1
+
+
+def _release_lock_local(client, keys, args):
+    if client.get(keys[0]) == args[0]:
+        return client.delete(keys[0])
+    return 0
+
+
+_store_if_fenced = Script("""
+if redis.call('GET', KEYS[2]) ~= ARGV[1] then return 0 end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+return 1
+""", _store_if_fenced_local)
+
+_release_lock = Script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+""", _release_lock_local)
+
+
+def invalidate_scopes(scopes):
+    """Bump the given generations and tell every process to drop its copy."""
+    scopes = sorted(set(scopes))
+
+    pipe = get_redis().pipeline()
+    for scope in scopes:
+        pipe.incr(_generation_key(scope))
+    pipe.publish(INVALIDATION_CHANNEL, json.dumps(scopes))
+    pipe.execute()
+
+    # Our own listener will also get the message; drop now for read-your-writes
+    _drop_local_generations(scopes)
+
+
+def invalidate_reviews(pairs):
+    """Bump the generations touched by new reviews, given (user_id, media_id) pairs."""
+    scopes = {REVIEWS_SCOPE}
+    for user_id, media_id in pairs:
+        scopes.add(user_scope(user_id))
+        scopes.add(media_scope(media_id))
+    invalidate_scopes(scopes)
+
+
+def invalidate_review(user_id, media_id):
+    """Invalidate every cached query a single new review can affect."""
+    invalidate_reviews([(user_id, media_id)])
+
+
+def get_cache_stats():
+    """Return hit/miss/byte/eviction counters for each cache tier."""
+    total = redis_stats["hits"] + redis_stats["misses"]
+    return {
+        "local": local_tier.stats(),
+        "redis": {**redis_stats, "hit_ratio": redis_stats["hits"] / total if total else 0.0},
+        "rebuild": dict(rebuild_stats),
+    }
@@ -0,0 +1,182 @@
+import json
+import struct
+import zlib
+from array import array
+from itertools import accumulate
+from operator import itemgetter
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:  # optional, zlib is always available
+    lz4_frame = None
+
+# Frame layout: magic, codec id, flags, soft expiry, hard expiry, rebuild time
+FRAME_HEADER = struct.Struct("<2sBBddd")
+FRAME_MAGIC = b"MC"
+FLAG_ZLIB = 1
+FLAG_LZ4 = 2
+FLAG_CHUNKED = 4
+
+# Manifest body of a chunked frame: chunk count and the writer's token
+CHUNK_MANIFEST = struct.Struct("<IQ")
+
+COMPRESS_THRESHOLD = 4096
+CHUNK_SIZE = 512 * 1024
+
+_SEPARATOR = "\x00"
+
+
+class JsonCodec:
+    """Any JSON-serialisable value."""
+    codec_id = 0
+
+    def encode(self, value):
+        return json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+    def decode(self, data):
+        return json.loads(data)
+
+
+def _pack_strings(strings):
+    """Pack strings as one UTF-8 blob, split by NUL or (if any contain NUL) by lengths."""
+    text = _SEPARATOR.join(strings)
+    if text.count(_SEPARATOR) == max(len(strings) - 1, 0):
+        return b"\x00" + text.encode("utf-8")
+    lengths = array("I", (len(s) for s in strings))
+    return b"\x01" + struct.pack("<I", len(lengths)) + lengths.tobytes() + text.encode("utf-8")
+
+
+def _unpack_strings(data, count):
+    mode, data = data[0], data[1:]
+    if mode == 0:
+        return data.decode("utf-8").split(_SEPARATOR) if count else []
+
+    (n,) = struct.unpack_from("<I", data)
+    lengths = array("I")
+    lengths.frombytes(data[4:4 + 4 * n])
+    text = data[4 + 4 * n:].decode("utf-8")
+    # Lengths were recorded without separators; skip one between strings
+    ends = list(accumulate(length + 1 for length in lengths))
+    return [text[end - length - 1:end - 1] for end, length in zip(ends, lengths)]
+
+
+class ReviewRowsCodec:
+    """Columnar binary format for (user, media, rating, comment) rows.
+
+    User names and media titles repeat heavily, so each distinct string is
+    stored once and rows refer to it by index. Columns are packed with
+    ``array`` so encoding and decoding run mostly in C.
+    """
+    codec_id = 1
+    _header = struct.Struct("<III")  # rows, distinct names, section-1 length
+
+    def encode(self, rows):
+        users, media, ratings, comments = (list(map(itemgetter(i), rows)) for i in range(4))
+
+        names = dict.fromkeys(users)
+        names.update(dict.fromkeys(media))
+        index = {name: i for i, name in enumerate(names)}
+        packed_names = _pack_strings(list(index))
+
+        if None in ratings:
+            ratings = [-1 if rating is None else rating for rating in ratings]
+        has_comment = bytes(comment is not None for comment in comments) if None in comments else b"\x01" * len(rows)
+        if None in comments:
+            comments = [comment or "" for comment in comments]
+
+        return b"".join([
+            self._header.pack(len(rows), len(index), len(packed_names)),
+            packed_names,
+            array("I", map(index.__getitem__, users)).tobytes(),
+            array("I", map(index.__getitem__, media)).tobytes(),
+            array("b", ratings).tobytes(),
+            has_comment,
+            _pack_strings(comments),
+        ])
+
+    def decode(self, data):
+        count, name_count, names_length = self._header.unpack_from(data)
+        offset = self._header.size
+        names = _unpack_strings(data[offset:offset + names_length], name_count)
+        offset += names_length
+
+        columns = []
+        for _ in range(2):
+            refs = array("I")
+            refs.frombytes(data[offset:offset + 4 * count])
+            offset += 4 * count
+            columns.append(list(map(names.__getitem__, refs)))
+
+        ratings = array("b")
+        ratings.frombytes(data[offset:offset + count])
+        offset += count
+        has_comment = data[offset:offset + count]
+        offset += count
+        comments = _unpack_strings(data[offset:], count)
+
+        if 0 in has_comment:
+            comments = [c if present else None for c, present in zip(comments, has_comment)]
+        rating_column = [r if r >= 0 else None for r in ratings] if -1 in ratings else ratings.tolist()
+        return list(zip(columns[0], columns[1], rating_column, comments))
+
+
+JSON = JsonCodec()
+REVIEW_ROWS = ReviewRowsCodec()
+CODECS = {codec.codec_id: codec for codec in (JSON, REVIEW_ROWS)}
+
+
+def _compress(body, threshold):
+    if len(body) < threshold:
+        return body, 0
+    if lz4_frame is not None:
+        return lz4_frame.compress(body), FLAG_LZ4
+    return zlib.compress(body, 1), FLAG_ZLIB
+
+
+def _decompress(body, flags):
+    if flags & FLAG_LZ4:
+        if lz4_frame is None:
+            raise ValueError("cached value is lz4-compressed but lz4 is not installed")
+        return lz4_frame.decompress(body)
+    if flags & FLAG_ZLIB:
+        return zlib.decompress(body)
+    return body
+
+
+def encode_frame(value, codec, soft, hard, delta, threshold=COMPRESS_THRESHOLD):
+    """Serialize a cache envelope. Returns (frame bytes, flags)."""
+    body, flags = _compress(codec.encode(value), threshold)
+    return FRAME_HEADER.pack(FRAME_MAGIC, codec.codec_id, flags, soft, hard, delta) + body, flags
+
+
+def decode_frame(frame):
+    """Return (envelope dict, body) with the body still encoded/compressed."""
+    magic, codec_id, flags, soft, hard, delta = FRAME_HEADER.unpack_from(frame)
+    if magic != FRAME_MAGIC:
+        raise ValueError("not a cache frame")
+    envelope = {"codec": codec_id, "flags": flags, "soft": soft, "hard": hard, "delta": delta}
+    return envelope, frame[FRAME_HEADER.size:]
+
+
+def decode_value(envelope, body):
+    return CODECS[envelope["codec"]].decode(_decompress(body, envelope["flags"]))
+
+
+def split_frame(frame, token, chunk_size=CHUNK_SIZE):
+    """Split a large frame into a small manifest frame plus body chunks.
+
+    Returns (manifest, chunks). Frames under ``chunk_size`` come back as-is
+    with no chunks.
+    """
+    if len(frame) <= chunk_size:
+        return frame, []
+    magic, codec_id, flags, soft, hard, delta = FRAME_HEADER.unpack_from(frame)
+    body = frame[FRAME_HEADER.size:]
+    chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)]
+    manifest = FRAME_HEADER.pack(magic, codec_id, flags | FLAG_CHUNKED, soft, hard, delta)
+    return manifest + CHUNK_MANIFEST.pack(len(chunks), token), chunks
+
+
+def chunk_keys(key, manifest_body):
+    count, token = CHUNK_MANIFEST.unpack_from(manifest_body)
+    return [f"{key}#{token}:{i}" for i in range(count)]
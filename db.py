@@ -1,100 +1,251 @@
 import sqlite3
-import redis
-import json
-from redis_cache import redis_client
+from db_pool import ConnectionPool
+from lazy import lazy_import
+from migrations import (apply_migrations, explain_queries, MEDIA_STATS_COLUMNS, MEDIA_STATS_SELECT, MEDIA_STATS_CHECKED,
+                        REBUILD_MEDIA_STATS_SQL, REFRESH_SCORES_SQL)
 
-def get_db_connection():
-    try:
-        return sqlite3.connect("media_reviews.db")
-    except sqlite3.Error as e:
-        print(f"Database connection error: {e}")
-        return None
+redis = lazy_import("redis")
+# The cache (and the Redis client and logging behind it) loads on first use,
+# so commands that only touch SQLite never import it
+cache = lazy_import("cache")
+cache_codec = lazy_import("cache_codec")
 
-def initialize_db():
-    conn = get_db_connection()
-    if conn is None:
-        return
+DB_PATH = "media_reviews.db"
+DEFAULT_POOL_SIZE = 5
+
+# PRAGMA profiles applied to every pooled connection. "legacy" is SQLite's
+# stock rollback journal and is kept for comparison benchmarks.
+DURABILITY_PROFILES = {
+    "full": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "busy_timeout": 5000,
+        "cache_size": -64000,  # negative means KiB, i.e. 64 MB
+        "mmap_size": 268435456,
+        "temp_store": "MEMORY",
+    },
+    "normal": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "cache_size": -64000,
+        "mmap_size": 268435456,
+        "temp_store": "MEMORY",
+    },
+    "off": {
+        "journal_mode": "WAL",
+        "synchronous": "OFF",
+        "busy_timeout": 5000,
+        "cache_size": -64000,
+        "mmap_size": 268435456,
+        "temp_store": "MEMORY",
+    },
+    "legacy": {
+        "journal_mode": "DELETE",
+        "synchronous": "FULL",
+        "busy_timeout": 5000,
+    },
+}
+DEFAULT_DURABILITY = "normal"
+
+pool = ConnectionPool(DB_PATH, size=DEFAULT_POOL_SIZE, pragmas=DURABILITY_PROFILES[DEFAULT_DURABILITY])
+
+def configure_pool(size=DEFAULT_POOL_SIZE, database=DB_PATH, durability=DEFAULT_DURABILITY):
+    """Replace the shared connection pool (e.g. to change its size or durability)."""
+    global pool
+    if durability not in DURABILITY_PROFILES:
+        raise ValueError(f"Unknown durability level '{durability}'")
+    pool.close()
+    pool = ConnectionPool(database, size=size, pragmas=DURABILITY_PROFILES[durability])
+    return pool
+
+def db_connection():
+    """Context manager yielding a pooled connection that commits or rolls back."""
+    return pool.connection()
 
+def get_pool_stats():
+    """Return hit/miss counters of the shared connection pool."""
+    return pool.stats()
+
+def check_pool_health():
+    """Ping idle pooled connections and drop broken ones."""
+    return pool.health_check()
+
+def initialize_db():
     try:
-        cursor = conn.cursor()
+        with db_connection() as conn:
+            cursor = conn.cursor()
         
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT UNIQUE NOT NULL
-            )
-        """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS users (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT UNIQUE NOT NULL
+                )
+            """)
         
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS media (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT NOT NULL,
-                type TEXT NOT NULL CHECK(type IN ('Movie', 'WebShow', 'Song'))
-            )
-        """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS media (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    title TEXT NOT NULL,
+                    type TEXT NOT NULL CHECK(type IN ('Movie', 'WebShow', 'Song'))
+                )
+            """)
 
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS reviews (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                media_id INTEGER NOT NULL,
-                rating INTEGER CHECK(rating BETWEEN 1 AND 5),
-                comment TEXT,
-                FOREIGN KEY (user_id) REFERENCES users(id),
-                FOREIGN KEY (media_id) REFERENCES media(id)
-            )
-        """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS reviews (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    media_id INTEGER NOT NULL,
+                    rating INTEGER CHECK(rating BETWEEN 1 AND 5),
+                    comment TEXT,
+                    FOREIGN KEY (user_id) REFERENCES users(id),
+                    FOREIGN KEY (media_id) REFERENCES media(id)
+                )
+            """)
 
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS subscriptions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                media_id INTEGER,
-                FOREIGN KEY (user_id) REFERENCES users(id),
-                FOREIGN KEY (media_id) REFERENCES media(id),
-                UNIQUE(user_id, media_id) -- Prevent duplicate subscriptions
-            )
-        """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS subscriptions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER,
+                    media_id INTEGER,
+                    FOREIGN KEY (user_id) REFERENCES users(id),
+                    FOREIGN KEY (media_id) REFERENCES media(id),
+                    UNIQUE(user_id, media_id) -- Prevent duplicate subscriptions
+                )
+            """)
+
+        return migrate_db()
 
-        
-        conn.commit()
-        
     except sqlite3.Error as e:
         print(f"Database initialization error: {e}")
-    finally:
-        conn.close()
+
+def migrate_db():
+    """Bring the schema up to the latest version. Returns the applied migrations."""
+    with db_connection() as conn:
+        return apply_migrations(conn)
+
+def get_query_plans():
+    """Report which indexes the query planner picks for the hot queries."""
+    with db_connection() as conn:
+        return explain_queries(conn)
+
+def rebuild_media_stats():
+    """Recompute media_stats from reviews. Returns (media rows, rows that had drifted)."""
+    with db_connection() as conn:
+        drifted = conn.execute(f"""
+            WITH expected ({MEDIA_STATS_COLUMNS}) AS ({MEDIA_STATS_SELECT})
+            SELECT COUNT(DISTINCT media_id) FROM (
+                SELECT media_id FROM (SELECT {MEDIA_STATS_CHECKED} FROM expected
+                                      EXCEPT SELECT {MEDIA_STATS_CHECKED} FROM media_stats)
+                UNION ALL
+                SELECT media_id FROM (SELECT {MEDIA_STATS_CHECKED} FROM media_stats
+                                      EXCEPT SELECT {MEDIA_STATS_CHECKED} FROM expected)
+            )
+        """).fetchone()[0]
+        conn.execute("DELETE FROM media_stats")
+        conn.execute(REBUILD_MEDIA_STATS_SQL)
+        # Inserted rows don't fire the score trigger
+        conn.execute(REFRESH_SCORES_SQL)
+        total = conn.execute("SELECT COUNT(*) FROM media_stats").fetchone()[0]
+    return total, drifted
+
+def fetch_reviews_from_db(media_id=None, user_id=None):
+    """Fetch reviews from SQLite, optionally only for one media and/or user"""
+    conditions, params = [], []
+    if media_id is not None:
+        conditions.append("reviews.media_id = ?")
+        params.append(media_id)
+    if user_id is not None:
+        conditions.append("reviews.user_id = ?")
+        params.append(user_id)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    with db_connection() as conn:
+        cursor = conn.cursor()
         
-def fetch_reviews_from_db():
-    """Fetch reviews from SQLite"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT users.name, media.title, reviews.rating, reviews.comment 
-        FROM reviews 
-        JOIN users ON reviews.user_id = users.id 
-        JOIN media ON reviews.media_id = media.id
-    """)
-    
-    reviews = cursor.fetchall()  # List of tuples [(user, media, rating, comment), ...]
-    conn.close()
+        cursor.execute(f"""
+            SELECT users.name, media.title, reviews.rating, reviews.comment 
+            FROM reviews 
+            JOIN users ON reviews.user_id = users.id 
+            JOIN media ON reviews.media_id = media.id
+            {where}
+        """, params)
+        
+        reviews = cursor.fetchall()  # List of tuples [(user, media, rating, comment), ...]
     
     return reviews
-def get_reviews():
+
+def iter_review_pages(after_id=0, limit=None, page_size=500):
+    """Yield pages of (id, user, media, rating, comment) rows in reviews.id order.
+
+    Keyset pagination: rows come from ``reviews.id > after_id``, so a
+    listing can be continued from the last ID it printed. Rows are pulled
+    with ``fetchmany`` and never materialized all at once.
+    """
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT reviews.id, users.name, media.title, reviews.rating, reviews.comment
+            FROM reviews
+            JOIN users ON reviews.user_id = users.id
+            JOIN media ON reviews.media_id = media.id
+            WHERE reviews.id > ?
+            ORDER BY reviews.id
+            LIMIT ?
+        """, (after_id, -1 if limit is None else limit))
+
+        while True:
+            page = cursor.fetchmany(page_size)
+            if not page:
+                break
+            yield page
+
+def get_reviews(media_id=None, user_id=None):
     """Get reviews from Redis if available, otherwise fetch from DB and cache it"""
-    cache_key = "reviews"
-    
-    # Check if data exists in Redis
-    cached_reviews = redis_client.get(cache_key)
-    
-    if cached_reviews:
-        print("Fetching reviews from Redis cache...")
-        return json.loads(cached_reviews)
-    
-    print("Fetching reviews from Database...")
-    reviews = fetch_reviews_from_db()
-    
+    # Each query is keyed by the generations of the scopes it reads, so a new
+    # review invalidates it without touching unrelated media/users.
+    if media_id is None and user_id is None:
+        query, scopes = "reviews:all", [cache.REVIEWS_SCOPE]
+    else:
+        query, scopes = f"reviews:media={media_id}:user={user_id}", []
+        if media_id is not None:
+            scopes.append(cache.media_scope(media_id))
+        if user_id is not None:
+            scopes.append(cache.user_scope(user_id))
+
     # Store in Redis with an expiry of 1 hour 
-    redis_client.setex(cache_key, 3600, json.dumps(reviews))
-    
-    return reviews
\ No newline at end of file
+    reviews, tier = cache.cached_query(query, scopes, lambda: fetch_reviews_from_db(media_id, user_id), ttl=3600,
+                                 codec=cache_codec.REVIEW_ROWS)
+
+    if tier == "local":
+        print("Fetching reviews from the in-process cache...")
+    elif tier == "redis":
+        print("Fetching reviews from Redis cache...")
+    else:
+        print("Fetching reviews from Database...")
+
+    return reviews
+
+def _fetch_id(sql, value):
+    with db_connection() as conn:
+        row = conn.execute(sql, (value,)).fetchone()
+    return row[0] if row else None
+
+def _find_id(query, scope, sql, value):
+    try:
+        found, _ = cache.cached_query(query, [scope], lambda: _fetch_id(sql, value))
+    except redis.RedisError:
+        # The cache is only a shortcut; without Redis ask SQLite directly
+        return _fetch_id(sql, value)
+    # Names are unique and never renamed, so a cached ID stays right; a cached
+    # miss may predate the insert, so misses are checked against SQLite and
+    # adding a user or media needs no invalidation
+    return found if found is not None else _fetch_id(sql, value)
+
+def find_user_id(name):
+    """Look up a user ID by exact name through the cache (None if missing)."""
+    return _find_id(f"user-id:{name}", cache.USERS_SCOPE, "SELECT id FROM users WHERE name = ?", name)
+
+def find_media_id(title):
+    """Look up a media ID by exact title through the cache (None if missing)."""
+    return _find_id(f"media-id:{title}", cache.MEDIA_SCOPE, "SELECT id FROM media WHERE title = ?", title)
@@ -0,0 +1,156 @@
+import math
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from queue import Queue, Empty, Full
+
+
+def register_functions(conn):
+    """Add the SQL functions the schema relies on to a connection.
+
+    pow() is only built in when SQLite was compiled with math functions,
+    which many Windows and older builds are not; the media_stats triggers
+    need it for the decay weights.
+    """
+    conn.create_function("pow", 2, math.pow, deterministic=True)
+
+
+class ConnectionPool:
+    """Thread-safe pool of SQLite connections.
+
+    Each thread holds at most one connection at a time; nested ``connection()``
+    blocks on the same thread reuse it and only the outermost block commits.
+    Idle connections are kept (up to ``size``) and handed to the next caller.
+    """
+
+    def __init__(self, database, size=5, ping_interval=30.0, pragmas=None):
+        self.database = database
+        self.size = size
+        self.pragmas = pragmas or {}
+        self.ping_interval = ping_interval
+        self._idle = Queue(maxsize=size)
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "discarded": 0, "reused": 0, "rollbacks": 0}
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def _connect(self):
+        # Connections move between threads through the idle queue, but only
+        # ever one thread uses a connection at a time.
+        conn = sqlite3.connect(self.database, check_same_thread=False)
+        register_functions(conn)
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def _is_healthy(self, conn):
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _checkout(self):
+        while True:
+            try:
+                conn, last_used = self._idle.get_nowait()
+            except Empty:
+                self._count("misses")
+                return self._connect()
+
+            # Ping connections that have been sitting idle for a while
+            if time.monotonic() - last_used > self.ping_interval and not self._is_healthy(conn):
+                self._count("discarded")
+                self._close_quietly(conn)
+                continue
+
+            self._count("hits")
+            return conn
+
+    def _checkin(self, conn):
+        try:
+            self._idle.put_nowait((conn, time.monotonic()))
+        except Full:
+            self._close_quietly(conn)
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    @contextmanager
+    def connection(self):
+        """Yield a connection; commit on success, roll back on error."""
+        held = getattr(self._local, "conn", None)
+        if held is not None:
+            # Nested use on the same thread shares the outer transaction
+            self._count("reused")
+            yield held
+            return
+
+        conn = self._checkout()
+        self._local.conn = conn
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            self._count("rollbacks")
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                # A broken connection must not go back into the pool
+                self._local.conn = None
+                self._count("discarded")
+                self._close_quietly(conn)
+                raise
+            raise
+        finally:
+            if self._local.conn is conn:
+                self._local.conn = None
+                self._checkin(conn)
+
+    def health_check(self):
+        """Ping every idle connection, dropping broken ones. Returns a summary."""
+        healthy = broken = 0
+        checked = []
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except Empty:
+                break
+            if self._is_healthy(conn):
+                healthy += 1
+                checked.append(conn)
+            else:
+                broken += 1
+                self._count("discarded")
+                self._close_quietly(conn)
+
+        for conn in checked:
+            self._checkin(conn)
+
+        return {"healthy": healthy, "broken": broken, "idle": self._idle.qsize()}
+
+    def stats(self):
+        """Return hit/miss counters plus the current idle count."""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["idle"] = self._idle.qsize()
+        stats["size"] = self.size
+        total = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / total if total else 0.0
+        return stats
+
+    def close(self):
+        """Close all idle connections."""
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except Empty:
+                break
+            self._close_quietly(conn)
@@ -0,0 +1,39 @@
+"""Defaults shared by main.py's options and the modules they configure.
+
+This module imports nothing, so the CLI can build and validate its options
+without loading the modules behind them; those modules import their
+defaults from here so the two cannot drift apart.
+"""
+
+# logger: notifications.log formats and rotation (0 disables either limit)
+LOG_FORMATS = ("text", "json")
+MAX_BYTES = 50 * 1024 * 1024
+ROTATE_SECONDS = 24 * 3600
+
+# ranking: top-rated modes
+RANKING_MODES = ("average", "bayesian", "wilson", "decayed")
+
+# notifications: queue (the default) uses the in-process dispatcher only;
+# stream is durable, through Redis, and delivered once a notify-worker
+# consumes it
+DELIVERY_MODES = ("stream", "queue")
+# Digest mode: (subscriber, media) buffers held at once; each is a few counters
+DIGEST_MAX_BUFFERS = 100000
+# When buffers are full, a new (subscriber, media) either flushes the
+# oldest buffer early or has its event dropped
+OVERFLOW_POLICIES = ("flush", "drop")
+# Entries per XREADGROUP
+STREAM_BATCH = 500
+# Milliseconds an XREADGROUP waits for new entries
+BLOCK_MS = 1000
+# Entries pending this long (their consumer died or failed) are reclaimed
+CLAIM_IDLE_MS = 60000
+
+# als: latent factors, sweeps and the ridge penalty per rating
+# (weighted-lambda), so heavy raters aren't over-regularized
+ALS_FACTORS = 32
+ALS_ITERATIONS = 10
+ALS_REGULARIZATION = 0.1
+
+# recommendation_cache: dirty users refreshed per worker transaction
+REFRESH_BATCH_SIZE = 500
@@ -0,0 +1,524 @@
+import heapq
+import os
+import re
+import struct
+import threading
+import unicodedata
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from operator import itemgetter
+
+# Snapshots live next to their database: media_reviews.db -> media_reviews.db.trigrams
+SNAPSHOT_SUFFIX = ".trigrams"
+SNAPSHOT_MAGIC = b"TGI4"
+# magic, titles, highest media id, title checksum, words, trigrams, word postings, trigram postings
+SNAPSHOT_HEADER = struct.Struct("<4sIQQIIII")
+
+# Rewrite the snapshot when opening it had to index this many new titles
+RESAVE_AFTER = 1000
+
+# Upper bound on trigram postings scanned per query word; rare trigrams go first
+POSTING_BUDGET = 5000
+# Vocabulary words checked with an exact edit distance per query word
+MAX_VERIFIED = 64
+# Titles taken from the rarest query word before checking the other words
+MAX_CANDIDATES = 500
+# Below this many candidates, other query words are checked on the titles themselves
+MAX_TITLE_CHECKS = 50
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def normalize(text):
+    """Lower-case words with diacritics removed, matching the FTS tokenizer."""
+    text = unicodedata.normalize("NFKD", text.casefold())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return _WORD_RE.findall(text)
+
+
+def word_trigrams(word):
+    """Distinct trigrams of a word padded with spaces (" da", "dar", "ark", "rk ")."""
+    padded = f" {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _gram_key(gram, length):
+    """Trigram postings are split by word length so lookups skip impossible lengths."""
+    return gram + chr(length)
+
+
+def max_edits(text):
+    """Typos tolerated across a whole query."""
+    return min(3, max(1, len(text) // 4))
+
+
+def word_edits(word):
+    """Typos tolerated within one word; very short words must match exactly."""
+    if len(word) <= 3:
+        return 0
+    return 1 if len(word) <= 7 else 2
+
+
+def _one_edit_apart(a, b):
+    """True when a and b differ by one insertion, deletion, substitution or swap."""
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    if len(a) < len(b):
+        return a[i:] == b[i + 1:]
+    return a[i + 1:] == b[i + 1:] or (a[i:i + 2] == b[i + 1::-1][:2] and a[i + 2:] == b[i + 2:])
+
+
+def _pattern_masks(word):
+    """Bit mask of the positions of each character, for ``_bit_distance``."""
+    masks = {}
+    for i, ch in enumerate(word):
+        masks[ch] = masks.get(ch, 0) | (1 << i)
+    return masks
+
+
+def _bit_distance(masks, length, other):
+    """Levenshtein distance via Myers' bit-parallel algorithm: one pass over ``other``."""
+    full = (1 << length) - 1
+    last = 1 << (length - 1)
+    pv, mv, score = full, 0, length
+    for ch in other:
+        eq = masks.get(ch, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & full)
+        mh = pv & xh
+        if ph & last:
+            score += 1
+        elif mh & last:
+            score -= 1
+        ph = ((ph << 1) | 1) & full
+        mh = (mh << 1) & full
+        pv = mh | (~(xv | ph) & full)
+        mv = ph & xv
+    return score
+
+
+def bounded_distance(a, b, limit, masks=None):
+    """Edit distance between a and b, or limit + 1 when it exceeds ``limit``.
+
+    With one typo allowed an adjacent swap counts as a single edit; beyond
+    that plain Levenshtein distance is used. ``masks`` may carry
+    ``_pattern_masks(a)`` when comparing one word against many.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    if a == b:
+        return 0
+    if limit == 0:
+        return 1
+    if limit == 1:
+        return 1 if _one_edit_apart(a, b) else 2
+    if not a or not b:
+        return max(len(a), len(b))
+    distance = _bit_distance(masks or _pattern_masks(a), len(a), b)
+    return distance if distance <= limit else limit + 1
+
+
+class PostingLists:
+    """Ascending integer posting lists keyed by word index or trigram.
+
+    Lists loaded from a snapshot live in one flat array (``spans`` maps a
+    key to its slice); values appended later go to small per-key arrays.
+    New values are always larger than loaded ones, so the two parts read
+    back in order and stay searchable with bisect.
+    """
+
+    def __init__(self, spans=None, flat=None):
+        self._spans = spans if spans is not None else {}
+        self._flat = flat if flat is not None else memoryview(array("I"))
+        self._delta = {}
+
+    def append(self, key, value):
+        postings = self._delta.get(key)
+        if postings is None:
+            postings = self._delta[key] = array("I")
+        postings.append(value)
+
+    def get(self, key):
+        parts = []
+        span = self._spans.get(key)
+        if span is not None:
+            parts.append(self._flat[span[0]:span[1]])
+        postings = self._delta.get(key)
+        if postings is not None:
+            parts.append(postings)
+        return parts
+
+    def size(self, key):
+        span = self._spans.get(key)
+        postings = self._delta.get(key)
+        return (span[1] - span[0] if span else 0) + (len(postings) if postings is not None else 0)
+
+    def contains(self, key, value):
+        for part in self.get(key):
+            i = bisect_left(part, value)
+            if i < len(part) and part[i] == value:
+                return True
+        return False
+
+    def flatten(self, keys):
+        """Return (offsets, flat postings) for ``keys`` in order, for a snapshot."""
+        offsets = array("I", [0])
+        flat = array("I")
+        for key in keys:
+            for part in self.get(key):
+                flat.extend(part)
+            offsets.append(len(flat))
+        return offsets, flat
+
+
+class TrigramIndex:
+    """Typo-tolerant title lookup.
+
+    Titles are split into words. Each distinct word is indexed by its
+    trigrams, and each word lists the titles containing it. A query word
+    is matched against the (much smaller) vocabulary by trigram overlap and
+    bounded edit distance; the titles of the rarest query word are then
+    checked for the other words with binary searches.
+    """
+
+    def __init__(self):
+        self.ids = array("I")
+        self.max_id = 0
+        # Of the media rows this index was built from; see media_checksum()
+        self.checksum = 0
+        self._words = []
+        self._word_ids = {}
+        self._grams = PostingLists()        # trigram + word length -> word indexes
+        self._titles_of = PostingLists()    # word index -> title positions
+        self._title_blob = b""
+        self._title_offsets = array("I", [0])
+        self._new_titles = []
+
+    def __len__(self):
+        return len(self.ids)
+
+    def title(self, position):
+        loaded = len(self._title_offsets) - 1
+        if position >= loaded:
+            return self._new_titles[position - loaded]
+        return self._title_blob[self._title_offsets[position]:self._title_offsets[position + 1]].decode("utf-8")
+
+    def _title_length(self, position):
+        loaded = len(self._title_offsets) - 1
+        if position >= loaded:
+            return len(self._new_titles[position - loaded].encode("utf-8"))
+        return self._title_offsets[position + 1] - self._title_offsets[position]
+
+    def add(self, media_id, title):
+        position = len(self.ids)
+        self.ids.append(media_id)
+        self._new_titles.append(title)
+        self.max_id = max(self.max_id, media_id)
+
+        for word in dict.fromkeys(normalize(title)):
+            index = self._word_ids.get(word)
+            if index is None:
+                index = self._word_ids[word] = len(self._words)
+                self._words.append(word)
+                for gram in word_trigrams(word):
+                    self._grams.append(_gram_key(gram, len(word)), index)
+            self._titles_of.append(index, position)
+
+    def _similar_words(self, word, edits):
+        """Return {word index: distance} for vocabulary words within ``edits`` of ``word``."""
+        matches = {}
+        exact = self._word_ids.get(word)
+        if exact is not None:
+            matches[exact] = 0
+        if edits == 0:
+            return matches
+
+        # A swap of neighbouring letters can leave no trigram in common
+        # ("drak"/"dark"), so those spellings are looked up directly
+        for i in range(len(word) - 1):
+            swapped = self._word_ids.get(word[:i] + word[i + 1] + word[i] + word[i + 2:])
+            if swapped is not None:
+                matches.setdefault(swapped, 1)
+
+        # Only words within ``edits`` of this length can match. Each edit
+        # destroys at most 3 trigrams, so a match shares all but 3 * edits
+        # of the trigrams looked at.
+        lengths = range(max(1, len(word) - edits), len(word) + edits + 1)
+        ranked = []
+        for gram in word_trigrams(word):
+            keys = [_gram_key(gram, length) for length in lengths]
+            ranked.append((sum(map(self._grams.size, keys)), keys))
+        ranked.sort()
+
+        counts = Counter()
+        used = scanned = 0
+        for size, keys in ranked:
+            if used > 3 * edits and scanned + size > POSTING_BUDGET:
+                break
+            for key in keys:
+                for part in self._grams.get(key):
+                    counts.update(part)
+            used += 1
+            scanned += size
+
+        # Close spellings share the most trigrams; only the best-overlapping
+        # candidates get the exact distance check
+        threshold = max(1, used - 3 * edits)
+        candidates = [item for item in counts.items() if item[1] >= threshold]
+        if len(candidates) > MAX_VERIFIED:
+            candidates = heapq.nlargest(MAX_VERIFIED, candidates, key=itemgetter(1))
+        words = self._words
+        masks = _pattern_masks(word)
+        for index, _ in candidates:
+            if index not in matches:
+                distance = bounded_distance(word, words[index], edits, masks)
+                if distance <= edits:
+                    matches[index] = distance
+        return matches
+
+    def _titles_with(self, matches):
+        """Map title position -> distance for titles containing one of ``matches``, closest first."""
+        candidates = {}
+        for index, distance in sorted(matches.items(), key=itemgetter(1)):
+            for part in self._titles_of.get(index):
+                for position in part[:MAX_CANDIDATES - len(candidates)]:
+                    candidates.setdefault(position, distance)
+            if len(candidates) >= MAX_CANDIDATES:
+                break
+        return candidates
+
+    def _intersect(self, candidates, matches, edits):
+        """Keep candidates that also contain one of ``matches`` within the typo budget."""
+        ordered = sorted(matches.items(), key=itemgetter(1))
+        size = sum(self._titles_of.size(index) for index in matches)
+        survivors = {}
+        if size <= 4 * len(candidates) * len(ordered):
+            # Cheaper to map every title of this word than to bisect per candidate
+            closest = {}
+            for index, distance in reversed(ordered):
+                for part in self._titles_of.get(index):
+                    closest.update(dict.fromkeys(part, distance))
+            for position, total in candidates.items():
+                distance = closest.get(position)
+                if distance is not None and total + distance <= edits:
+                    survivors[position] = total + distance
+        else:
+            for position, total in candidates.items():
+                for index, distance in ordered:
+                    if total + distance > edits:
+                        break
+                    if self._titles_of.contains(index, position):
+                        survivors[position] = total + distance
+                        break
+        return survivors
+
+    def _check_titles(self, candidates, words, edits):
+        """Keep candidates whose own words match every query word in ``words``."""
+        survivors = {}
+        for position, total in candidates.items():
+            title_words = normalize(self.title(position))
+            for word in words:
+                limit = min(edits - total, word_edits(word))
+                distance = min((bounded_distance(word, other, limit) for other in title_words), default=limit + 1)
+                if distance > limit:
+                    break
+                total += distance
+            else:
+                survivors[position] = total
+        return survivors
+
+    def search(self, text, limit=5, edits=None):
+        """Return [(media id, title, typos)] for titles containing every word of ``text`` give or take typos."""
+        query_words = list(dict.fromkeys(normalize(text)))
+        if not query_words:
+            return []
+        edits = max_edits(" ".join(query_words)) if edits is None else edits
+
+        # Longer words are rarer, so they narrow the candidates fastest. Once
+        # only a few titles are left, the remaining words are checked against
+        # those titles directly instead of searching the vocabulary again.
+        remaining = sorted(query_words, key=len, reverse=True)
+        candidates = None
+        while remaining:
+            if candidates is not None and len(candidates) <= MAX_TITLE_CHECKS:
+                candidates = self._check_titles(candidates, remaining, edits)
+                break
+            word = remaining.pop(0)
+            matches = self._similar_words(word, min(edits, word_edits(word)))
+            if not matches:
+                return []
+            candidates = self._titles_with(matches) if candidates is None else self._intersect(candidates, matches, edits)
+
+        results = sorted((total, self._title_length(position), self.ids[position], position)
+                         for position, total in candidates.items())
+        return [(media_id, self.title(position), total) for total, _, media_id, position in results[:limit]]
+
+    def save(self, path):
+        """Write a compact snapshot: flat posting arrays plus string tables."""
+        grams = sorted(set(self._grams._spans) | set(self._grams._delta))
+        gram_offsets, gram_postings = self._grams.flatten(grams)
+        word_offsets, word_postings = self._titles_of.flatten(range(len(self._words)))
+
+        words_blob = "\n".join(self._words).encode("utf-8")
+        grams_blob = "".join(grams).encode("utf-8")
+        gram_lengths = array("B", (len(gram.encode("utf-8")) for gram in grams))
+
+        title_offsets = array("I", self._title_offsets)
+        new_titles = [title.encode("utf-8") for title in self._new_titles]
+        for encoded in new_titles:
+            title_offsets.append(title_offsets[-1] + len(encoded))
+
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(self.ids), self.max_id, self.checksum, len(self._words),
+                                         len(grams), len(word_postings), len(gram_postings)))
+            for part in (self.ids, title_offsets, word_offsets, gram_offsets, word_postings, gram_postings, gram_lengths):
+                f.write(part.tobytes())
+            for blob in (words_blob, grams_blob):
+                f.write(struct.pack("<I", len(blob)))
+                f.write(blob)
+            f.write(self._title_blob)
+            f.write(b"".join(new_titles))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, count, max_id, checksum, word_count, gram_count, word_posting_count, gram_posting_count = \
+            SNAPSHOT_HEADER.unpack_from(data)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not a trigram index snapshot")
+        offset = SNAPSHOT_HEADER.size
+
+        def take(typecode, n):
+            nonlocal offset
+            part = array(typecode)
+            part.frombytes(data[offset:offset + n * part.itemsize])
+            offset += n * part.itemsize
+            return part
+
+        def take_blob():
+            nonlocal offset
+            (length,) = struct.unpack_from("<I", data, offset)
+            offset += 4 + length
+            return data[offset - length:offset]
+
+        index = cls()
+        index.ids = take("I", count)
+        index.max_id = max_id
+        index.checksum = checksum
+        index._title_offsets = take("I", count + 1)
+        word_offsets = take("I", word_count + 1)
+        gram_offsets = take("I", gram_count + 1)
+        word_postings = take("I", word_posting_count)
+        gram_postings = take("I", gram_posting_count)
+        gram_lengths = take("B", gram_count)
+
+        words_blob = take_blob().decode("utf-8")
+        index._words = words_blob.split("\n") if word_count else []
+        index._word_ids = {word: i for i, word in enumerate(index._words)}
+        index._titles_of = PostingLists(
+            {i: (word_offsets[i], word_offsets[i + 1]) for i in range(word_count)}, memoryview(word_postings))
+
+        grams_blob = take_blob().decode("utf-8")
+        spans, position = {}, 0
+        for i, length in enumerate(gram_lengths):
+            spans[grams_blob[position:position + length]] = (gram_offsets[i], gram_offsets[i + 1])
+            position += length
+        index._grams = PostingLists(spans, memoryview(gram_postings))
+
+        index._title_blob = data[offset:]
+        return index
+
+
+def build_index(conn, index=None, after_id=0):
+    """Index media rows with ``id > after_id``. Returns (index, rows added)."""
+    index = index or TrigramIndex()
+    cursor = conn.execute("SELECT id, title FROM media WHERE id > ? ORDER BY id", (after_id,))
+    added = 0
+    while True:
+        rows = cursor.fetchmany(5000)
+        if not rows:
+            break
+        for media_id, title in rows:
+            index.add(media_id, title)
+        added += len(rows)
+    return index, added
+
+
+def snapshot_path(conn):
+    """Return the snapshot file of ``conn``'s database (in the working directory
+    for an in-memory one)."""
+    database = conn.execute("PRAGMA database_list").fetchone()[2]
+    return (database or "media") + SNAPSHOT_SUFFIX
+
+
+def media_checksum(conn, max_id):
+    """Return (rows, checksum) of the media with ``id <= max_id``.
+
+    A snapshot only matches its database if both agree, so one built from a
+    recreated or replaced database with the same highest id is not reused.
+    """
+    rows, checksum = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(id * LENGTH(title) + unicode(title)), 0) FROM media WHERE id <= ?",
+        (max_id,),
+    ).fetchone()
+    return rows, checksum & 0xFFFFFFFFFFFFFFFF
+
+
+def _save(conn, index, path):
+    index.checksum = media_checksum(conn, index.max_id)[1]
+    index.save(path)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index(conn, path=None):
+    """Return the shared index, loading the snapshot on first use.
+
+    Media is append-only, so a snapshot whose titles still match the
+    database is a valid prefix: titles added since it was written are
+    indexed on load and the snapshot is rewritten once enough of them pile
+    up. A snapshot that doesn't match is rebuilt from scratch.
+    """
+    global _index
+    path = path or snapshot_path(conn)
+    with _index_lock:
+        if _index is None:
+            try:
+                index = TrigramIndex.load(path)
+            except (OSError, ValueError, struct.error, UnicodeDecodeError):
+                index = None
+            if index is not None and media_checksum(conn, index.max_id) != (len(index), index.checksum):
+                index = None
+
+            index, added = build_index(conn, index, after_id=index.max_id if index else 0)
+            if added >= RESAVE_AFTER or not os.path.exists(path):
+                _save(conn, index, path)
+            _index = index
+        return _index
+
+
+def index_media(media_id, title):
+    """Add a newly inserted title to the shared index if it is loaded."""
+    with _index_lock:
+        if _index is not None:
+            _index.add(media_id, title)
+
+
+def rebuild_index(conn, path=None):
+    """Rebuild the index from the media table and rewrite the snapshot."""
+    global _index
+    with _index_lock:
+        index, _ = build_index(conn)
+        _save(conn, index, path or snapshot_path(conn))
+        _index = index
+        return index
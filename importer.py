@@ -0,0 +1,233 @@
+import csv
+import io
+import json
+import os
+import time
+
+from db import db_connection
+from logger import logger
+from review_writer import INSERT_REVIEW_SQL, inserted_ids, validate_review
+
+MAX_REPORTED_ERRORS = 100
+
+
+class ImportStats:
+    def __init__(self, start_offset=0):
+        self.start_offset = start_offset
+        self.offset = start_offset
+        self.rows = 0
+        self.inserted = 0
+        self.failed = 0
+        self.errors = []  # first MAX_REPORTED_ERRORS (line offset, message) pairs
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rows_per_sec(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def bytes_per_sec(self):
+        return (self.offset - self.start_offset) / self.elapsed if self.elapsed else 0.0
+
+
+def detect_format(path):
+    """Guess the file format from its extension."""
+    return "csv" if path.lower().endswith(".csv") else "jsonl"
+
+
+def read_records(path, fmt, offset=0):
+    """Yield (end_offset, line_offset, record dict) for each record after ``offset``.
+
+    Records must be one per line so a byte offset is always a safe resume point.
+    """
+    with open(path, "rb") as f:
+        header = None
+        if fmt == "csv":
+            header = next(csv.reader([f.readline().decode("utf-8-sig")]))
+            offset = max(offset, f.tell())
+        f.seek(offset)
+
+        while True:
+            line_offset = f.tell()
+            line = f.readline()
+            if not line:
+                break
+            try:
+                text = line.decode("utf-8").strip()
+                if not text:
+                    continue
+                if fmt == "csv":
+                    record = dict(zip(header, next(csv.reader(io.StringIO(text)))))
+                else:
+                    record = json.loads(text)
+                    if not isinstance(record, dict):
+                        raise ValueError("expected a JSON object")
+            # UnicodeDecodeError is a ValueError: a bad line is rejected, not fatal
+            except (ValueError, csv.Error, StopIteration) as e:
+                record = {"_error": f"unparseable record: {e}"}
+
+            yield f.tell(), line_offset, record
+
+
+def chunked(iterable, size):
+    """Group an iterable into lists of at most ``size`` items."""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# SQLite's LOWER() only folds ASCII; names are folded the same way on both
+# sides so "Émile" matches itself and the LOWER() indexes are still used
+_ASCII_LOWER = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+
+def _fold(name):
+    return name.translate(_ASCII_LOWER)
+
+
+class NameResolver:
+    """Case-insensitive (as SQLite's LOWER) name -> id lookup with a bounded in-memory cache."""
+
+    def __init__(self, table, column, max_size=100000):
+        self.table = table
+        self.column = column
+        self.max_size = max_size
+        self._cache = {}
+
+    def resolve_many(self, conn, names):
+        """Resolve a batch of names with one query for the cache misses."""
+        missing = {_fold(name) for name in names if _fold(name) not in self._cache}
+        if missing:
+            if len(self._cache) + len(missing) > self.max_size:
+                self._cache.clear()
+            missing = list(missing)
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(missing), 500):
+                part = missing[start:start + 500]
+                placeholders = ", ".join("?" * len(part))
+                rows = conn.execute(
+                    f"SELECT LOWER({self.column}), id FROM {self.table} WHERE LOWER({self.column}) IN ({placeholders})",
+                    part,
+                )
+                found = dict(rows.fetchall())
+                for name in part:
+                    self._cache[name] = found.get(name)
+        return {name: self._cache.get(_fold(name)) for name in names}
+
+
+def _as_int(value):
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lstrip("-").isdigit():
+        return int(value)
+    return None
+
+
+def _resolve_chunk(conn, chunk, users, media):
+    """Turn raw records into insertable rows. Returns (rows, errors)."""
+    user_names = [str(r["user"]) for _, _, r in chunk if "user" in r and "user_id" not in r]
+    media_titles = [str(r["media"]) for _, _, r in chunk if "media" in r and "media_id" not in r]
+    user_ids = users.resolve_many(conn, user_names)
+    media_ids = media.resolve_many(conn, media_titles)
+
+    rows, errors = [], []
+    for _, line_offset, record in chunk:
+        if "_error" in record:
+            errors.append((line_offset, record["_error"]))
+            continue
+
+        user_id = _as_int(record["user_id"]) if "user_id" in record else user_ids.get(str(record.get("user")))
+        media_id = _as_int(record["media_id"]) if "media_id" in record else media_ids.get(str(record.get("media")))
+        if user_id is None:
+            errors.append((line_offset, f"unknown user {record.get('user', record.get('user_id'))!r}"))
+            continue
+        if media_id is None:
+            errors.append((line_offset, f"unknown media {record.get('media', record.get('media_id'))!r}"))
+            continue
+
+        rating = _as_int(record.get("rating"))
+        comment = record.get("comment")
+        error = validate_review(user_id, media_id, rating, comment)
+        if error:
+            errors.append((line_offset, error))
+            continue
+        rows.append((user_id, media_id, rating, comment))
+
+    return rows, errors
+
+
+def _checkpoint_key(path):
+    return os.path.abspath(path)
+
+
+def read_checkpoint(path):
+    """Return the byte offset saved by an interrupted import, or 0."""
+    with db_connection() as conn:
+        row = conn.execute("SELECT byte_offset FROM import_checkpoints WHERE path = ?",
+                           (_checkpoint_key(path),)).fetchone()
+    return row[0] if row else 0
+
+
+def _write_checkpoint(conn, path, offset):
+    """Record ``offset`` in the chunk's own transaction, so the rows and the
+    resume point commit together."""
+    conn.execute("""
+        INSERT INTO import_checkpoints (path, byte_offset, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT (path) DO UPDATE SET byte_offset = excluded.byte_offset, updated_at = excluded.updated_at
+    """, (_checkpoint_key(path), offset, time.time()))
+
+
+def clear_checkpoint(path):
+    """Forget the saved offset of a finished import."""
+    with db_connection() as conn:
+        conn.execute("DELETE FROM import_checkpoints WHERE path = ?", (_checkpoint_key(path),))
+
+
+def import_reviews(path, fmt=None, offset=0, chunk_size=5000, on_progress=None, on_commit=None):
+    """Stream reviews from a JSONL/CSV file into the database.
+
+    Each chunk is validated, resolved and inserted in one transaction, which
+    also records the byte offset after the chunk, so a crashed import can be
+    resumed with ``offset=read_checkpoint(path)`` without duplicating rows.
+    """
+    fmt = fmt or detect_format(path)
+    stats = ImportStats(offset)
+    users = NameResolver("users", "name")
+    media = NameResolver("media", "title")
+
+    for chunk in chunked(read_records(path, fmt, offset), chunk_size):
+        with db_connection() as conn:
+            rows, errors = _resolve_chunk(conn, chunk, users, media)
+            ids = []
+            if rows:
+                conn.executemany(INSERT_REVIEW_SQL, rows)
+                ids = inserted_ids(conn, len(rows))
+            _write_checkpoint(conn, path, chunk[-1][0])
+
+        stats.offset = chunk[-1][0]
+        stats.rows += len(chunk)
+        stats.inserted += len(rows)
+        stats.failed += len(errors)
+        stats.errors.extend(errors[:MAX_REPORTED_ERRORS - len(stats.errors)])
+
+        if rows and on_commit is not None:
+            try:
+                on_commit(rows, ids)
+            except Exception as e:
+                logger.error(f"Import post-commit hook failed: {e}")
+        if on_progress is not None:
+            on_progress(stats)
+
+    # Finished cleanly, nothing left to resume
+    clear_checkpoint(path)
+
+    return stats
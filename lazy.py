@@ -0,0 +1,39 @@
+import importlib
+import importlib.util
+import sys
+
+
+class LazyModule:
+    """Stands in for a module and imports it on first attribute access.
+
+    ``except lazy.Error`` clauses only touch the module when an exception
+    reaches them, so a module used mostly for its exception types costs
+    nothing at startup.
+    """
+
+    def __init__(self, name):
+        self._lazy_name = name
+        self._lazy_module = None
+
+    def __getattr__(self, attr):
+        if self._lazy_module is None:
+            # import_module holds the import lock, so racing threads are safe
+            self._lazy_module = importlib.import_module(self._lazy_name)
+        return getattr(self._lazy_module, attr)
+
+    def __repr__(self):
+        return f"<lazy module {self._lazy_name!r}>"
+
+
+def lazy_import(name, optional=False):
+    """Return a LazyModule for ``name``; with ``optional``, None if it isn't installed."""
+    if optional and importlib.util.find_spec(name) is None:
+        return None
+    return LazyModule(name)
+
+
+def is_loaded(module):
+    """Whether ``module`` has been imported yet; plain modules always have."""
+    if isinstance(module, LazyModule):
+        return module._lazy_module is not None or module._lazy_name in sys.modules
+    return True
@@ -0,0 +1,303 @@
+from lazy import lazy_import
+from redis_cache import Script, get_redis
+
+redis = lazy_import("redis")
+
+MEDIA_TYPES = ("Movie", "WebShow", "Song")
+
+GLOBAL_KEY = "leaderboard:all"
+SUMS_KEY = "leaderboard:sum"
+COUNTS_KEY = "leaderboard:count"
+TYPES_KEY = "leaderboard:types"
+BUILT_KEY = "leaderboard:built"
+_REBUILD_SUFFIX = ":rebuild"
+
+# Highest review id the boards were rebuilt from; recording skips reviews at
+# or below it, which the rebuild already counted
+HIGH_WATER_KEY = "leaderboard:high-water"
+# Reviews above the high-water mark already folded in by the last rebuild
+APPLIED_KEY = "leaderboard:applied"
+APPLIED_TTL = 3600
+# Present (holding the snapshot's high-water mark) while a rebuild is staged;
+# reviews recorded meanwhile are folded into the staged boards too
+STAGING_KEY = "leaderboard:staging"
+STAGING_TIMEOUT_MS = 10 * 60 * 1000
+
+
+def type_key(media_type):
+    return f"leaderboard:type:{media_type}"
+
+
+# Sums, counts, types, global board, then one board per MEDIA_TYPES entry
+_BOARD_KEYS = [SUMS_KEY, COUNTS_KEY, TYPES_KEY, GLOBAL_KEY] + [type_key(t) for t in MEDIA_TYPES]
+_STAGED_KEYS = [key + _REBUILD_SUFFIX for key in _BOARD_KEYS]
+# KEYS of both scripts: the live keys, the staged keys, then these
+_KEYS = _BOARD_KEYS + _STAGED_KEYS + [HIGH_WATER_KEY, APPLIED_KEY, APPLIED_KEY + _REBUILD_SUFFIX, STAGING_KEY, BUILT_KEY]
+
+# Shared by both scripts. ARGV: the media types (in KEYS order), then
+# review_id/media_id/rating triples
+_FOLD_LUA = """
+local n = (#KEYS - 5) / 2
+local types = n - 4
+local boards = {}
+for i = 1, types do
+    boards[ARGV[i]] = 4 + i
+end
+local staging = tonumber(redis.call('GET', KEYS[2 * n + 4]) or '-1')
+
+-- Add one rating to the live (base 0) or staged (base n) boards
+local function fold(base, media_id, rating)
+    local total = redis.call('HINCRBY', KEYS[base + 1], media_id, rating)
+    local count = redis.call('HINCRBY', KEYS[base + 2], media_id, 1)
+    local score = total / count
+    redis.call('ZADD', KEYS[base + 4], score, media_id)
+    local board = boards[redis.call('HGET', KEYS[base + 3], media_id)]
+    if board then
+        redis.call('ZADD', KEYS[base + board], score, media_id)
+    end
+end
+
+-- Fold a review into the staged boards once, unless the snapshot has it
+local function stage(review_id, media_id, rating)
+    if staging >= 0 and tonumber(review_id) > staging and redis.call('SADD', KEYS[2 * n + 3], review_id) == 1 then
+        fold(n, media_id, rating)
+    end
+end
+"""
+
+_RECORD_LUA = _FOLD_LUA + """
+local high_water = tonumber(redis.call('GET', KEYS[2 * n + 1]) or '0')
+local recorded = 0
+for i = types + 1, #ARGV, 3 do
+    if tonumber(ARGV[i]) > high_water and redis.call('SISMEMBER', KEYS[2 * n + 2], ARGV[i]) == 0 then
+        fold(0, ARGV[i + 1], ARGV[i + 2])
+        recorded = recorded + 1
+    end
+    stage(ARGV[i], ARGV[i + 1], ARGV[i + 2])
+end
+return recorded
+"""
+
+# ARGV as above (the reviews committed since the snapshot), then the TTL of APPLIED_KEY
+_SWAP_LUA = _FOLD_LUA + """
+if staging < 0 then
+    return redis.error_reply('leaderboard rebuild expired before its swap')
+end
+for i = types + 1, #ARGV - 1, 3 do
+    stage(ARGV[i], ARGV[i + 1], ARGV[i + 2])
+end
+for i = 1, n do
+    if redis.call('EXISTS', KEYS[n + i]) == 1 then
+        redis.call('RENAME', KEYS[n + i], KEYS[i])
+    else
+        redis.call('DEL', KEYS[i])
+    end
+end
+redis.call('SET', KEYS[2 * n + 1], staging)
+if redis.call('EXISTS', KEYS[2 * n + 3]) == 1 then
+    redis.call('RENAME', KEYS[2 * n + 3], KEYS[2 * n + 2])
+    redis.call('EXPIRE', KEYS[2 * n + 2], ARGV[#ARGV])
+else
+    redis.call('DEL', KEYS[2 * n + 2])
+end
+redis.call('DEL', KEYS[2 * n + 4])
+redis.call('SET', KEYS[2 * n + 5], 1)
+return 1
+"""
+
+
+class _Fold:
+    """Python twin of _FOLD_LUA for LocalRedis."""
+
+    def __init__(self, client, keys, args):
+        self.client = client
+        self.n = (len(keys) - 5) // 2
+        self.live, self.staged = keys[:self.n], keys[self.n:2 * self.n]
+        self.high_water, self.applied, self.staged_applied, self.staging, self.built = keys[2 * self.n:]
+        types = self.n - 4
+        self.boards = {media_type: 4 + i for i, media_type in enumerate(args[:types])}
+        self.triples = args[types:]
+        staging = client.get(self.staging)
+        self.staging_mark = int(staging) if staging is not None else -1
+
+    def reviews(self):
+        triples = self.triples
+        return zip(triples[::3], triples[1::3], triples[2::3])
+
+    def fold(self, keys, media_id, rating):
+        total = self.client.hincrby(keys[0], media_id, int(rating))
+        count = self.client.hincrby(keys[1], media_id, 1)
+        score = total / count
+        self.client.zadd(keys[3], {media_id: score})
+        board = self.boards.get(self.client.hget(keys[2], media_id))
+        if board:
+            self.client.zadd(keys[board], {media_id: score})
+
+    def stage(self, review_id, media_id, rating):
+        if 0 <= self.staging_mark < int(review_id) and self.client.sadd(self.staged_applied, review_id):
+            self.fold(self.staged, media_id, rating)
+
+
+def _record_local(client, keys, args):
+    state = _Fold(client, keys, args)
+    high_water = int(client.get(state.high_water) or 0)
+    recorded = 0
+    for review_id, media_id, rating in state.reviews():
+        if int(review_id) > high_water and not client.sismember(state.applied, review_id):
+            state.fold(state.live, media_id, rating)
+            recorded += 1
+        state.stage(review_id, media_id, rating)
+    return recorded
+
+
+def _swap_local(client, keys, args):
+    state = _Fold(client, keys, args[:-1])
+    if state.staging_mark < 0:
+        raise redis.ResponseError("leaderboard rebuild expired before its swap")
+    for review in state.reviews():
+        state.stage(*review)
+    for live, staged in zip(state.live, state.staged):
+        if client.exists(staged):
+            client.rename(staged, live)
+        else:
+            client.delete(live)
+    client.set(state.high_water, state.staging_mark)
+    if client.exists(state.staged_applied):
+        client.rename(state.staged_applied, state.applied)
+        client.expire(state.applied, int(args[-1]))
+    else:
+        client.delete(state.applied)
+    client.delete(state.staging)
+    client.set(state.built, 1)
+    return 1
+
+
+_record_reviews = Script(_RECORD_LUA, _record_local)
+_swap = Script(_SWAP_LUA, _swap_local)
+
+
+def _review_args(reviews):
+    args = []
+    for review_id, media_id, rating in reviews:
+        if rating is not None:
+            args += [str(review_id), str(media_id), int(rating)]
+    return args
+
+
+def record_reviews(reviews, client=None):
+    """Fold (review_id, media_id, rating) triples into the leaderboards in one
+    atomic script call. Returns how many were new to the live boards."""
+    args = _review_args(reviews)
+    if not args:
+        return 0
+    return _record_reviews(_KEYS, list(MEDIA_TYPES) + args, client=client)
+
+
+def add_media(media_id, media_type, client=None):
+    """Put a new media on the boards with a score of 0 until it is reviewed."""
+    client = client or get_redis()
+    pipe = client.pipeline()
+    pipe.hset(TYPES_KEY, str(media_id), media_type)
+    pipe.zadd(GLOBAL_KEY, {str(media_id): 0})
+    if media_type in MEDIA_TYPES:
+        pipe.zadd(type_key(media_type), {str(media_id): 0})
+    pipe.execute()
+
+
+def _expected(conn):
+    """Return {media_id: (type, rating sum, rating count)} from SQLite."""
+    rows = conn.execute("""
+        SELECT media.id, media.type, media_stats.rating_sum, media_stats.rating_count
+        FROM media_stats JOIN media ON media.id = media_stats.media_id
+    """)
+    return {str(media_id): (media_type, total, count) for media_id, media_type, total, count in rows}
+
+
+def _snapshot(conn):
+    """Return (highest review id, _expected()) read in one statement, so the
+    stats are exactly the reviews up to that id."""
+    rows = conn.execute("""
+        SELECT media.id, media.type, media_stats.rating_sum, media_stats.rating_count,
+               (SELECT COALESCE(MAX(id), 0) FROM reviews)
+        FROM media_stats JOIN media ON media.id = media_stats.media_id
+    """).fetchall()
+    if not rows:
+        return conn.execute("SELECT COALESCE(MAX(id), 0) FROM reviews").fetchone()[0], {}
+    return rows[0][4], {str(media_id): (media_type, total, count) for media_id, media_type, total, count, _ in rows}
+
+
+def rebuild(conn, client=None):
+    """Rebuild every board from media_stats and swap them in atomically.
+
+    New boards are written under temporary keys first, so readers see
+    either the old boards or the complete new ones. Reviews recorded while
+    they are staged are folded into them as well, and the swap replays
+    reviews committed since the snapshot, so none are lost or counted twice.
+    """
+    client = client or get_redis()
+    high_water, expected = _snapshot(conn)
+
+    sums, counts, types, boards = {}, {}, {}, {key: {} for key in _BOARD_KEYS[3:]}
+    for media_id, (media_type, total, count) in expected.items():
+        types[media_id] = media_type
+        if count:
+            sums[media_id], counts[media_id] = total, count
+        score = total / count if count else 0
+        boards[GLOBAL_KEY][media_id] = score
+        if media_type in MEDIA_TYPES:
+            boards[type_key(media_type)][media_id] = score
+
+    staged = {SUMS_KEY: sums, COUNTS_KEY: counts, TYPES_KEY: types, **boards}
+    pipe = client.pipeline()
+    for key, values in staged.items():
+        pipe.delete(key + _REBUILD_SUFFIX)
+        if values:
+            if key in boards:
+                pipe.zadd(key + _REBUILD_SUFFIX, values)
+            else:
+                pipe.hset(key + _REBUILD_SUFFIX, mapping=values)
+    pipe.delete(APPLIED_KEY + _REBUILD_SUFFIX)
+    # From here on record_reviews also folds new reviews into the staged boards
+    pipe.set(STAGING_KEY, high_water, px=STAGING_TIMEOUT_MS)
+    pipe.execute()
+
+    # Reviews recorded before staging began only reached the old boards
+    since = conn.execute("SELECT id, media_id, rating FROM reviews WHERE id > ? AND rating IS NOT NULL",
+                         (high_water,)).fetchall()
+    _swap(_KEYS, list(MEDIA_TYPES) + _review_args(since) + [APPLIED_TTL], client=client)
+    return len(expected)
+
+
+def top(conn, limit=5, media_type=None, client=None):
+    """Return [(media_id, score)] best first, building the boards on first use."""
+    client = client or get_redis()
+    if not client.exists(BUILT_KEY):
+        rebuild(conn, client)
+    key = type_key(media_type) if media_type else GLOBAL_KEY
+    return [(int(member), score) for member, score in client.zrevrange(key, 0, limit - 1, withscores=True)]
+
+
+def check(conn, client=None, tolerance=1e-9):
+    """Compare the boards with media_stats. Returns a dict of mismatch counts."""
+    client = client or get_redis()
+    expected = _expected(conn)
+    sums, counts, types = client.hgetall(SUMS_KEY), client.hgetall(COUNTS_KEY), client.hgetall(TYPES_KEY)
+    boards = {key: dict(client.zrevrange(key, 0, -1, withscores=True)) for key in _BOARD_KEYS[3:]}
+
+    report = {"checked": len(expected), "missing": 0, "wrong_score": 0, "wrong_counts": 0, "wrong_type": 0, "extra": 0}
+    for media_id, (media_type, total, count) in expected.items():
+        score = boards[GLOBAL_KEY].get(media_id)
+        if score is None:
+            report["missing"] += 1
+            continue
+        if abs(score - (total / count if count else 0)) > tolerance:
+            report["wrong_score"] += 1
+        if int(sums.get(media_id, 0)) != total or int(counts.get(media_id, 0)) != count:
+            report["wrong_counts"] += 1
+        on_boards = [t for t in MEDIA_TYPES if media_id in boards[type_key(t)]]
+        if types.get(media_id) != media_type or on_boards != ([media_type] if media_type in MEDIA_TYPES else []):
+            report["wrong_type"] += 1
+
+    report["extra"] = len(set(boards[GLOBAL_KEY]) - set(expected))
+    return report
+
@@ -1,10 +1,219 @@
+import atexit
+import json
 import logging
+import logging.handlers
+import queue
+import threading
+import time
 
-# Configure logging
-logging.basicConfig(
-    filename="notifications.log",  # Log notifications to a file
-    level=logging.INFO,  # Set logging level
-    format="%(asctime)s - %(levelname)s - %(message)s",  # Log format
-)
+from defaults import LOG_FORMATS, MAX_BYTES, ROTATE_SECONDS
+
+LOG_FILE = "notifications.log"
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+# Records waiting for the writer thread; beyond this they are dropped and counted
+QUEUE_SIZE = 50000
+# Most records written (and flushed) in one go
+BATCH_SIZE = 1000
+BACKUP_COUNT = 5
+
+_STOP = object()
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, thread and message."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks the logging thread: once ``max_size``
+    records are waiting, new ones are dropped and counted."""
+
+    def __init__(self, log_queue, max_size=QUEUE_SIZE):
+        super().__init__(log_queue)
+        self.max_size = max_size
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def prepare(self, record):
+        # Merge the arguments and traceback into text now, as the base class
+        # does, but without formatting the whole line or copying the record
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        # qsize() is approximate, so the bound is too; it only needs to keep
+        # memory in check when the writer falls behind
+        if self.queue.qsize() >= self.max_size:
+            with self._dropped_lock:
+                self.dropped += 1
+            return
+        self.queue.put_nowait(record)
+
+
+class BatchFileHandler(logging.handlers.RotatingFileHandler):
+    """Rotating file handler that writes a batch of records with one write and
+    one flush, rotating by size or by age."""
+
+    def __init__(self, filename, max_bytes=MAX_BYTES, backup_count=BACKUP_COUNT, rotate_seconds=ROTATE_SECONDS):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+        self.rotate_seconds = rotate_seconds
+        self._opened_at = time.time()
+        self.rotations = 0
+
+    def _due(self, size):
+        if self.stream is None:
+            self.stream = self._open()
+        if self.maxBytes and self.stream.tell() and self.stream.tell() + size > self.maxBytes:
+            return True
+        return bool(self.rotate_seconds) and time.time() - self._opened_at >= self.rotate_seconds
+
+    def doRollover(self):
+        super().doRollover()
+        self._opened_at = time.time()
+        self.rotations += 1
+
+    def emit_batch(self, records):
+        text = "".join(self.format(record) + self.terminator for record in records)
+        with self.lock:
+            try:
+                if self._due(len(text.encode("utf-8"))):
+                    self.doRollover()
+                self.stream.write(text)
+                self.stream.flush()
+            except OSError:
+                self.handleError(records[-1])
+
+
+class BatchLogWriter:
+    """Background thread that takes everything queued (up to BATCH_SIZE) at
+    once and hands it to the handlers as one batch."""
+
+    def __init__(self, log_queue, *handlers, batch_size=BATCH_SIZE):
+        self.queue = log_queue
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self.written = 0
+        self.batches = 0
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Write out everything queued so far, then stop the thread."""
+        if self._thread is not None and self._thread.is_alive():
+            self.queue.put(_STOP)
+            self._thread.join()
+
+    def handle_batch(self, records):
+        for handler in self.handlers:
+            wanted = [record for record in records if record.levelno >= handler.level]
+            if not wanted:
+                continue
+            if hasattr(handler, "emit_batch"):
+                handler.emit_batch(wanted)
+            else:
+                for record in wanted:
+                    handler.handle(record)
+        self.written += len(records)
+        self.batches += 1
+
+    def _run(self):
+        stop = False
+        while not stop:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            records = [record for record in batch if record is not _STOP]
+            stop = len(records) < len(batch)
+            if records:
+                self.handle_batch(records)
+
+
+_lock = threading.Lock()
+_queue_handler = None
+_writer = None
+_file_handler = None
+
+
+def configure_logging(path=LOG_FILE, fmt="text", max_bytes=MAX_BYTES, rotate_seconds=ROTATE_SECONDS,
+                      backup_count=BACKUP_COUNT, queue_size=QUEUE_SIZE):
+    """Route the root logger through a bounded queue to a background writer.
+
+    Logging calls only enqueue, so notification threads never wait on file
+    I/O or the file handler's lock. Reconfiguring flushes the previous
+    writer first.
+    """
+    global _queue_handler, _writer, _file_handler
+    if fmt not in LOG_FORMATS:
+        raise ValueError(f"Unknown log format {fmt!r}, expected one of {', '.join(LOG_FORMATS)}")
+    shutdown()
+
+    file_handler = BatchFileHandler(path, max_bytes, backup_count, rotate_seconds)
+    file_handler.setFormatter(JsonLinesFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+    log_queue = queue.SimpleQueue()
+    queue_handler = DroppingQueueHandler(log_queue, queue_size)
+    writer = BatchLogWriter(log_queue, file_handler)
+
+    with _lock:
+        _queue_handler, _writer, _file_handler = queue_handler, writer, file_handler
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(queue_handler)
+    writer.start()
+
+
+def log_stats():
+    """Return counters of the current writer: queued, written, batches, rotations, dropped."""
+    with _lock:
+        if _writer is None:
+            return {"queued": 0, "written": 0, "batches": 0, "rotations": 0, "dropped": 0}
+        return {"queued": _queue_handler.queue.qsize(), "written": _writer.written, "batches": _writer.batches,
+                "rotations": _file_handler.rotations, "dropped": _queue_handler.dropped}
+
+
+def shutdown():
+    """Write out everything queued and close the file. Called at exit."""
+    global _queue_handler, _writer, _file_handler
+    with _lock:
+        queue_handler, writer, file_handler = _queue_handler, _writer, _file_handler
+        _queue_handler = _writer = _file_handler = None
+    if writer is None:
+        return
+    logging.getLogger().removeHandler(queue_handler)
+    writer.stop()
+    if queue_handler.dropped:
+        record = logging.LogRecord(__name__, logging.WARNING, __file__, 0,
+                                   f"{queue_handler.dropped} log records dropped: the log queue was full",
+                                   None, None)
+        file_handler.emit_batch([record])
+    file_handler.close()
+
+
+configure_logging()
+# Registered at import, before any worker that logs, so it runs after them
+atexit.register(shutdown)
 
 logger = logging.getLogger(__name__)
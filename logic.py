@@ -1,10 +1,32 @@
 import sqlite3
 from rich.console import Console
 from rich.table import Table
-from db import get_db_connection
+from rich.markup import escape
+from db import db_connection, find_user_id, find_media_id, iter_review_pages, rebuild_media_stats
 from models import User, Media
 from threading import *
-from redis_cache import redis_client
+from defaults import DELIVERY_MODES, DIGEST_MAX_BUFFERS, OVERFLOW_POLICIES
+from lazy import is_loaded, lazy_import
+import time
+import atexit
+
+redis = lazy_import("redis")
+# Feature modules load on first use, so a command only imports what it runs
+cache = lazy_import("cache")
+log = lazy_import("logger")
+redis_cache = lazy_import("redis_cache")
+review_writer = lazy_import("review_writer")
+importer = lazy_import("importer")
+search = lazy_import("search")
+fuzzy = lazy_import("fuzzy")
+autocomplete = lazy_import("autocomplete")
+leaderboard = lazy_import("leaderboard")
+ranking = lazy_import("ranking")
+recommender = lazy_import("recommender")
+recommendation_cache = lazy_import("recommendation_cache")
+als = lazy_import("als")
+notifications = lazy_import("notifications")
+subscribers = lazy_import("subscribers")
 
 console = Console()
 
@@ -14,30 +36,29 @@ def add_user(name):
         console.print("[bold red]Error: User name cannot be empty![/bold red]")
         return
 
-    conn = get_db_connection()
-    if conn is None:
-        return
-
     try:
-        cursor = conn.cursor()
+        with db_connection() as conn:
+            cursor = conn.cursor()
 
-        # Check if the user already exists (case-insensitive)
-        cursor.execute("SELECT id FROM users WHERE LOWER(name) = LOWER(?)", (name,))
-        existing_user = cursor.fetchone()
+            # Check if the user already exists (case-insensitive)
+            cursor.execute("SELECT id FROM users WHERE LOWER(name) = LOWER(?)", (name,))
+            existing_user = cursor.fetchone()
 
-        if existing_user:
-            console.print(f"[bold yellow]Warning: User '{name}' already exists in the database![/bold yellow]")
-            return
+            if existing_user:
+                console.print(f"[bold yellow]Warning: User '{name}' already exists in the database![/bold yellow]")
+                return
 
-        # Insert new user
-        cursor.execute("INSERT INTO users (name) VALUES (?)", (name,))
-        conn.commit()
-        console.print(f"[bold green]User '{name}' added successfully![/bold green]")
+            # Insert new user
+            cursor.execute("INSERT INTO users (name) VALUES (?)", (name,))
+            user_id = cursor.lastrowid
+            console.print(f"[bold green]User '{name}' added successfully![/bold green]")
+
+        # The in-memory indexes only exist in processes that already used them
+        if is_loaded(autocomplete):
+            autocomplete.add_entry("users", user_id, name)
 
     except sqlite3.Error as e:
         console.print(f"[bold red]Database Error: {e}[/bold red]")
-    finally:
-        conn.close()
 
 
 def add_media(title, media_type):
@@ -46,45 +67,41 @@ def add_media(title, media_type):
         console.print("[bold red]Error: Media title cannot be empty![/bold red]")
         return
 
-    conn = get_db_connection()
-    if conn is None:
-        return
-
     try:
-        cursor = conn.cursor()
+        with db_connection() as conn:
+            cursor = conn.cursor()
 
-        # Check if media already exists (case-insensitive)
-        cursor.execute("SELECT id FROM media WHERE LOWER(title) = LOWER(?)", (title,))
-        existing_media = cursor.fetchone()
+            # Check if media already exists (case-insensitive)
+            cursor.execute("SELECT id FROM media WHERE LOWER(title) = LOWER(?)", (title,))
+            existing_media = cursor.fetchone()
 
-        if existing_media:
-            console.print(f"[bold yellow]Warning: Media '{title}' already exists in the database![/bold yellow]")
-            return
+            if existing_media:
+                console.print(f"[bold yellow]Warning: Media '{title}' already exists in the database![/bold yellow]")
+                return
 
-        # Insert new media
-        cursor.execute("INSERT INTO media (title, type) VALUES (?, ?)", (title, media_type))
-        conn.commit()
-        console.print(f"[bold green]Media '{title}' added successfully![/bold green]")
+            # Insert new media
+            cursor.execute("INSERT INTO media (title, type) VALUES (?, ?)", (title, media_type))
+            media_id = cursor.lastrowid
+            console.print(f"[bold green]Media '{title}' added successfully![/bold green]")
+
+        if is_loaded(fuzzy):
+            fuzzy.index_media(media_id, title)
+        if is_loaded(autocomplete):
+            autocomplete.add_entry("media", media_id, title)
+        _update_leaderboard(leaderboard.add_media, media_id, media_type)
 
     except sqlite3.Error as e:
         console.print(f"[bold red]Database Error: {e}[/bold red]")
-    finally:
-        conn.close()
 
 def list_users():
-    conn = get_db_connection()
-    if conn is None:
-        return
-
     try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, name FROM users")
-        users = cursor.fetchall()
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, name FROM users")
+            users = cursor.fetchall()
     except sqlite3.Error as e:
         console.print(f"[bold red]Database Error: {e}[/bold red]")
         return
-    finally:
-        conn.close()
 
     if not users:
         console.print("[bold yellow]No users found.[/bold yellow]")
@@ -100,19 +117,14 @@ def list_users():
     console.print(table)
 
 def list_media():
-    conn = get_db_connection()
-    if conn is None:
-        return
-
     try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, title, type FROM media")
-        media_list = cursor.fetchall()
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, title, type FROM media")
+            media_list = cursor.fetchall()
     except sqlite3.Error as e:
         console.print(f"[bold red]Database Error: {e}[/bold red]")
         return
-    finally:
-        conn.close()
 
     if not media_list:
         console.print("[bold yellow]No media found.[/bold yellow]")
@@ -130,38 +142,131 @@ def list_media():
 
 def search_media(title: str):
     """Search for media by title (case-insensitive)."""
-    conn = get_db_connection()
-    if conn is None:
+    try:
+        with db_connection() as conn:
+            # Word/prefix matches come from the FTS index; only fall back to
+            # the full-table substring scan when that finds nothing
+            results = [row[:3] for row in search.search_media(conn, title, limit=-1)]
+            if not results:
+                cursor = conn.cursor()
+                cursor.execute("SELECT id, title, type FROM media WHERE LOWER(title) LIKE LOWER(?)", (f"%{title}%",))
+                results = cursor.fetchall()
+
+            if not results:
+                console.print(f"[bold yellow]No media found matching '{title}'.[/bold yellow]")
+                _suggest_titles(conn, title)
+                return
+        
+            # Display results in a table
+            table = Table(title="Search Results")
+            table.add_column("ID", style="cyan", justify="center")
+            table.add_column("Title", style="magenta", justify="left")
+            table.add_column("Type", style="green", justify="left")
+
+            for media_id, media_title, media_type in results:
+                table.add_row(str(media_id), media_title, media_type)
+
+            console.print(table)
+
+    except Exception as e:
+        console.print(f"[bold red]Database Error: {e}[/bold red]")
+
+def _suggest_titles(conn, text):
+    """Print close spellings of a title that matched nothing."""
+    matches = fuzzy.get_index(conn).search(text)
+    if not matches:
         return
 
+    table = Table(title="Did you mean?")
+    table.add_column("ID", style="cyan", justify="center")
+    table.add_column("Title", style="magenta", justify="left")
+    table.add_column("Typos", style="yellow", justify="center")
+    for media_id, media_title, distance in matches:
+        table.add_row(str(media_id), escape(media_title), str(distance))
+    console.print(table)
+
+def show_completions(prefix, kind="media", limit=10):
+    """Print the most-reviewed media titles or user names starting with ``prefix``."""
     try:
-        cursor = conn.cursor()
-        
-        # Case-insensitive search using `LIKE`
-        cursor.execute("SELECT id, title, type FROM media WHERE LOWER(title) LIKE LOWER(?)", (f"%{title}%",))
-        results = cursor.fetchall()
+        index = autocomplete.get_index(kind)
+    except sqlite3.Error as e:
+        console.print(f"[bold red]Database Error: {e}[/bold red]")
+        return
 
-        if not results:
-            console.print(f"[bold yellow]No media found matching '{title}'.[/bold yellow]")
-            return
-        
-        # Display results in a table
-        table = Table(title="Search Results")
+    started = time.perf_counter()
+    completions = index.complete(prefix, limit)
+    elapsed = time.perf_counter() - started
+
+    if not completions:
+        console.print(f"[bold yellow]No {kind} starting with '{escape(prefix)}'.[/bold yellow]")
+        return
+
+    table = Table(title=f"{'Media' if kind == 'media' else 'Users'} starting with '{escape(prefix)}'",
+                  caption=f"{len(index)} entries searched in {elapsed * 1e6:.0f} µs")
+    table.add_column("ID", style="cyan", justify="center")
+    table.add_column("Title" if kind == "media" else "Name", style="magenta", justify="left")
+    table.add_column("Reviews", style="green", justify="right")
+    for entry_id, name, count in completions:
+        table.add_row(str(entry_id), escape(name), str(count))
+    console.print(table)
+
+def _highlight(text):
+    return escape(text).replace(search.MATCH_START, "[bold]").replace(search.MATCH_END, "[/bold]")
+
+def search_catalog(text, page=1, per_page=10, media_type=None, include_reviews=True):
+    """Full-text search over media titles and review comments, ranked by bm25."""
+    if search.fts_query(text) is None:
+        console.print("[bold red]Error: Search text must contain at least one word![/bold red]")
+        return
+
+    offset = (page - 1) * per_page
+    try:
+        with db_connection() as conn:
+            media_total = search.count_matches(conn, "media_fts", text, media_type=media_type)
+            media_rows = search.search_media(conn, text, limit=per_page, offset=offset, media_type=media_type)
+            review_total, review_rows = 0, []
+            if include_reviews:
+                review_total = search.count_matches(conn, "reviews_fts", text)
+                review_rows = search.search_reviews(conn, text, limit=per_page, offset=offset)
+    except sqlite3.Error as e:
+        console.print(f"[bold red]Database Error: {e}[/bold red]")
+        return
+
+    if not media_rows and not review_rows:
+        console.print(f"[bold yellow]No matches for '{escape(text)}' on page {page}.[/bold yellow]")
+        if page == 1:
+            try:
+                with db_connection() as conn:
+                    _suggest_titles(conn, text)
+            except sqlite3.Error as e:
+                console.print(f"[bold red]Database Error: {e}[/bold red]")
+        return
+
+    if media_rows:
+        table = Table(title=f"Media matching '{escape(text)}' (page {page}, {media_total} total)")
         table.add_column("ID", style="cyan", justify="center")
         table.add_column("Title", style="magenta", justify="left")
         table.add_column("Type", style="green", justify="left")
+        table.add_column("Score", style="yellow", justify="right")
+        for media_id, media_title, media_type_, score in media_rows:
+            table.add_row(str(media_id), escape(media_title), media_type_, f"{-score:.2f}")
+        console.print(table)
 
-        for media_id, media_title, media_type in results:
-            table.add_row(str(media_id), media_title, media_type)
-
+    if review_rows:
+        table = Table(title=f"Reviews matching '{escape(text)}' (page {page}, {review_total} total)")
+        table.add_column("ID", style="blue", justify="right")
+        table.add_column("User", style="cyan", justify="left")
+        table.add_column("Media", style="magenta", justify="left")
+        table.add_column("Rating", style="green", justify="center")
+        table.add_column("Comment", style="yellow", justify="left")
+        table.add_column("Score", style="yellow", justify="right")
+        for review_id, user, media_title, rating, snippet, score in review_rows:
+            table.add_row(str(review_id), escape(user), escape(media_title), str(rating), _highlight(snippet), f"{-score:.2f}")
         console.print(table)
 
-    except Exception as e:
-        console.print(f"[bold red]Database Error: {e}[/bold red]")
-    finally:
-        conn.close()
+    if offset + per_page < max(media_total, review_total):
+        console.print(f"[bold blue]Next page: --page {page + 1}[/bold blue]")
 
-from threading import Thread
 console = Console()
 review_lock = Lock()
 
@@ -176,275 +281,665 @@ def add_review(user_id: int, media_id: int, rating: int, comment: str):
         console.print("[bold red]Error: Rating must be between 1 and 5.[/bold red]")
         return
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
     try:
         with review_lock:  # Ensure thread-safe insertion
-            cursor.execute("INSERT INTO reviews (user_id, media_id, rating, comment) VALUES (?, ?, ?, ?)", 
-                           (user_id, media_id, rating, comment))
-            conn.commit()
-            console.print(f"[bold green]Review added for media ID {media_id} by user ID {user_id}![/bold green]")
+            with db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(review_writer.INSERT_REVIEW_SQL, (user_id, media_id, rating, comment))
+                review_id = cursor.lastrowid
+        console.print(f"[bold green]Review added for media ID {media_id} by user ID {user_id}![/bold green]")
 
         # Invalidate Redis cache
-        redis_client.delete("reviews:all")
-
-        review_details = f"User '{user_id}' reviewed '{media_id}' with Rating {rating}: {comment}"
+        _invalidate_reviews([(user_id, media_id)])
+        if is_loaded(autocomplete):
+            autocomplete.record_reviews([(user_id, media_id)])
+        _update_leaderboard(leaderboard.record_reviews, [(review_id, media_id, rating)])
 
-        # Notify subscribers in a separate thread
-        notification_thread = Thread(target=notify_subscribers, args=(media_id, review_details))
-        notification_thread.start()
+        # Notify subscribers through the notification stream (or worker pool)
+        _notify([(media_id, notifications.review_details(user_id, media_id, rating, comment))])
 
     except sqlite3.Error as e:
         console.print(f"[bold red]Database Error: {e}[/bold red]")
-    finally:
-        conn.close()
 
-def add_reviews_multithreaded(reviews):
-    """Add multiple reviews using multi-threading."""
-    
-    threads = []
-    for review in reviews:
-        thread = Thread(target=add_review, args=review)
-        threads.append(thread)
-        thread.start()
+_notifier = None
+_review_writer = None
+_review_writer_lock = Lock()
+notification_mode = "queue"
+digest_options = None
+_digest = None
+
+def configure_notifications(mode, digest_window=0, digest_buffers=None, digest_overflow="flush"):
+    """Choose how review notifications are delivered, see defaults.DELIVERY_MODES.
+    A ``digest_window`` in seconds sends subscribers one summary per window instead."""
+    global notification_mode, digest_options
+    if mode not in DELIVERY_MODES:
+        raise ValueError(f"Unknown notification mode {mode!r}")
+    if digest_overflow not in OVERFLOW_POLICIES:
+        raise ValueError(f"Unknown overflow policy {digest_overflow!r}")
+    notification_mode = mode
+    if digest_buffers is None:
+        digest_buffers = DIGEST_MAX_BUFFERS
+    digest_options = (digest_window, digest_buffers, digest_overflow) if digest_window > 0 else None
+
+def _notification_sink():
+    """The sink notifications are delivered to: the log, or the digest buffer in digest mode."""
+    global _digest
+    if digest_options is None:
+        return notifications.log_notification
+    if _digest is None:
+        window, buffers, overflow = digest_options
+        _digest = notifications.DigestSink(window=window, max_buffers=buffers, overflow=overflow).start()
+        # Registered before the notifier so it closes after it, flushing what it delivered last
+        atexit.register(_digest.close)
+    return _digest
+
+def _use_dispatcher():
+    global _notifier
+    _notifier = notifications.get_dispatcher(_notification_sink())
+    atexit.register(_notifier.close)
+    return _notifier
+
+def get_notifier():
+    """Return the shared notifier, delivering what is queued at exit.
+
+    Queue mode, the default, delivers through the in-process dispatcher.
+    Stream mode publishes to Redis and nothing is delivered until a
+    notify-worker process consumes the stream; with the local Redis
+    stand-in it also runs the stream's workers in-process. If
+    Redis is unreachable, notifications go through the in-process
+    dispatcher instead.
+    """
+    global _notifier
+    with _review_writer_lock:
+        if _notifier is None:
+            if notification_mode == "queue":
+                return _use_dispatcher()
+            local = isinstance(redis_cache.get_redis(), redis_cache.LocalRedis)
+            try:
+                _notifier = notifications.StreamNotifier(local_workers=notifications.WORKERS if local else 0,
+                                                         sink=_notification_sink())
+                atexit.register(_notifier.close)
+            except redis.RedisError as e:
+                log.logger.error(f"Notification stream unavailable, delivering in-process: {e}")
+                _use_dispatcher()
+    return _notifier
+
+def _notify(events):
+    """Hand (media_id, details) events to the notifier, switching to the
+    in-process dispatcher if the stream stops accepting them."""
+    notifier = get_notifier()
+    try:
+        notifier.submit_many(events)
+    except redis.RedisError as e:
+        log.logger.error(f"Notification stream unavailable, delivering in-process: {e}")
+        with _review_writer_lock:
+            if _notifier is notifier:
+                _use_dispatcher()
+        get_notifier().submit_many(events)
+
+def get_review_writer():
+    """Return the shared batched review writer, starting it on first use."""
+    global _review_writer
+    # Registered first so it closes last: the writer's final flush still notifies
+    get_notifier()
+    with _review_writer_lock:
+        if _review_writer is None:
+            _review_writer = review_writer.ReviewWriter(on_commit=_after_reviews_committed).start()
+            atexit.register(_review_writer.close)
+    return _review_writer
+
+def _after_reviews_committed(rows, ids):
+    """Notify subscribers and invalidate the cache once per committed batch."""
+    # One pipelined XADD per batch; in queue mode this blocks while the
+    # queue is full, slowing the writer down
+    _notify([(media_id, notifications.review_details(user_id, media_id, rating, comment))
+             for user_id, media_id, rating, comment in rows])
+
+    # Invalidate Redis cache
+    _invalidate_reviews([(user_id, media_id) for user_id, media_id, _, _ in rows])
+    if is_loaded(autocomplete):
+        autocomplete.record_reviews((user_id, media_id) for user_id, media_id, _, _ in rows)
+    _update_leaderboard(leaderboard.record_reviews,
+                        [(review_id, media_id, rating) for review_id, (_, media_id, rating, _) in zip(ids, rows)])
+
+def _invalidate_reviews(pairs):
+    """Bump the cache generations of committed reviews; SQLite already has them,
+    so a Redis failure is logged and stale entries age out through their TTL."""
+    try:
+        cache.invalidate_reviews(pairs)
+    except redis.RedisError as e:
+        log.logger.error(f"Cache invalidation failed: {e}")
 
-    for thread in threads:
-        thread.join()
+def _update_leaderboard(update, *args):
+    """Apply a leaderboard update after a commit; SQLite stays the source of truth,
+    so a Redis failure is logged and repaired later with rebuild-leaderboard."""
+    try:
+        update(*args)
+    except redis.RedisError as e:
+        log.logger.error(f"Leaderboard update failed: {e}")
 
-    console.print("[bold blue]All reviews added using multi-threading![/bold blue]")
+def add_reviews_multithreaded(reviews):
+    """Add multiple reviews through the batched background writer."""
+    writer = get_review_writer()
 
-def list_reviews():
-    """Displays unique reviews from the database."""
-    conn = get_db_connection()
-    if conn is None:
+    futures = []
+    for review in reviews:
+        if not isinstance(review, (tuple, list)) or len(review) != 4:
+            console.print(f"[bold red]Error: Invalid review {review!r}, expected (user_id, media_id, rating, comment).[/bold red]")
+            continue
+        futures.append((review, writer.submit(*review)))
+
+    added = 0
+    for review, future in futures:
+        try:
+            future.result()
+            added += 1
+        except (ValueError, sqlite3.Error) as e:
+            console.print(f"[bold red]Error in review {tuple(review)!r}: {e}[/bold red]")
+
+    console.print(f"[bold blue]{added} of {len(reviews)} reviews added using the batched writer![/bold blue]")
+    _report_notifications()
+
+def _report_digest():
+    if _digest is None:
+        return
+    metrics = _digest.metrics()
+    console.print(
+        f"[cyan]Digests: {metrics['events']} events into {metrics['buffered']} buffers, {metrics['digests']} sent "
+        f"| {metrics['early_flushes']} early flushes, {metrics['dropped']} dropped[/cyan]"
+    )
+
+def _report_notifications():
+    """Print the notifier's queue depth and delivery lag."""
+    metrics = get_notifier().metrics()
+    _report_digest()
+    dropped = log.log_stats()["dropped"]
+    if dropped:
+        console.print(f"[bold yellow]{dropped} log records dropped so far: the log queue was full.[/bold yellow]")
+    if "published" in metrics:
+        console.print(
+            f"[cyan]Notifications: {metrics['published']} published to the stream, {metrics['delivered']} "
+            f"delivered in-process in {metrics['fanouts']} fan-outs | max lag {metrics['max_lag_ms']:.0f} ms[/cyan]"
+        )
         return
+    console.print(
+        f"[cyan]Notifications: {metrics['submitted']} queued, {metrics['delivered']} delivered in "
+        f"{metrics['fanouts']} fan-outs | depth {metrics['depth']} (max {metrics['max_depth']}) | "
+        f"lag {metrics['lag_ms']:.0f} ms (max {metrics['max_lag_ms']:.0f} ms) | "
+        f"producers blocked {metrics['blocked_seconds']:.2f}s[/cyan]"
+    )
+
+def import_reviews_file(path, fmt=None, offset=None, chunk_size=5000):
+    """Stream reviews from a JSONL/CSV file, reporting progress and throughput."""
+    def report(stats):
+        console.print(
+            f"[cyan]{stats.rows} rows read, {stats.inserted} inserted, {stats.failed} rejected "
+            f"| offset {stats.offset} | {stats.rows_per_sec:.0f} rows/s, {stats.bytes_per_sec / 1024:.0f} KiB/s[/cyan]"
+        )
 
     try:
-        cursor = conn.cursor()
-
-        # Fetch unique reviews using JOIN to get user names and media titles
-        cursor.execute("""
-            SELECT  users.name, media.title, reviews.rating, reviews.comment
-            FROM reviews
-            JOIN users ON reviews.user_id = users.id
-            JOIN media ON reviews.media_id = media.id
-        """)
-        reviews = cursor.fetchall()
-
-        if not reviews:
-            console.print("[bold yellow]No reviews found![/bold yellow]")
-            return
+        if offset is None:
+            offset = importer.read_checkpoint(path)
+            if offset:
+                console.print(f"[bold yellow]Resuming {path} from byte offset {offset}.[/bold yellow]")
+        stats = importer.import_reviews(
+            path, fmt=fmt, offset=offset, chunk_size=chunk_size,
+            on_progress=report, on_commit=_after_reviews_committed,
+        )
+    except OSError as e:
+        console.print(f"[bold red]Error: {e}[/bold red]")
+        return
+    except sqlite3.Error as e:
+        console.print(f"[bold red]Database Error: {e}[/bold red]")
+        console.print("[bold yellow]Re-run the import to resume from the last committed chunk.[/bold yellow]")
+        return
 
-        table = Table(title="Unique Reviews")
-        table.add_column("User", style="cyan", justify="left")
-        table.add_column("Media", style="magenta", justify="left")
-        table.add_column("Rating", style="green", justify="center")
-        table.add_column("Comment", style="yellow", justify="left")
+    for line_offset, message in stats.errors:
+        console.print(f"[bold red]Rejected record at byte {line_offset}: {message}[/bold red]")
+    if stats.failed > len(stats.errors):
+        console.print(f"[bold red]... and {stats.failed - len(stats.errors)} more rejected records.[/bold red]")
+
+    console.print(
+        f"[bold blue]Imported {stats.inserted} of {stats.rows} reviews in {stats.elapsed:.2f}s "
+        f"({stats.rows_per_sec:.0f} rows/s).[/bold blue]"
+    )
+    _report_notifications()
+
+def _review_table(title=None, show_header=True):
+    table = Table(title=title, show_header=show_header)
+    table.add_column("ID", style="blue", justify="right", min_width=6)
+    table.add_column("User", style="cyan", justify="left", min_width=12)
+    table.add_column("Media", style="magenta", justify="left", min_width=20)
+    table.add_column("Rating", style="green", justify="center", min_width=6)
+    table.add_column("Comment", style="yellow", justify="left")
+    return table
+
+def list_reviews(after=0, limit=None, stream=False, page_size=500):
+    """Displays reviews from the database, ordered by review ID.
+
+    ``after``/``limit`` page through reviews by ID. With ``stream`` every
+    page is printed as soon as it is fetched, so memory stays bounded and
+    the first rows appear immediately even for millions of reviews.
+    """
+    last_id = None
+    count = 0
+    table = None if stream else _review_table(title="Unique Reviews")
 
-        for user, media, rating, comment in reviews:
-            table.add_row(user, media, str(rating), comment)
+    try:
+        for page in iter_review_pages(after_id=after, limit=limit, page_size=page_size):
+            if stream:
+                table = _review_table(title="Unique Reviews" if count == 0 else None, show_header=count == 0)
 
-        console.print(table)
+            for review_id, user, media, rating, comment in page:
+                table.add_row(str(review_id), user, media, str(rating), comment)
+            count += len(page)
+            last_id = page[-1][0]
+
+            if stream:
+                console.print(table)
 
     except sqlite3.Error as e:
         console.print(f"[bold red]Database Error: {e}[/bold red]")
-    finally:
-        conn.close()
+        return
 
+    if count == 0:
+        console.print("[bold yellow]No reviews found![/bold yellow]")
+        return
+
+    if not stream:
+        console.print(table)
 
+    if limit is not None and count == limit:
+        console.print(f"[bold blue]Next page: --after {last_id}[/bold blue]")
 
 
-def get_top_rated_media(limit=5):
-    """Fetch the top-rated media based on average review ratings."""
-    conn = get_db_connection()
-    if conn is None:
-        return
 
+
+def _top_by_average(conn, limit, media_type=None):
+    """Top media by raw average, from the Redis sorted sets, falling back to
+    media_stats (kept up to date by triggers) if Redis is unavailable."""
     try:
-        cursor = conn.cursor()
-        
-        # Fetch media with their average rating
-        cursor.execute("""
-            SELECT media.id, media.title, media.type, 
-                   COALESCE(AVG(reviews.rating), 0) AS avg_rating
-            FROM media
-            LEFT JOIN reviews ON media.id = reviews.media_id
-            GROUP BY media.id
-            ORDER BY avg_rating DESC
-            LIMIT ?
-        """, (limit,))
-        
-        results = cursor.fetchall()
+        ranked = leaderboard.top(conn, limit, media_type)
+        ids = [media_id for media_id, _ in ranked]
+        placeholders = ", ".join("?" * len(ids))
+        rows = {row[0]: row for row in conn.execute(
+            f"SELECT id, title, type FROM media WHERE id IN ({placeholders})", ids)}
+        return [rows[media_id] + (score,) for media_id, score in ranked if media_id in rows]
+    except redis.RedisError as e:
+        log.logger.error(f"Leaderboard read failed, using media_stats: {e}")
+
+    type_filter = "WHERE media.type = ?" if media_type else ""
+    return conn.execute(f"""
+        SELECT media.id, media.title, media.type, media_stats.avg_rating
+        FROM media_stats
+        JOIN media ON media.id = media_stats.media_id
+        {type_filter}
+        ORDER BY media_stats.avg_rating DESC
+        LIMIT ?
+    """, ([media_type] if media_type else []) + [limit]).fetchall()
+
+
+def get_top_rated_media(limit=5, media_type=None, mode="average"):
+    """Fetch the top-rated media, ranked by raw average or one of ranking.MODES."""
+    try:
+        with db_connection() as conn:
+            if mode == "average":
+                results = _top_by_average(conn, limit, media_type)
+            else:
+                results = [row[:4] for row in ranking.top_media(conn, limit, mode, media_type)]
 
-        if not results:
-            console.print("[bold yellow]No media found with ratings.[/bold yellow]")
-            return
+            if not results:
+                console.print("[bold yellow]No media found with ratings.[/bold yellow]")
+                return
 
-        # Display results in a table
-        table = Table(title="Top Rated Media")
-        table.add_column("ID", style="cyan", justify="center")
-        table.add_column("Title", style="magenta", justify="left")
-        table.add_column("Type", style="green", justify="left")
-        table.add_column("Avg Rating", style="yellow", justify="center")
+            # Display results in a table
+            table = Table(title="Top Rated Media")
+            table.add_column("ID", style="cyan", justify="center")
+            table.add_column("Title", style="magenta", justify="left")
+            table.add_column("Type", style="green", justify="left")
+            table.add_column("Avg Rating" if mode == "average" else f"Score ({mode})", style="yellow", justify="center")
 
-        for media_id, title, media_type, avg_rating in results:
-            table.add_row(str(media_id), title, media_type, f"{avg_rating:.2f}")
+            for media_id, title, media_type, score in results:
+                table.add_row(str(media_id), title, media_type, f"{score:.2f}")
 
-        console.print(table)
+            console.print(table)
 
     except Exception as e:
         console.print(f"[bold red]Database Error: {e}[/bold red]")
-    finally:
-        conn.close()
 
 
-def subscribe_user(name, title):
-    """Function to allow a user to subscribe to a media using names instead of IDs"""
-    conn = get_db_connection()
-    if conn is None:
+def rebuild_stats():
+    """Recompute the per-media rating aggregates from the reviews table."""
+    try:
+        total, drifted = rebuild_media_stats()
+    except sqlite3.Error as e:
+        console.print(f"[bold red]Database Error: {e}[/bold red]")
         return
 
+    style = "bold yellow" if drifted else "bold green"
+    console.print(f"[{style}]Rebuilt rating stats for {total} media ({drifted} were out of date).[/{style}]")
+
+
+def build_recommender():
+    """Rebuild and save the item-item neighbour lists used by the cf engine."""
+    try:
+        with db_connection() as conn:
+            started = time.perf_counter()
+            model = recommender.rebuild_model(conn)
+            expanded = recommendation_cache.expand_dirty_media(conn, model)
+            dirty_users, _ = recommendation_cache.pending(conn)
+    except (sqlite3.Error, RuntimeError) as e:
+        console.print(f"[bold red]Error: {e}[/bold red]")
+        return
+    console.print(f"[bold green]Built neighbour lists for {len(model)} media "
+                  f"({len(model.neighbors)} pairs) in {time.perf_counter() - started:.2f}s "
+                  f"-> {recommender.MODEL_PATH}[/bold green]")
+    console.print(f"[bold blue]{expanded} reviewed media marked their neighbourhoods stale; "
+                  f"{dirty_users} users waiting for refresh-recs.[/bold blue]")
+
+
+def train_recommender(factors=None, iterations=None, regularization=None, implicit=False):
+    """Train and save the ALS factors used by the als engine (als defaults for None)."""
+    factors = als.FACTORS if factors is None else factors
+    iterations = als.ITERATIONS if iterations is None else iterations
+    regularization = als.REGULARIZATION if regularization is None else regularization
     try:
-        cursor = conn.cursor()
+        with db_connection() as conn:
+            started = time.perf_counter()
+            model = als.train_model(conn, factors=factors, iterations=iterations,
+                                    regularization=regularization, implicit=implicit)
+    except (sqlite3.Error, RuntimeError) as e:
+        console.print(f"[bold red]Error: {e}[/bold red]")
+        return
+    console.print(f"[bold green]Trained {factors} {'implicit' if implicit else 'explicit'} factors for "
+                  f"{len(model.user_ids)} users and {len(model)} media in {time.perf_counter() - started:.2f}s "
+                  f"-> {als.MODEL_PREFIX}.*.npy[/bold green]")
+
+
+def refresh_recommendations(watch=False, batch_size=None):
+    """Refresh dirty precomputed recommendations, once or continuously with ``watch``."""
+    if batch_size is None:
+        batch_size = recommendation_cache.BATCH_SIZE
+    if watch:
+        worker = recommendation_cache.RecommendationWorker(batch_size=batch_size).start()
+        console.print("[bold blue]Refreshing recommendations as they go stale (Ctrl+C to stop)...[/bold blue]")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            worker.close()
+        console.print(f"[bold green]Refreshed {worker.stats['users']} users in "
+                      f"{worker.stats['batches']} batches.[/bold green]")
+        return
 
+    started = time.perf_counter()
+    total = 0
+    try:
+        while True:
+            refreshed = recommendation_cache.refresh_dirty(batch_size)
+            if not refreshed:
+                break
+            total += refreshed
+    except (sqlite3.Error, RuntimeError) as e:
+        console.print(f"[bold red]Error: {e}[/bold red]")
+        return
+    console.print(f"[bold green]Refreshed recommendations for {total} users "
+                  f"in {time.perf_counter() - started:.2f}s.[/bold green]")
+
+
+def run_notify_workers(consumer=None, workers=1, count=None, block_ms=None, claim_idle_ms=None, drain=False):
+    """Consume the notification stream with ``workers`` consumers until Ctrl+C
+    (or, with ``drain``, until it has nothing new); None takes the notifications defaults."""
+    count = notifications.STREAM_BATCH if count is None else count
+    block_ms = notifications.BLOCK_MS if block_ms is None else block_ms
+    claim_idle_ms = notifications.CLAIM_IDLE_MS if claim_idle_ms is None else claim_idle_ms
+    base = consumer or notifications.default_consumer()
+    names = [base] if workers == 1 else [f"{base}-{i}" for i in range(workers)]
+    try:
+        length, pending, _ = notifications.stream_status()
+    except redis.RedisError as e:
+        console.print(f"[bold red]Redis Error: {e}[/bold red]")
+        return
+    console.print(f"[bold blue]{len(names)} consumer(s) in group '{notifications.GROUP}' on "
+                  f"'{notifications.STREAM_KEY}' ({length} entries, {pending} pending)"
+                  f"{'' if drain else ' (Ctrl+C to stop)'}...[/bold blue]")
+
+    sink = _notification_sink()
+    runners = [notifications.StreamWorker(name, count=count, block_ms=block_ms, claim_idle_ms=claim_idle_ms, sink=sink)
+               for name in names]
+    started = time.perf_counter()
+    if drain:
+        threads = [Thread(target=runner.run, kwargs={"drain": True}) for runner in runners]
+        for thread in threads:
+            thread.start()
+    else:
+        for runner in runners:
+            runner.start()
+    try:
+        if drain:
+            for thread in threads:
+                thread.join()
+        else:
+            while True:
+                time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    for runner in runners:
+        runner.close()
+    elapsed = time.perf_counter() - started
+
+    table = Table(title="Notification Workers")
+    for column in ("Consumer", "Acked", "Notifications", "Batches", "Claimed", "Errors", "Max Lag (ms)"):
+        table.add_column(column, justify="left" if column == "Consumer" else "right")
+    acked = 0
+    for runner in runners:
+        metrics = runner.metrics()
+        acked += metrics["acked"]
+        table.add_row(metrics["consumer"], str(metrics["acked"]), str(metrics["notifications"]),
+                      str(metrics["batches"]), str(metrics["claimed"]), str(metrics["errors"]),
+                      f"{metrics['max_lag_ms']:.0f}")
+    console.print(table)
+    console.print(f"[bold green]Acknowledged {acked} entries in {elapsed:.2f}s "
+                  f"({acked / elapsed if elapsed else 0:.0f}/s).[/bold green]")
+    if _digest is not None:
+        _digest.close()
+        _report_digest()
+
+
+def rebuild_leaderboard():
+    """Rebuild the Redis top-rated leaderboards from media_stats."""
+    try:
+        with db_connection() as conn:
+            count = leaderboard.rebuild(conn)
+    except (sqlite3.Error, redis.RedisError) as e:
+        console.print(f"[bold red]Leaderboard Error: {e}[/bold red]")
+        return
+    console.print(f"[bold green]Rebuilt leaderboards for {count} media.[/bold green]")
+
+
+def check_leaderboard():
+    """Compare the Redis leaderboards with media_stats. Returns True when they agree."""
+    try:
+        with db_connection() as conn:
+            report = leaderboard.check(conn)
+    except (sqlite3.Error, redis.RedisError) as e:
+        console.print(f"[bold red]Leaderboard Error: {e}[/bold red]")
+        return False
+
+    problems = {name: count for name, count in report.items() if name != "checked" and count}
+    if not problems:
+        console.print(f"[bold green]Leaderboards match media_stats for {report['checked']} media.[/bold green]")
+        return True
+    details = ", ".join(f"{count} {name.replace('_', ' ')}" for name, count in problems.items())
+    console.print(f"[bold yellow]Leaderboards out of date: {details}. Run rebuild-leaderboard.[/bold yellow]")
+    return False
+
+
+def subscribe_user(name, title):
+    """Function to allow a user to subscribe to a media using names instead of IDs"""
+    try:
         # Get user ID from name
-        cursor.execute("SELECT id FROM users WHERE name = ?", (name,))
-        user = cursor.fetchone()
-        if not user:
+        user_id = find_user_id(name)
+        if user_id is None:
             console.print(f"[bold red]Error: User '{name}' does not exist![/bold red]")
             return
-        user_id = user[0]
 
         # Get media ID from title
-        cursor.execute("SELECT id FROM media WHERE title = ?", (title,))
-        media = cursor.fetchone()
-        if not media:
+        media_id = find_media_id(title)
+        if media_id is None:
             console.print(f"[bold red]Error: Media '{title}' does not exist![/bold red]")
             return
-        media_id = media[0]
 
-        # Subscribe the user to media
-        cursor.execute("INSERT OR IGNORE INTO subscriptions (user_id, media_id) VALUES (?, ?)", 
-                       (user_id, media_id))
-        conn.commit()
+        with db_connection() as conn:
+            cursor = conn.cursor()
+
+            # Subscribe the user to media
+            cursor.execute("INSERT OR IGNORE INTO subscriptions (user_id, media_id) VALUES (?, ?)", 
+                           (user_id, media_id))
+        _update_subscribers(media_id, name)
         console.print(f"[bold green]User '{name}' subscribed to '{title}' successfully![/bold green]")
 
     except sqlite3.Error as e:
         console.print(f"[bold red]Database Error: {e}[/bold red]")
-    finally:
-        conn.close()
-
-from logger import logger
-
-def notify_subscribers(media_id, review_details):
-    """Function to log notifications for users who subscribed to a media"""
-    conn = get_db_connection()
-    if conn is None:
-        return
 
+def _update_subscribers(media_id, name):
+    """Add a subscription to the cached fan-out sets; a Redis failure is logged
+    and repaired with rebuild-subscribers."""
     try:
-        cursor = conn.cursor()
-        
-        # Get users who subscribed to this media
-        cursor.execute("SELECT users.name FROM subscriptions JOIN users ON subscriptions.user_id = users.id WHERE subscriptions.media_id = ?", (media_id,))
-        subscribers = cursor.fetchall()
+        subscribers.add(media_id, name)
+    except redis.RedisError as e:
+        log.logger.error(f"Subscriber cache update failed: {e}")
 
-        for subscriber in subscribers:
-            user_name = subscriber[0]
-            logger.info(f"Notification: User '{user_name}', a new review has been added for Media ID {media_id}.")
-            logger.info(f"Review Details: {review_details}")
-
-    except sqlite3.Error as e:
-        logger.error(f"Notification Error: {e}")
-    finally:
-        conn.close()
-
-def get_recommendations(user_id: int):
-    """Fetch top 5 media recommendations based on rating and user subscriptions."""
-    conn = get_db_connection()
-    if conn is None:
+def rebuild_subscriber_index():
+    """Drop the cached subscriber sets so they are reloaded from SQLite."""
+    try:
+        dropped = subscribers.rebuild()
+    except redis.RedisError as e:
+        console.print(f"[bold red]Redis Error: {e}[/bold red]")
         return
+    console.print(f"[bold green]Dropped {dropped} cached subscriber sets; they reload on next fan-out.[/bold green]")
 
+def notify_subscribers(media_id, review_details):
+    """Function to log notifications for users who subscribed to a media"""
     try:
-        cursor = conn.cursor()
-
-        # Check if user exists
-        cursor.execute("SELECT name FROM users WHERE id = ?", (user_id,))
-        user = cursor.fetchone()
-        if not user:
-            console.print(f"[bold red]Error: User ID '{user_id}' does not exist![/bold red]")
-            return
-        user_name = user[0]
-
-        # Get top-rated media (average rating)
-        cursor.execute("""
-            SELECT media.title, media.type, AVG(reviews.rating) as avg_rating
-            FROM media
-            LEFT JOIN reviews ON media.id = reviews.media_id
-            GROUP BY media.id
-            ORDER BY avg_rating DESC
-            LIMIT 5
-        """)
-        top_rated = cursor.fetchall()
-
-        # Get media the user is subscribed to
-        cursor.execute("""
-            SELECT media.title, media.type
-            FROM media
-            JOIN subscriptions ON media.id = subscriptions.media_id
-            WHERE subscriptions.user_id = ?
-        """, (user_id,))
-        subscribed_media = cursor.fetchall()
-
-        # Exclude media already reviewed by the user
-        cursor.execute("""
-            SELECT DISTINCT media.title
-            FROM reviews
-            JOIN media ON reviews.media_id = media.id
-            WHERE reviews.user_id = ?
-        """, (user_id,))
-        reviewed_media = {row[0] for row in cursor.fetchall()}
-
-        # Combine top-rated and subscribed media, removing duplicates
-        recommended_media = []
-        seen_titles = set()
-
-        # Add top-rated media first
-        for title, media_type, avg_rating in top_rated:
-            if title not in reviewed_media and title not in seen_titles:
-                recommended_media.append((title, media_type, round(avg_rating, 2)))
-                seen_titles.add(title)
-
-        # Add subscribed media (if not already in recommendations)
-        for title, media_type in subscribed_media:
-            if title not in reviewed_media and title not in seen_titles:
-                recommended_media.append((title, media_type, None))  # No avg rating for subscribed media
-                seen_titles.add(title)
-
-        # Limit to top 5 recommendations
-        recommended_media = recommended_media[:5]
-
-        if not recommended_media:
-            console.print(f"[bold yellow]No new recommendations for User ID {user_id} ({user_name}).[/bold yellow]")
-            return
-
-        # Display recommendations
-        table = Table(title=f"Top 5 Recommendations for {user_name} (ID: {user_id})")
-        table.add_column("Media", style="magenta", justify="left")
-        table.add_column("Type", style="cyan", justify="left")
-        table.add_column("Avg Rating", style="green", justify="center")
-
-        for title, media_type, avg_rating in recommended_media:
-            rating_display = str(avg_rating) if avg_rating is not None else "N/A"
-            table.add_row(title, media_type, rating_display)
-
-        console.print(table)
+        notifications.fan_out({media_id: [review_details]}, budget=None)
+    except (sqlite3.Error, redis.RedisError) as e:
+        log.logger.error(f"Notification Error: {e}")
+
+def _popular_recommendations(cursor, user_id):
+    """Global top-rated media plus the user's subscriptions, minus what they reviewed."""
+    # Get top-rated media (average rating)
+    cursor.execute("""
+        SELECT media.title, media.type, media_stats.avg_rating
+        FROM media_stats
+        JOIN media ON media.id = media_stats.media_id
+        ORDER BY media_stats.avg_rating DESC
+        LIMIT 5
+    """)
+    top_rated = cursor.fetchall()
+
+    # Get media the user is subscribed to
+    cursor.execute("""
+        SELECT media.title, media.type
+        FROM media
+        JOIN subscriptions ON media.id = subscriptions.media_id
+        WHERE subscriptions.user_id = ?
+    """, (user_id,))
+    subscribed_media = cursor.fetchall()
+
+    # Exclude media already reviewed by the user
+    cursor.execute("""
+        SELECT DISTINCT media.title
+        FROM reviews
+        JOIN media ON reviews.media_id = media.id
+        WHERE reviews.user_id = ?
+    """, (user_id,))
+    reviewed_media = {row[0] for row in cursor.fetchall()}
+
+    # Combine top-rated and subscribed media, removing duplicates
+    recommended_media = []
+    seen_titles = set()
+
+    # Add top-rated media first
+    for title, media_type, avg_rating in top_rated:
+        if title not in reviewed_media and title not in seen_titles:
+            recommended_media.append((title, media_type, round(avg_rating, 2)))
+            seen_titles.add(title)
+
+    # Add subscribed media (if not already in recommendations)
+    for title, media_type in subscribed_media:
+        if title not in reviewed_media and title not in seen_titles:
+            recommended_media.append((title, media_type, None))  # No avg rating for subscribed media
+            seen_titles.add(title)
+
+    # Limit to top 5 recommendations
+    return recommended_media[:5]
+
+
+def _model_recommendations(conn, user_id, engine, limit=5):
+    """Model-based recommendations as (title, type, score): "cf" from the
+    precomputed item-item lists, "als" from the matrix-factorization factors."""
+    if engine == "cf":
+        ranked = recommendation_cache.get(conn, user_id, limit)
+    else:
+        ranked = als.recommend(conn, user_id, limit)
+    if not ranked:
+        return []
+    ids = [media_id for media_id, _ in ranked]
+    rows = {row[0]: row[1:] for row in conn.execute(
+        f"SELECT id, title, type FROM media WHERE id IN ({', '.join('?' * len(ids))})", ids)}
+    return [rows[media_id] + (round(score, 2),) for media_id, score in ranked if media_id in rows]
+
+
+def get_recommendations(user_id: int, engine: str = "popular"):
+    """Fetch top 5 media recommendations for a user.
+
+    The "popular" engine combines the global top-rated list with the user's
+    subscriptions; "cf" predicts ratings from similar media the user rated
+    and "als" from learned user/media factors. Both fall back to "popular"
+    for users they know nothing about.
+    """
+    try:
+        with db_connection() as conn:
+            cursor = conn.cursor()
+
+            # Check if user exists
+            cursor.execute("SELECT name FROM users WHERE id = ?", (user_id,))
+            user = cursor.fetchone()
+            if not user:
+                console.print(f"[bold red]Error: User ID '{user_id}' does not exist![/bold red]")
+                return
+            user_name = user[0]
+
+            recommended_media = []
+            if engine in ("cf", "als"):
+                try:
+                    recommended_media = _model_recommendations(conn, user_id, engine)
+                except RuntimeError as e:
+                    console.print(f"[bold red]Error: {e}[/bold red]")
+                    return
+            if not recommended_media:
+                engine = "popular"
+                recommended_media = _popular_recommendations(cursor, user_id)
+
+            if not recommended_media:
+                console.print(f"[bold yellow]No new recommendations for User ID {user_id} ({user_name}).[/bold yellow]")
+                return
+
+            # Display recommendations
+            table = Table(title=f"Top 5 Recommendations for {user_name} (ID: {user_id})")
+            table.add_column("Media", style="magenta", justify="left")
+            table.add_column("Type", style="cyan", justify="left")
+            table.add_column({"popular": "Avg Rating", "cf": "Predicted"}.get(engine, "Score"), style="green", justify="center")
+
+            for title, media_type, avg_rating in recommended_media:
+                rating_display = str(avg_rating) if avg_rating is not None else "N/A"
+                table.add_row(title, media_type, rating_display)
+
+            console.print(table)
 
     except sqlite3.Error as e:
         console.print(f"[bold red]Database Error: {e}[/bold red]")
-    finally:
-        conn.close()
 
 
 
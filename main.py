@@ -1,9 +1,13 @@
 import typer
-from db import initialize_db
+from db import (initialize_db, get_query_plans, configure_pool, get_pool_stats, check_pool_health,
+                DEFAULT_POOL_SIZE, DEFAULT_DURABILITY, DURABILITY_PROFILES)
 from rich.console import Console
-from rich.table import Table
-import ast
+import os
 from db import get_reviews 
+# Option defaults only; the modules they configure are imported by the commands that use them
+from defaults import (LOG_FORMATS, MAX_BYTES, ROTATE_SECONDS, RANKING_MODES, DELIVERY_MODES, STREAM_BATCH,
+                      BLOCK_MS, CLAIM_IDLE_MS, DIGEST_MAX_BUFFERS, OVERFLOW_POLICIES, ALS_FACTORS,
+                      ALS_ITERATIONS, ALS_REGULARIZATION, REFRESH_BATCH_SIZE)
 
 
 from logic import (
@@ -16,14 +20,63 @@ from logic import (
     get_recommendations,
     subscribe_user,
     search_media,
+    search_catalog,
+    show_completions,
+    rebuild_stats,
+    build_recommender,
+    refresh_recommendations,
+    train_recommender,
+    rebuild_leaderboard,
+    check_leaderboard,
     get_top_rated_media,
     add_reviews_multithreaded,
-    
+    import_reviews_file,
+    configure_notifications,
+    run_notify_workers,
+    rebuild_subscriber_index,
 )
 app = typer.Typer()
 console = Console()
 
 
+@app.callback()
+def main(
+    pool_size: int = typer.Option(DEFAULT_POOL_SIZE, help="Number of idle SQLite connections to keep pooled"),
+    durability: str = typer.Option(DEFAULT_DURABILITY, help=f"SQLite durability profile: {', '.join(DURABILITY_PROFILES)}"),
+    redis_backend: str = typer.Option("redis", help="redis, or local for an in-process stand-in (no server needed)"),
+    notify: str = typer.Option("queue", help="Notification delivery: queue (in-process) or stream (Redis, durable; "
+                                             "needs a running notify-worker to deliver)"),
+    digest_window: float = typer.Option(0, help="Seconds per notification digest for each subscriber and media; 0 sends every review"),
+    digest_buffers: int = typer.Option(DIGEST_MAX_BUFFERS, help="(subscriber, media) digests buffered at once"),
+    digest_overflow: str = typer.Option("flush", help=f"When digest buffers are full: {', '.join(OVERFLOW_POLICIES)}"),
+    log_format: str = typer.Option("text", help=f"notifications.log format: {', '.join(LOG_FORMATS)} (json writes JSON lines)"),
+    log_max_bytes: int = typer.Option(MAX_BYTES, help="Rotate notifications.log past this size (0 = never)"),
+    log_rotate_seconds: int = typer.Option(ROTATE_SECONDS, help="Rotate notifications.log after this many seconds (0 = never)"),
+    profile_startup: bool = typer.Option(False, "--profile-startup",
+                                         help="Run the command, then print which imports its startup spent time on"),
+):
+    """Media Review System"""
+    if durability not in DURABILITY_PROFILES:
+        raise typer.BadParameter(f"choose one of: {', '.join(DURABILITY_PROFILES)}", param_hint="--durability")
+    if redis_backend not in ("redis", "local"):
+        raise typer.BadParameter("choose redis or local", param_hint="--redis-backend")
+    if notify not in DELIVERY_MODES:
+        raise typer.BadParameter(f"choose one of: {', '.join(DELIVERY_MODES)}", param_hint="--notify")
+    if digest_overflow not in OVERFLOW_POLICIES:
+        raise typer.BadParameter(f"choose one of: {', '.join(OVERFLOW_POLICIES)}", param_hint="--digest-overflow")
+    if log_format not in LOG_FORMATS:
+        raise typer.BadParameter(f"choose one of: {', '.join(LOG_FORMATS)}", param_hint="--log-format")
+    if (log_format, log_max_bytes, log_rotate_seconds) != ("text", MAX_BYTES, ROTATE_SECONDS):
+        from logger import configure_logging
+
+        configure_logging(fmt=log_format, max_bytes=log_max_bytes, rotate_seconds=log_rotate_seconds)
+    configure_pool(size=pool_size, durability=durability)
+    configure_notifications(notify, digest_window, digest_buffers, digest_overflow)
+    if redis_backend == "local":
+        from redis_cache import use_local_redis
+
+        use_local_redis()
+
 
 @app.command("init")
 def init():
@@ -31,6 +84,29 @@ def init():
     initialize_db()
     typer.echo("Database initialized successfully.")
 
+@app.command()
+def migrate():
+    """Apply pending schema migrations and show the indexes the query planner uses."""
+    from rich.table import Table
+
+    applied = initialize_db() or []
+
+    if applied:
+        for version, description in applied:
+            console.print(f"[bold green]Applied migration {version}: {description}[/bold green]")
+    else:
+        console.print("[bold blue]Schema is up to date.[/bold blue]")
+
+    table = Table(title="Query Plans")
+    table.add_column("Query", style="cyan")
+    table.add_column("Index Used", style="green")
+    table.add_column("Plan", style="yellow")
+
+    for name, detail, indexes in get_query_plans():
+        table.add_row(name, ", ".join(indexes) or "[bold red]none (scan)[/bold red]", detail)
+
+    console.print(table)
+
 @app.command()
 def create_user(name: str):
     """Add a new user"""
@@ -56,6 +132,40 @@ def search_media_by_title(title: str):
     """Search for media by title."""
     search_media(title)
 
+@app.command()
+def search(
+    text: str,
+    page: int = typer.Option(1, min=1, help="Page of results to show"),
+    per_page: int = typer.Option(10, min=1, help="Results per page"),
+    media_type: str = typer.Option(None, "--type", help="Only media of this type (Movie, WebShow, Song)"),
+    reviews: bool = typer.Option(True, help="Also search review comments"),
+):
+    """Full-text search over titles and review comments (prefix matches, ranked by relevance)."""
+    search_catalog(text, page=page, per_page=per_page, media_type=media_type, include_reviews=reviews)
+
+@app.command("autocomplete")
+def autocomplete_names(
+    prefix: str,
+    kind: str = typer.Option("media", help="media (titles) or users (names)"),
+    limit: int = typer.Option(10, min=1, help="Number of completions"),
+):
+    """Complete a media title or user name, most-reviewed first."""
+    if kind not in ("media", "users"):
+        raise typer.BadParameter("choose media or users", param_hint="--kind")
+    show_completions(prefix, kind=kind, limit=limit)
+
+@app.command()
+def fuzzy_index():
+    """Rebuild the typo-tolerant title index and its on-disk snapshot."""
+    import fuzzy
+    from db import db_connection
+
+    with db_connection() as conn:
+        index = fuzzy.rebuild_index(conn)
+        path = fuzzy.snapshot_path(conn)
+    size = os.path.getsize(path)
+    console.print(f"[bold green]Indexed {len(index)} titles into {path} ({size / 1024:.0f} KiB).[/bold green]")
+
 @app.command()
 def review_media(user_id: int, media_id: int, rating: int, comment: str):
     """Command to allow users to review media based on user ID and media ID"""
@@ -63,31 +173,125 @@ def review_media(user_id: int, media_id: int, rating: int, comment: str):
 
 
 @app.command()
-def show_reviews():
-    """List all reviews"""
-    list_reviews()
-
-import ast  # To safely parse the tuple string input
+def show_reviews(
+    after: int = typer.Option(0, help="Only show reviews with an ID greater than this"),
+    limit: int = typer.Option(None, help="Maximum number of reviews to show"),
+    stream: bool = typer.Option(False, help="Print page by page instead of one table"),
+    page_size: int = typer.Option(500, help="Rows fetched (and printed, with --stream) per page"),
+):
+    """List reviews, paginated by review ID"""
+    list_reviews(after=after, limit=limit, stream=stream, page_size=page_size)
 
 
 @app.command()
-def top_rated(limit: int = 5):
+def top_rated(
+    limit: int = 5,
+    media_type: str = typer.Option(None, "--type", help="Only rank this media type (Movie, WebShow, Song)"),
+    mode: str = typer.Option("average", help="average, bayesian (shrunk towards the global mean), "
+                                             "wilson (confidence lower bound) or decayed (recent reviews count more)"),
+):
     """Get the top-rated media based on reviews."""
-    get_top_rated_media(limit)
+    if mode not in RANKING_MODES:
+        raise typer.BadParameter(f"choose one of {', '.join(RANKING_MODES)}", param_hint="--mode")
+    get_top_rated_media(limit, media_type, mode)
+
+@app.command("rebuild-stats")
+def rebuild_stats_command():
+    """Recompute per-media rating aggregates (media_stats) from all reviews."""
+    rebuild_stats()
+
+@app.command("rebuild-leaderboard")
+def rebuild_leaderboard_command():
+    """Rebuild the Redis top-rated leaderboards from media_stats."""
+    rebuild_leaderboard()
+
+@app.command("check-leaderboard")
+def check_leaderboard_command():
+    """Check the Redis top-rated leaderboards against media_stats."""
+    if not check_leaderboard():
+        raise typer.Exit(code=1)
 
 @app.command()
 def subscribe(user_name: str, media_title: str):
     """Subscribe a user to a media for notifications"""
     subscribe_user(user_name, media_title)
 
+@app.command("rebuild-subscribers")
+def rebuild_subscribers_command():
+    """Reload the Redis subscriber sets used for notification fan-out from SQLite"""
+    rebuild_subscriber_index()
+
 @app.command()
-def recommend(user_id: int):
+def recommend(
+    user_id: int,
+    engine: str = typer.Option("popular", help="popular (top rated + subscriptions), cf (item-item collaborative "
+                                               "filtering) or als (matrix factorization)"),
+):
     """Get top 5 media recommendations for a user using their ID."""
-    get_recommendations(user_id)
+    if engine not in ("popular", "cf", "als"):
+        raise typer.BadParameter("choose popular, cf or als", param_hint="--engine")
+    get_recommendations(user_id, engine)
+
+@app.command("build-cf")
+def build_cf_command():
+    """Rebuild the item-item neighbour lists used by `recommend --engine cf`."""
+    build_recommender()
+
+@app.command("train-recs")
+def train_recs(
+    factors: int = typer.Option(ALS_FACTORS, help="Latent factors per user and media"),
+    iterations: int = typer.Option(ALS_ITERATIONS, help="Alternating least-squares sweeps"),
+    regularization: float = typer.Option(ALS_REGULARIZATION, help="Ridge penalty (scaled by each row's rating count when explicit)"),
+    implicit: bool = typer.Option(False, help="Treat reviews as confidence-weighted implicit feedback"),
+):
+    """Train the matrix-factorization (ALS) model used by `recommend --engine als`."""
+    train_recommender(factors=factors, iterations=iterations, regularization=regularization, implicit=implicit)
+
+@app.command("eval-recs")
+def eval_recs(
+    k: int = 10,
+    holdout: float = typer.Option(0.2, help="Share of each user's reviews hidden from training"),
+    synthetic: int = typer.Option(0, help="Evaluate on this many synthetic reviews instead of the database"),
+    users: int = typer.Option(2000, help="Users sampled for scoring"),
+):
+    """Offline precision@k of the popular, cf and als engines on held-out reviews."""
+    from rich.table import Table
+    from benchmarks import evaluate_recommenders
+
+    result = evaluate_recommenders(k=k, holdout=holdout, synthetic=synthetic, max_users=users)
+    table = Table(title=f"precision@{result['k']} over {result['users']} users ({result['reviews']:,} reviews)")
+    table.add_column("Engine", style="cyan")
+    table.add_column(f"Precision@{result['k']}", style="green", justify="right")
+    table.add_column("Train (s)", style="yellow", justify="right")
+    for engine, scores in result["engines"].items():
+        table.add_row(engine, f"{scores['precision']:.4f}", f"{scores['train_seconds']:.2f}")
+    console.print(table)
+
+@app.command("refresh-recs")
+def refresh_recs(
+    watch: bool = typer.Option(False, help="Keep running as a worker, refreshing entries as reviews arrive"),
+    batch_size: int = typer.Option(REFRESH_BATCH_SIZE, help="Users recomputed per transaction"),
+):
+    """Recompute precomputed cf recommendations for users marked dirty by new reviews."""
+    refresh_recommendations(watch=watch, batch_size=batch_size)
+
+@app.command("notify-worker")
+def notify_worker(
+    consumer: str = typer.Option(None, help="Consumer name; reuse it after a crash to redeliver its pending entries"),
+    workers: int = typer.Option(1, help="Consumers to run in this process"),
+    count: int = typer.Option(STREAM_BATCH, help="Entries per XREADGROUP"),
+    block: int = typer.Option(BLOCK_MS, help="Milliseconds each read waits for new entries"),
+    claim_idle: int = typer.Option(CLAIM_IDLE_MS, help="Reclaim entries pending longer than this many milliseconds"),
+    drain: bool = typer.Option(False, help="Exit once the stream has nothing new instead of waiting"),
+):
+    """Deliver notifications from the Redis stream; run more of these to scale out."""
+    run_notify_workers(consumer, workers, count, block, claim_idle, drain)
 
 @app.command()
 def bulk_review(reviews: str):
-    """Add multiple reviews using multi-threading."""
+    """Add multiple reviews through the batched background writer."""
+    import ast  # To safely parse the tuple string input
+
     try:
         reviews_list = ast.literal_eval(reviews)  # Convert string input to list
         if not isinstance(reviews_list, list):
@@ -98,10 +302,24 @@ def bulk_review(reviews: str):
 
     add_reviews_multithreaded(reviews_list)
 
+@app.command("import-reviews")
+def import_reviews(
+    path: str,
+    fmt: str = typer.Option(None, "--format", help="jsonl or csv (default: from the file extension)"),
+    offset: int = typer.Option(None, help="Byte offset to resume from (default: the saved checkpoint)"),
+    chunk_size: int = typer.Option(5000, help="Rows validated and inserted per transaction"),
+):
+    """Stream reviews from a JSONL or CSV file (fields: user/user_id, media/media_id, rating, comment)."""
+    if fmt is not None and fmt not in ("jsonl", "csv"):
+        raise typer.BadParameter("choose jsonl or csv", param_hint="--format")
+    import_reviews_file(path, fmt=fmt, offset=offset, chunk_size=chunk_size)
+
 @app.command()
-def show_reviews_redis():
+def show_reviews_redis(media_id: int = None, user_id: int = None):
     """Fetch reviews using Redis as a cache store"""
-    reviews = get_reviews()  # Fetch reviews (Redis or DB)
+    from rich.table import Table
+
+    reviews = get_reviews(media_id=media_id, user_id=user_id)  # Fetch reviews (Redis or DB)
 
     table = Table(title="Media Reviews")
     table.add_column("User", style="cyan")
@@ -114,6 +332,288 @@ def show_reviews_redis():
 
     console.print(table)
 
+@app.command()
+def pool_stats():
+    """Run a pool health check and show connection pool counters."""
+    from rich.table import Table
+
+    health = check_pool_health()
+    stats = get_pool_stats()
+
+    table = Table(title="Connection Pool")
+    table.add_column("Metric", style="cyan")
+    table.add_column("Value", style="green", justify="right")
+
+    for key, value in {**stats, **health}.items():
+        table.add_row(key, f"{value:.2f}" if isinstance(value, float) else str(value))
+
+    console.print(table)
+
+@app.command()
+def bench_concurrency(
+    writers: int = 4,
+    readers: int = 4,
+    seconds: float = 3.0,
+    profiles: str = typer.Option("legacy,normal", help="Comma-separated durability profiles to compare"),
+):
+    """Benchmark concurrent review writes and reads under different durability profiles."""
+    from rich.table import Table
+    from benchmarks import bench_concurrency as run_bench
+
+    table = Table(title="SQLite Concurrency Benchmark")
+    table.add_column("Profile", style="cyan")
+    table.add_column("Journal", style="magenta")
+    table.add_column("Writes/s", style="green", justify="right")
+    table.add_column("Reads/s", style="green", justify="right")
+    table.add_column("Write p99 (ms)", style="yellow", justify="right")
+    table.add_column("Read p99 (ms)", style="yellow", justify="right")
+    table.add_column("Lock Errors", style="red", justify="right")
+
+    for profile in profiles.split(","):
+        result = run_bench(profile.strip(), writers=writers, readers=readers, seconds=seconds)
+        table.add_row(
+            result["durability"], result["journal_mode"],
+            f"{result['writes_per_sec']:.0f}", f"{result['reads_per_sec']:.0f}",
+            f"{result['write_p99_ms']:.2f}", f"{result['read_p99_ms']:.2f}",
+            str(result["locked_errors"]),
+        )
+
+    console.print(table)
+
+@app.command()
+def bench_writer(count: int = 50000, batch: int = 1000):
+    """Benchmark the batched review writer on a scratch database."""
+    from benchmarks import bench_review_writer
+
+    result = bench_review_writer(count, max_batch=batch)
+    console.print(
+        f"[bold green]{result['rows']} reviews in {result['seconds']:.2f}s "
+        f"({result['rows_per_sec']:.0f} reviews/s, {result['batches']} transactions)[/bold green]"
+    )
+
+@app.command()
+def cache_stats():
+    """Show hit ratio, size and eviction counters for each cache tier."""
+    from rich.table import Table
+    from cache import get_cache_stats
+
+    table = Table(title="Cache Tiers")
+    table.add_column("Tier", style="cyan")
+    table.add_column("Metric", style="magenta")
+    table.add_column("Value", style="green", justify="right")
+
+    for tier, stats in get_cache_stats().items():
+        for key, value in stats.items():
+            table.add_row(tier, key, f"{value:.2f}" if isinstance(value, float) else str(value))
+
+    console.print(table)
+
+@app.command()
+def cache_check(rounds: int = 200, readers: int = 4):
+    """Check that no stale cached review list survives a write."""
+    from benchmarks import check_cache_coherence
+
+    result = check_cache_coherence(rounds=rounds, readers=readers)
+    style = "bold red" if result["stale_reads"] else "bold green"
+    console.print(
+        f"[{style}]{result['stale_reads']} stale reads out of {result['reads']} "
+        f"post-write reads over {result['rounds']} writes.[/{style}]"
+    )
+    if result["stale_reads"]:
+        raise typer.Exit(code=1)
+
+@app.command()
+def stampede_check(callers: int = 32):
+    """Check that a cold or expired cache key triggers exactly one rebuild."""
+    from benchmarks import check_stampede
+
+    result = check_stampede(callers=callers)
+    ok = result["cold_builds"] == 1 and result["stale_builds"] == 1
+    style = "bold green" if ok else "bold red"
+    console.print(
+        f"[{style}]{result['callers']} concurrent callers: {result['cold_builds']} rebuild(s) for a cold key, "
+        f"{result['stale_builds']} for a soft-expired key "
+        f"(max wait while stale {result['stale_max_wait_ms']:.1f} ms).[/{style}]"
+    )
+    if not ok:
+        raise typer.Exit(code=1)
+
+@app.command()
+def bench_codecs(rows: int = 200000):
+    """Compare cache payload codecs: bytes on the wire and encode/decode time."""
+    from rich.table import Table
+    from benchmarks import bench_codecs as run_bench
+
+    table = Table(title=f"Cache Codecs ({rows} reviews)")
+    table.add_column("Codec", style="cyan")
+    table.add_column("Bytes", style="green", justify="right")
+    table.add_column("Encode (ms)", style="yellow", justify="right")
+    table.add_column("Decode (ms)", style="yellow", justify="right")
+
+    for result in run_bench(rows=rows):
+        table.add_row(result["codec"], f"{result['bytes']:,}", f"{result['encode_ms']:.1f}", f"{result['decode_ms']:.1f}")
+
+    console.print(table)
+
+@app.command()
+def bench_search(titles: int = 1000000):
+    """Compare full-text search with the LIKE scan on a synthetic catalog."""
+    from rich.table import Table
+    from benchmarks import bench_search as run_bench
+
+    result = run_bench(titles=titles)
+    table = Table(title=f"Title Search ({result['titles']:,} titles, loaded in {result['load_seconds']:.1f}s)")
+    table.add_column("Query", style="cyan")
+    table.add_column("LIKE matches", style="magenta", justify="right")
+    table.add_column("FTS matches", style="magenta", justify="right")
+    table.add_column("LIKE (ms)", style="yellow", justify="right")
+    table.add_column("FTS (ms)", style="green", justify="right")
+    table.add_column("Speedup", style="green", justify="right")
+
+    for row in result["queries"]:
+        speedup = row["like_ms"] / row["fts_ms"] if row["fts_ms"] else float("inf")
+        table.add_row(row["query"], f"{row['like_matches']:,}", f"{row['fts_matches']:,}",
+                      f"{row['like_ms']:.1f}", f"{row['fts_ms']:.2f}", f"{speedup:.0f}x")
+
+    console.print(table)
+
+@app.command()
+def bench_fuzzy(titles: int = 1000000):
+    """Measure typo-tolerant title lookups on a synthetic catalog."""
+    from rich.table import Table
+    from benchmarks import bench_fuzzy as run_bench
+
+    result = run_bench(titles=titles)
+    console.print(
+        f"[bold blue]{result['titles']:,} titles: build {result['build_seconds']:.1f}s, "
+        f"snapshot {result['snapshot_bytes'] / 2**20:.1f} MiB, load {result['load_seconds'] * 1000:.0f} ms[/bold blue]"
+    )
+
+    console.print(
+        f"[bold green]Lookups: p50 {result['p50_ms']:.3f} ms, p99 {result['p99_ms']:.3f} ms, "
+        f"original title found {result['recall']:.0%} of the time[/bold green]"
+    )
+
+    table = Table(title="Sample Lookups")
+    table.add_column("Query", style="cyan")
+    table.add_column("Best Match", style="magenta")
+    table.add_column("Typos", style="yellow", justify="center")
+
+    for row in result["examples"]:
+        table.add_row(row["query"], row["match"] or "-", "-" if row["match"] is None else str(row["distance"]))
+
+    console.print(table)
+
+@app.command()
+def bench_autocomplete(entries: int = 1000000):
+    """Measure prefix completion and insert latency on a synthetic catalog."""
+    from benchmarks import bench_autocomplete as run_bench
+
+    result = run_bench(entries=entries)
+    console.print(
+        f"[bold blue]{result['entries']:,} entries indexed in {result['build_seconds']:.1f}s[/bold blue]\n"
+        f"[bold green]Completions: p50 {result['p50_us']:.0f} µs, p99 {result['p99_us']:.0f} µs; "
+        f"inserts: p50 {result['insert_p50_us']:.0f} µs[/bold green]"
+    )
+
+@app.command()
+def bench_cf(reviews: int = 500000, users: int = 20000, media: int = 5000):
+    """Measure item-item neighbour building and cf recommendation latency on synthetic ratings."""
+    from benchmarks import bench_cf as run_bench
+
+    result = run_bench(users=users, media=media, reviews=reviews)
+    console.print(
+        f"[bold blue]{result['reviews']:,} reviews -> {result['pairs']:,} neighbour pairs over "
+        f"{result['media']:,} media in {result['build_seconds']:.1f}s "
+        f"({result['size_mb']:.1f} MB, loads in {result['load_ms']:.0f} ms)[/bold blue]\n"
+        f"[bold green]Recommendations: p50 {result['p50_ms']:.2f} ms, p99 {result['p99_ms']:.2f} ms[/bold green]"
+    )
+
+@app.command()
+def bench_notify(reviews: int = 100000, media: int = 1000, subscribers: int = 5, baseline: int = 2000):
+    """Measure the notification dispatcher against one thread per review."""
+    from benchmarks import bench_notifications
+
+    result = bench_notifications(reviews=reviews, media=media, subscribers=subscribers, baseline=baseline)
+    console.print(
+        f"[bold green]Dispatcher: {result['reviews']:,} reviews in {result['seconds']:.2f}s "
+        f"({result['per_sec']:,.0f}/s) -> {result['fanouts']:,} fan-out groups, "
+        f"{result['notifications']:,} notifications; peak {result['peak_threads']} threads, "
+        f"max depth {result['max_depth']:,}, max lag {result['max_lag_ms']:.0f} ms, "
+        f"producer blocked {result['blocked_seconds']:.2f}s[/bold green]"
+    )
+    if result["baseline"]:
+        console.print(
+            f"[bold yellow]Thread per review: {result['baseline']:,} reviews at {result['baseline_per_sec']:,.0f}/s, "
+            f"peak {result['baseline_peak_threads']} threads[/bold yellow]"
+        )
+
+@app.command()
+def bench_fanout(subscribers: int = 100000, reviews: int = 10, budget_ms: float = 20):
+    """Measure fan-out to one heavily subscribed media: SQLite join vs cached Redis set."""
+    from benchmarks import bench_fanout as run_bench
+
+    result = run_bench(subscribers=subscribers, reviews=reviews, budget=budget_ms / 1000)
+    console.print(
+        f"[bold yellow]SQLite join per review: {result['sql_ms']:.1f} ms for {result['subscribers']:,} subscribers[/bold yellow]\n"
+        f"[bold green]Cached set: {result['cached_ms']:.1f} ms per review after a one-off {result['load_ms']:.0f} ms load[/bold green]\n"
+        f"[bold green]With a {budget_ms:g} ms budget: {result['slices_per_review']:.1f} slices per review, "
+        f"worker held at most {result['max_slice_ms']:.1f} ms at a time[/bold green]"
+    )
+
+@app.command()
+def bench_digest(reviews: int = 100000, media: int = 100, subscribers: int = 20, window: float = 3600,
+                 max_buffers: int = DIGEST_MAX_BUFFERS, overflow: str = "flush"):
+    """Compare notification log volume per review and in digest mode."""
+    from benchmarks import bench_digest as run_bench
+
+    if overflow not in OVERFLOW_POLICIES:
+        raise typer.BadParameter(f"choose one of: {', '.join(OVERFLOW_POLICIES)}", param_hint="--overflow")
+    result = run_bench(reviews=reviews, media=media, subscribers=subscribers, window=window,
+                       max_buffers=max_buffers, overflow=overflow)
+    console.print(
+        f"[bold yellow]Per review: {result['plain_entries']:,} log entries for {result['reviews']:,} reviews "
+        f"({result['plain_seconds']:.2f}s)[/bold yellow]\n"
+        f"[bold green]Digest ({window:g}s window): {result['digest_entries']:,} log entries from "
+        f"{result['events']:,} events ({result['digest_seconds']:.2f}s) | peak {result['max_buffers']:,} buffers, "
+        f"{result['early_flushes']:,} early flushes, {result['dropped']:,} dropped[/bold green]"
+    )
+
+@app.command()
+def bench_logging(threads: int = 8, records: int = 20000, queue_size: int = None):
+    """Compare a synchronous FileHandler with the queued, batched log writer."""
+    from benchmarks import bench_logging as run_bench
+
+    result = run_bench(threads=threads, records=records, queue_size=queue_size)
+    console.print(
+        f"[bold yellow]FileHandler: {result['records']:,} records in {result['sync_seconds']:.2f}s, "
+        f"{result['sync_us']:.1f} us per call[/bold yellow]\n"
+        f"[bold green]Queued writer: {result['queued_seconds']:.2f}s, {result['queued_us']:.1f} us per call "
+        f"(+{result['drain_seconds']:.2f}s to drain); {result['written']:,} written in {result['batches']:,} batches, "
+        f"{result['dropped']:,} dropped[/bold green]"
+    )
+
+@app.command()
+def bench_stream(reviews: int = 20000, media: int = 1000, subscribers: int = 5, workers: str = "1,2,4,8",
+                 delivery_ms: float = 0.2):
+    """Measure notification stream throughput as consumers are added."""
+    from rich.table import Table
+    from benchmarks import bench_stream_workers
+
+    try:
+        counts = [int(n) for n in workers.split(",")]
+    except ValueError:
+        raise typer.BadParameter("expected a comma-separated list of worker counts", param_hint="--workers")
+    table = Table(title=f"{reviews:,} reviews, {delivery_ms} ms per delivery")
+    for column in ("Workers", "Seconds", "Reviews/s", "Publish/s", "Notifications", "Acked", "Pending"):
+        table.add_column(column, justify="right")
+    for result in bench_stream_workers(reviews=reviews, media=media, subscribers=subscribers,
+                                       workers=counts, delivery_ms=delivery_ms):
+        table.add_row(str(result["workers"]), f"{result['seconds']:.2f}", f"{result['per_sec']:,.0f}",
+                      f"{result['publish_per_sec']:,.0f}", f"{result['notifications']:,}",
+                      f"{result['acked']:,}", str(result["pending"]))
+    console.print(table)
+
 @app.command()
 def add_sample_media():
     """Adds predefined media samples to the database."""
@@ -219,5 +719,57 @@ def add_sample_reviews():
     typer.echo("Sample reviews added successfully!")
 
 
+def profile_startup(args, top=15):
+    """Re-run ``main.py args`` under ``-X importtime`` and print the slowest imports.
+
+    Returns the command's exit code.
+    """
+    from rich.table import Table
+    import subprocess
+    import sys
+    import time
+
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", __file__, *args], stderr=subprocess.PIPE, text=True)
+    elapsed = time.perf_counter() - started
+
+    imports = []  # (self us, cumulative us, name, depth)
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            sys.stderr.write(line + "\n")
+            continue
+        fields = line[len("import time:"):].split("|")
+        if not fields[0].strip().isdigit():
+            continue  # the header
+        name = fields[2].rstrip()
+        imports.append((int(fields[0]), int(fields[1]), name.strip(), (len(name) - len(name.lstrip())) // 2))
+
+    roots = sorted((entry for entry in imports if entry[3] == 0), key=lambda entry: -entry[1])
+    table = Table(title=f"Startup imports ({len(imports)} modules)")
+    table.add_column("Top-level import", style="cyan")
+    table.add_column("Cumulative (ms)", justify="right")
+    table.add_column("Share", justify="right")
+    for _, cumulative, name, _ in roots[:top]:
+        table.add_row(name, f"{cumulative / 1000:.1f}", f"{cumulative / 1e4 / elapsed:.0f}%")
+    console.print(table)
+
+    table = Table(title="Slowest modules by own time")
+    table.add_column("Module", style="cyan")
+    table.add_column("Self (ms)", justify="right")
+    for own, _, name, _ in sorted(imports, key=lambda entry: -entry[0])[:top]:
+        table.add_row(name, f"{own / 1000:.1f}")
+    console.print(table)
+
+    total_imports = sum(entry[1] for entry in roots) / 1000
+    console.print(f"[bold blue]Wall time {elapsed * 1000:.0f} ms, of which imports {total_imports:.0f} ms "
+                  f"(interpreter start-up and the command itself make up the rest).[/bold blue]")
+    return result.returncode
+
+
 if __name__ == "__main__":
+    import sys
+
+    # Handled before typer runs so the profile covers typer's own import
+    if "--profile-startup" in sys.argv[1:]:
+        sys.exit(profile_startup([arg for arg in sys.argv[1:] if arg != "--profile-startup"]))
     app()
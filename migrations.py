@@ -0,0 +1,354 @@
+import re
+import sqlite3
+
+# Time-decayed ratings: a review's weight doubles every DECAY_HALF_LIFE
+# seconds after DECAY_EPOCH, so dividing the stored sums by the weight of
+# "now" gives each review a weight that halves every half-life. Changing
+# either constant needs a rebuild-stats.
+DECAY_EPOCH = 1767225600  # 2026-01-01 UTC
+DECAY_HALF_LIFE = 90 * 24 * 3600
+
+
+def _decay_weight(row):
+    """SQL for the decay weight of a review row ("new", "old" or "reviews").
+
+    Reviews written before created_at existed count as written at DECAY_EPOCH.
+    """
+    return f"pow(2.0, (COALESCE({row}.created_at, {DECAY_EPOCH}) - {DECAY_EPOCH}) / {float(DECAY_HALF_LIFE)})"
+
+
+# Wilson lower bound: z for a 95% interval, and the ratings counted as positive
+WILSON_Z = 1.96
+WILSON_POSITIVE = 4
+
+
+def _prior(column):
+    return f"(SELECT {column} FROM ranking_priors)"
+
+
+def _bayesian_score(row, count, total):
+    return (f"CASE WHEN {row}.rating_count > 0 THEN ({_prior('weight')} * {_prior('mean')} + {total})"
+            f" / ({_prior('weight')} + {count}) END")
+
+
+def _score_assignments(row):
+    """SET clause computing the stored ranking scores of a media_stats row.
+
+    NULL for media without ratings. The Bayesian and decayed scores use the
+    prior in ranking_priors (see ranking.refresh_scores), so they are NULL
+    until it has been computed.
+    """
+    count = f"{row}.rating_count"
+    share = f"(({' + '.join(f'{row}.r{n}' for n in range(WILSON_POSITIVE, 6))}) * 1.0 / {count})"
+    z2 = WILSON_Z * WILSON_Z
+    wilson = (f"CASE WHEN {count} > 0 THEN ({share} + {z2 / 2} / {count} - {WILSON_Z} * "
+              f"pow({share} * (1 - {share}) / {count} + {z2 / 4} / ({count} * {count}), 0.5)) / (1 + {z2} / {count}) END")
+    factor = _prior("decay_factor")
+    return f"""
+                wilson_score = {wilson},
+                bayesian_score = {_bayesian_score(row, count, f"{row}.rating_sum")},
+                decayed_score = {_bayesian_score(row, f"{row}.decay_weight * {factor}", f"{row}.decay_sum * {factor}")}"""
+
+
+# Recomputes every stored score, e.g. after the prior changed
+REFRESH_SCORES_SQL = f"UPDATE media_stats SET {_score_assignments('media_stats')}"
+
+
+# media_stats rows as they should be, computed from reviews
+_V4_STATS_COLUMNS = "media_id, review_count, rating_count, rating_sum, r1, r2, r3, r4, r5, avg_rating"
+_V4_STATS_SELECT = """
+    SELECT media.id AS media_id, COUNT(reviews.id), COUNT(reviews.rating), COALESCE(SUM(reviews.rating), 0),
+           COUNT(CASE WHEN reviews.rating = 1 THEN 1 END), COUNT(CASE WHEN reviews.rating = 2 THEN 1 END),
+           COUNT(CASE WHEN reviews.rating = 3 THEN 1 END), COUNT(CASE WHEN reviews.rating = 4 THEN 1 END),
+           COUNT(CASE WHEN reviews.rating = 5 THEN 1 END), COALESCE(AVG(reviews.rating), 0){extra}
+    FROM media LEFT JOIN reviews ON reviews.media_id = media.id
+    GROUP BY media.id
+"""
+MEDIA_STATS_COLUMNS = _V4_STATS_COLUMNS + ", decay_sum, decay_weight"
+MEDIA_STATS_SELECT = _V4_STATS_SELECT.format(extra=f""",
+           COALESCE(SUM(reviews.rating * {_decay_weight("reviews")}), 0),
+           COALESCE(SUM((reviews.rating IS NOT NULL) * {_decay_weight("reviews")}), 0)""")
+# Columns compared when checking for drift; the float decay sums depend on
+# summation order, so they are compared to 9 significant digits
+MEDIA_STATS_CHECKED = _V4_STATS_COLUMNS + ", printf('%.9e', decay_sum), printf('%.9e', decay_weight)"
+# Used to backfill and to repair
+REBUILD_MEDIA_STATS_SQL = f"INSERT INTO media_stats ({MEDIA_STATS_COLUMNS}) {MEDIA_STATS_SELECT};"
+
+
+def _apply_review(row, sign, decay=True):
+    """UPDATE adding (sign "+") or removing (sign "-") one review from its media_stats row."""
+    histogram = ", ".join(f"r{n} = r{n} {sign} ({row}.rating IS {n})" for n in range(1, 6))
+    decayed = f"""
+                decay_sum = decay_sum {sign} COALESCE({row}.rating, 0) * {_decay_weight(row)},
+                decay_weight = decay_weight {sign} ({row}.rating IS NOT NULL) * {_decay_weight(row)},""" if decay else ""
+    return f"""
+            UPDATE media_stats SET
+                review_count = review_count {sign} 1,
+                rating_count = rating_count {sign} ({row}.rating IS NOT NULL),
+                rating_sum = rating_sum {sign} COALESCE({row}.rating, 0),
+                {histogram},{decayed}
+                avg_rating = COALESCE((rating_sum {sign} COALESCE({row}.rating, 0)) * 1.0
+                                      / NULLIF(rating_count {sign} ({row}.rating IS NOT NULL), 0), 0)
+            WHERE media_id = {row}.media_id;"""
+
+
+def _review_triggers(decay):
+    """media_stats triggers on reviews. Every media row has a stats row (see
+    media_stats_media_insert), so reviews only ever update one; reviews of
+    unknown media are ignored."""
+    columns = "media_id, rating, created_at" if decay else "media_id, rating"
+    return f"""
+        CREATE TRIGGER IF NOT EXISTS media_stats_review_insert AFTER INSERT ON reviews BEGIN{_apply_review("new", "+", decay)}
+        END;
+        CREATE TRIGGER IF NOT EXISTS media_stats_review_delete AFTER DELETE ON reviews BEGIN{_apply_review("old", "-", decay)}
+        END;
+        CREATE TRIGGER IF NOT EXISTS media_stats_review_update AFTER UPDATE OF {columns} ON reviews BEGIN{_apply_review("old", "-", decay)}{_apply_review("new", "+", decay)}
+        END;
+    """
+
+
+def _mark_dirty(row):
+    return f"""
+            INSERT INTO recommendations_dirty (user_id) VALUES ({row}.user_id)
+                ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+            INSERT OR IGNORE INTO recommendations_dirty_media (media_id) VALUES ({row}.media_id);"""
+
+
+def _dirty_triggers():
+    """Triggers marking a reviewer's recommendations dirty on any review change."""
+    return f"""
+        CREATE TRIGGER IF NOT EXISTS recommendations_review_insert AFTER INSERT ON reviews BEGIN{_mark_dirty("new")}
+        END;
+        CREATE TRIGGER IF NOT EXISTS recommendations_review_delete AFTER DELETE ON reviews BEGIN{_mark_dirty("old")}
+        END;
+        CREATE TRIGGER IF NOT EXISTS recommendations_review_update AFTER UPDATE OF user_id, media_id, rating ON reviews BEGIN{_mark_dirty("old")}{_mark_dirty("new")}
+        END;
+    """
+
+
+# Ordered schema migrations: (version, description, SQL script).
+# The applied version is tracked in SQLite's PRAGMA user_version.
+MIGRATIONS = [
+    (1, "Covering indexes for review and subscription lookups", """
+        CREATE INDEX IF NOT EXISTS idx_reviews_media_rating ON reviews (media_id, rating);
+        CREATE INDEX IF NOT EXISTS idx_reviews_user_media ON reviews (user_id, media_id);
+        CREATE INDEX IF NOT EXISTS idx_subscriptions_media_user ON subscriptions (media_id, user_id);
+    """),
+    (2, "Case-insensitive name/title lookup indexes", """
+        CREATE INDEX IF NOT EXISTS idx_users_name_lower ON users (LOWER(name));
+        CREATE INDEX IF NOT EXISTS idx_media_title_lower ON media (LOWER(title));
+        CREATE INDEX IF NOT EXISTS idx_media_title ON media (title);
+    """),
+    (3, "FTS5 full-text index over media titles and review comments", """
+        CREATE VIRTUAL TABLE IF NOT EXISTS media_fts USING fts5(
+            title, content='media', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        );
+        CREATE VIRTUAL TABLE IF NOT EXISTS reviews_fts USING fts5(
+            comment, content='reviews', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        );
+
+        -- External-content tables: keep the index in step with the base rows
+        CREATE TRIGGER IF NOT EXISTS media_fts_insert AFTER INSERT ON media BEGIN
+            INSERT INTO media_fts (rowid, title) VALUES (new.id, new.title);
+        END;
+        CREATE TRIGGER IF NOT EXISTS media_fts_delete AFTER DELETE ON media BEGIN
+            INSERT INTO media_fts (media_fts, rowid, title) VALUES ('delete', old.id, old.title);
+        END;
+        CREATE TRIGGER IF NOT EXISTS media_fts_update AFTER UPDATE OF title ON media BEGIN
+            INSERT INTO media_fts (media_fts, rowid, title) VALUES ('delete', old.id, old.title);
+            INSERT INTO media_fts (rowid, title) VALUES (new.id, new.title);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS reviews_fts_insert AFTER INSERT ON reviews BEGIN
+            INSERT INTO reviews_fts (rowid, comment) VALUES (new.id, new.comment);
+        END;
+        CREATE TRIGGER IF NOT EXISTS reviews_fts_delete AFTER DELETE ON reviews BEGIN
+            INSERT INTO reviews_fts (reviews_fts, rowid, comment) VALUES ('delete', old.id, old.comment);
+        END;
+        CREATE TRIGGER IF NOT EXISTS reviews_fts_update AFTER UPDATE OF comment ON reviews BEGIN
+            INSERT INTO reviews_fts (reviews_fts, rowid, comment) VALUES ('delete', old.id, old.comment);
+            INSERT INTO reviews_fts (rowid, comment) VALUES (new.id, new.comment);
+        END;
+
+        -- Index rows that existed before this migration
+        INSERT INTO media_fts (media_fts) VALUES ('rebuild');
+        INSERT INTO reviews_fts (reviews_fts) VALUES ('rebuild');
+    """),
+    (4, "Per-media rating aggregates maintained by triggers", f"""
+        CREATE TABLE IF NOT EXISTS media_stats (
+            media_id INTEGER PRIMARY KEY REFERENCES media(id),
+            review_count INTEGER NOT NULL DEFAULT 0,
+            rating_count INTEGER NOT NULL DEFAULT 0,
+            rating_sum INTEGER NOT NULL DEFAULT 0,
+            r1 INTEGER NOT NULL DEFAULT 0,
+            r2 INTEGER NOT NULL DEFAULT 0,
+            r3 INTEGER NOT NULL DEFAULT 0,
+            r4 INTEGER NOT NULL DEFAULT 0,
+            r5 INTEGER NOT NULL DEFAULT 0,
+            avg_rating REAL NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_media_stats_avg ON media_stats (avg_rating DESC);
+
+        CREATE TRIGGER IF NOT EXISTS media_stats_media_insert AFTER INSERT ON media BEGIN
+            INSERT OR IGNORE INTO media_stats (media_id) VALUES (new.id);
+        END;
+        CREATE TRIGGER IF NOT EXISTS media_stats_media_delete AFTER DELETE ON media BEGIN
+            DELETE FROM media_stats WHERE media_id = old.id;
+        END;
+
+        {_review_triggers(decay=False)}
+
+        INSERT INTO media_stats ({_V4_STATS_COLUMNS}) {_V4_STATS_SELECT.format(extra="")};
+    """),
+    (5, "Review timestamps and time-decayed rating sums", f"""
+        ALTER TABLE reviews ADD COLUMN created_at INTEGER;
+        ALTER TABLE media_stats ADD COLUMN decay_sum REAL NOT NULL DEFAULT 0;
+        ALTER TABLE media_stats ADD COLUMN decay_weight REAL NOT NULL DEFAULT 0;
+
+        DROP TRIGGER IF EXISTS media_stats_review_insert;
+        DROP TRIGGER IF EXISTS media_stats_review_delete;
+        DROP TRIGGER IF EXISTS media_stats_review_update;
+        {_review_triggers(decay=True)}
+
+        DELETE FROM media_stats;
+        {REBUILD_MEDIA_STATS_SQL}
+    """),
+    (6, "Precomputed recommendations with dirty tracking", f"""
+        -- Top-N per user as packed arrays (see recommendation_cache.py)
+        CREATE TABLE IF NOT EXISTS recommendations (
+            user_id INTEGER PRIMARY KEY,
+            media_ids BLOB NOT NULL,
+            scores BLOB NOT NULL,
+            refreshed_at REAL NOT NULL
+        );
+        -- Users whose entry is out of date; version changes on every new mark
+        -- so a refresh never clears a mark made while it was computing
+        CREATE TABLE IF NOT EXISTS recommendations_dirty (
+            user_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        );
+        -- Reviewed media whose neighbours' raters need a refresh once the
+        -- neighbour model has been rebuilt
+        CREATE TABLE IF NOT EXISTS recommendations_dirty_media (
+            media_id INTEGER PRIMARY KEY
+        );
+
+        {_dirty_triggers()}
+
+        INSERT OR IGNORE INTO recommendations_dirty (user_id) SELECT DISTINCT user_id FROM reviews;
+    """),
+    (7, "Import checkpoints committed with the imported rows", """
+        -- Byte offset after the last committed chunk of an interrupted import
+        CREATE TABLE IF NOT EXISTS import_checkpoints (
+            path TEXT PRIMARY KEY,
+            byte_offset INTEGER NOT NULL,
+            updated_at REAL NOT NULL
+        );
+    """),
+    (8, "Stored ranking scores with indexes for top-k reads", f"""
+        -- Global prior of the Bayesian and decayed scores, as of a point in time
+        CREATE TABLE IF NOT EXISTS ranking_priors (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            mean REAL NOT NULL,
+            weight REAL NOT NULL,
+            decay_factor REAL NOT NULL,
+            as_of REAL NOT NULL
+        );
+        ALTER TABLE media_stats ADD COLUMN wilson_score REAL;
+        ALTER TABLE media_stats ADD COLUMN bayesian_score REAL;
+        ALTER TABLE media_stats ADD COLUMN decayed_score REAL;
+        CREATE INDEX IF NOT EXISTS idx_media_stats_wilson ON media_stats (wilson_score DESC);
+        CREATE INDEX IF NOT EXISTS idx_media_stats_bayesian ON media_stats (bayesian_score DESC);
+        CREATE INDEX IF NOT EXISTS idx_media_stats_decayed ON media_stats (decayed_score DESC);
+
+        CREATE TRIGGER IF NOT EXISTS media_stats_scores
+        AFTER UPDATE OF rating_count, rating_sum, r1, r2, r3, r4, r5, decay_sum, decay_weight ON media_stats BEGIN
+            UPDATE media_stats SET {_score_assignments("new")}
+            WHERE media_id = new.media_id;
+        END;
+
+        {REFRESH_SCORES_SQL};
+    """),
+]
+
+# Hot queries from logic.py, checked against the query planner by `migrate`
+PLANNED_QUERIES = {
+    "add_user lookup": ("SELECT id FROM users WHERE LOWER(name) = LOWER(?)", ("x",)),
+    "add_media lookup": ("SELECT id FROM media WHERE LOWER(title) = LOWER(?)", ("x",)),
+    "subscribe_user user": ("SELECT id FROM users WHERE name = ?", ("x",)),
+    "subscribe_user media": ("SELECT id FROM media WHERE title = ?", ("x",)),
+    "get_top_rated_media": ("""
+        SELECT media.id, media.title, media.type, media_stats.avg_rating
+        FROM media_stats
+        JOIN media ON media.id = media_stats.media_id
+        ORDER BY media_stats.avg_rating DESC
+        LIMIT ?
+    """, (5,)),
+    "top_media (wilson)": ("""
+        SELECT media_stats.media_id, media.title, media.type, media_stats.wilson_score, media_stats.rating_count
+        FROM media_stats CROSS JOIN media ON media.id = media_stats.media_id
+        WHERE media_stats.wilson_score IS NOT NULL AND media_stats.rating_count > 0 AND media.type = ?
+        ORDER BY media_stats.wilson_score DESC
+        LIMIT ?
+    """, ("Movie", 5)),
+    "notify_subscribers": ("""
+        SELECT users.name FROM subscriptions
+        JOIN users ON subscriptions.user_id = users.id
+        WHERE subscriptions.media_id = ?
+    """, (1,)),
+    "search (fts)": ("""
+        SELECT media.id, media.title, media.type, bm25(media_fts) AS score
+        FROM media_fts JOIN media ON media.id = media_fts.rowid
+        WHERE media_fts MATCH ? ORDER BY score LIMIT 10
+    """, ('"x"*',)),
+    "get_recommendations reviewed": ("""
+        SELECT DISTINCT media.title
+        FROM reviews
+        JOIN media ON reviews.media_id = media.id
+        WHERE reviews.user_id = ?
+    """, (1,)),
+}
+
+_INDEX_RE = re.compile(r"USING (?:COVERING )?INDEX (\w+)|USING (INTEGER PRIMARY KEY)")
+
+
+def get_schema_version(conn):
+    """Return the schema version recorded in the database."""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def apply_migrations(conn):
+    """Apply pending migrations in order. Returns the list of applied (version, description)."""
+    applied = []
+    current = get_schema_version(conn)
+
+    for version, description, script in MIGRATIONS:
+        if version <= current:
+            continue
+
+        # Each migration and its version bump commit together or not at all
+        try:
+            conn.executescript(f"BEGIN; {script} PRAGMA user_version = {version}; COMMIT;")
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        applied.append((version, description))
+
+    return applied
+
+
+def explain_queries(conn):
+    """Return (query name, plan detail, indexes used) for each planned query."""
+    report = []
+    for name, (sql, params) in PLANNED_QUERIES.items():
+        plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+        details = [row[3] for row in plan]
+        indexes = []
+        for detail in details:
+            for match in _INDEX_RE.finditer(detail):
+                indexes.append(match.group(1) or match.group(2))
+        report.append((name, "; ".join(details), indexes))
+    return report
@@ -0,0 +1,601 @@
+import json
+import os
+import queue
+import socket
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from lazy import lazy_import
+
+redis = lazy_import("redis")
+
+from db import db_connection
+from defaults import (DELIVERY_MODES, DIGEST_MAX_BUFFERS, OVERFLOW_POLICIES, STREAM_BATCH, BLOCK_MS,
+                      CLAIM_IDLE_MS)
+import subscribers
+from logger import logger
+from redis_cache import get_redis
+
+# Events waiting for a worker; producers block (backpressure) when it is full
+MAX_QUEUE = 10000
+WORKERS = 4
+# Seconds a worker keeps collecting events after its first one, so bursts on
+# the same media become one fan-out
+COALESCE_WINDOW = 0.05
+MAX_BATCH = 1000
+# Seconds a fan-out may deliver before the rest of a media's subscribers
+# are queued to resume later, so a media with 100k subscribers can't hold a
+# worker, and every review behind it, for its whole list
+FANOUT_BUDGET = 0.2
+
+# Digest mode: a subscriber's events for one media are summed up and sent
+# as one summary per window instead of one entry per review
+DIGEST_WINDOW = 300
+
+# Durable pipeline: reviews are appended to a Redis stream and notify-worker
+# processes consume it through one consumer group
+STREAM_KEY = "notifications:reviews"
+GROUP = "notifiers"
+# Approximate cap on the stream's length; acknowledged entries are only trimmed
+STREAM_MAXLEN = 1000000
+
+_STOP = object()
+
+
+def review_details(user_id, media_id, rating, comment):
+    """The event for one review; JSON-serializable so it can go through the stream."""
+    return {"user_id": user_id, "media_id": media_id, "rating": rating, "comment": comment}
+
+
+def describe(details):
+    if not isinstance(details, dict):
+        return str(details)
+    return (f"User '{details['user_id']}' reviewed '{details['media_id']}' "
+            f"with Rating {details['rating']}: {details['comment']}")
+
+
+def log_notification(user_name, media_id, details):
+    """Default sink: one log entry per subscriber for a media's new reviews."""
+    if len(details) == 1:
+        logger.info(f"Notification: User '{user_name}', a new review has been added for Media ID {media_id}.")
+    else:
+        logger.info(f"Notification: User '{user_name}', {len(details)} new reviews have been added for Media ID {media_id}.")
+    for detail in details:
+        logger.info(f"Review Details: {describe(detail)}")
+
+
+def log_digest(user_name, media_id, digest):
+    """Default digest sink: one log entry per subscriber and media per window."""
+    average = f"average rating {digest['average']:.1f}" if digest["average"] is not None else "no ratings"
+    latest = f", latest: {digest['latest']}" if digest["latest"] is not None else ""
+    logger.info(f"Digest: User '{user_name}', {digest['reviews']} new review(s) for Media ID {media_id} "
+                f"in the last {digest['seconds']:.0f}s, {average}{latest}")
+
+
+class DigestSink:
+    """A sink that buffers events per (subscriber, media) and hands ``deliver``
+    one summary per ``window`` seconds: review count, average rating and
+    latest comment.
+
+    Each buffer is a few counters, and at most ``max_buffers`` are held;
+    beyond that ``overflow`` decides between flushing the oldest buffer
+    early and dropping the new event. Buffered events live in memory only,
+    so a crash loses up to one window of digests.
+    """
+
+    def __init__(self, window=DIGEST_WINDOW, max_buffers=DIGEST_MAX_BUFFERS, overflow="flush", deliver=log_digest):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {overflow!r}, expected one of {', '.join(OVERFLOW_POLICIES)}")
+        self.window = window
+        self.max_buffers = max_buffers
+        self.overflow = overflow
+        self.deliver = deliver
+        # Insertion order is first-event order, so due buffers are at the front
+        self._buffers = OrderedDict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._metrics = {"events": 0, "digests": 0, "early_flushes": 0, "dropped": 0, "max_buffers": 0}
+
+    def __call__(self, user_name, media_id, details):
+        key = (user_name, media_id)
+        evicted = None
+        with self._lock:
+            buffer = self._buffers.get(key)
+            if buffer is None:
+                if len(self._buffers) >= self.max_buffers:
+                    if self.overflow == "drop":
+                        self._metrics["dropped"] += len(details)
+                        return
+                    evicted = self._buffers.popitem(last=False)
+                    self._metrics["early_flushes"] += 1
+                buffer = self._buffers[key] = [time.monotonic(), 0, 0, 0, None]
+                self._metrics["max_buffers"] = max(self._metrics["max_buffers"], len(self._buffers))
+            for detail in details:
+                buffer[1] += 1
+                rating = detail.get("rating") if isinstance(detail, dict) else None
+                if rating is not None:
+                    buffer[2] += 1
+                    buffer[3] += rating
+                buffer[4] = detail.get("comment") if isinstance(detail, dict) else detail
+            self._metrics["events"] += len(details)
+        if evicted:
+            self._emit(*evicted)
+
+    def _emit(self, key, buffer):
+        started, reviews, rated, rating_sum, latest = buffer
+        digest = {"reviews": reviews, "average": rating_sum / rated if rated else None, "latest": latest,
+                  "seconds": time.monotonic() - started}
+        self.deliver(*key, digest)
+        with self._lock:
+            self._metrics["digests"] += 1
+
+    def flush(self, everything=False):
+        """Deliver buffers whose window has passed (all of them with ``everything``). Returns how many."""
+        due = []
+        cutoff = time.monotonic() - self.window
+        with self._lock:
+            while self._buffers:
+                key, buffer = next(iter(self._buffers.items()))
+                if not everything and buffer[0] > cutoff:
+                    break
+                due.append(self._buffers.popitem(last=False))
+        for key, buffer in due:
+            self._emit(key, buffer)
+        return len(due)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="notification-digest", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(min(self.window, 1.0)):
+            self.flush()
+
+    def metrics(self):
+        with self._lock:
+            return dict(self._metrics, buffered=len(self._buffers))
+
+    def close(self, timeout=None):
+        """Stop the flusher and deliver every buffer, due or not."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush(everything=True)
+
+
+def _fan_out_sqlite(by_media, sink):
+    with db_connection() as conn:
+        found = subscribers.subscribers_of(conn, by_media)
+    sent = 0
+    for media_id, details in by_media.items():
+        for name in found.get(media_id, ()):
+            sink(name, media_id, details)
+            sent += 1
+    return sent
+
+
+def fan_out(by_media, sink=log_notification, budget=FANOUT_BUDGET, cursors=None):
+    """Deliver {media_id: [review details]} to every subscriber.
+
+    Subscribers are SSCANned from the media's Redis set a chunk at a time
+    (or read from SQLite if Redis is unreachable). Each media gets at least
+    one chunk; once ``budget`` seconds have passed the rest are left
+    unfinished. Returns (notifications sent, {media_id: cursor}) where the
+    cursors resume the unfinished media when passed back as ``cursors``.
+    """
+    deadline = time.monotonic() + budget if budget else None
+    cursors = cursors or {}
+    try:
+        with db_connection() as conn:
+            subscribers.ensure_loaded(conn, by_media)
+    except redis.RedisError as e:
+        logger.error(f"Subscriber cache unavailable, reading SQLite: {e}")
+        return _fan_out_sqlite(by_media, sink), {}
+
+    sent = 0
+    unfinished = {}
+    for media_id, details in by_media.items():
+        cursor = cursors.get(media_id, 0)
+        while True:
+            cursor, names = subscribers.scan(media_id, cursor)
+            for name in names:
+                sink(name, media_id, details)
+            sent += len(names)
+            if not cursor:
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                unfinished[media_id] = cursor
+                break
+    return sent, unfinished
+
+
+class NotificationDispatcher:
+    """Fixed pool of workers draining a bounded queue of review notifications.
+
+    ``submit`` blocks while the queue is full, so a burst of reviews slows
+    its producer down instead of piling up threads. Each worker collects
+    events for up to ``window`` seconds, groups them per media and delivers
+    them with one subscriber query.
+    """
+
+    def __init__(self, workers=WORKERS, max_queue=MAX_QUEUE, window=COALESCE_WINDOW, max_batch=MAX_BATCH,
+                 sink=log_notification, budget=FANOUT_BUDGET):
+        self.workers = workers
+        self.budget = budget
+        self.window = window
+        self.max_batch = max_batch
+        self.sink = sink
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._closing = False
+        self._metrics = {"submitted": 0, "delivered": 0, "notifications": 0, "batches": 0, "fanouts": 0,
+                         "deferred": 0, "errors": 0, "max_depth": 0, "blocked_seconds": 0.0, "lag_ms": 0.0, "max_lag_ms": 0.0}
+
+    def start(self):
+        with self._lock:
+            self._closing = False
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run, name=f"notifier-{len(self._threads)}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        return self
+
+    def submit_many(self, events):
+        """Queue (media_id, details) events in order."""
+        for media_id, details in events:
+            self.submit(media_id, details)
+
+    def submit(self, media_id, details, timeout=None):
+        """Queue one review's notification, waiting while the queue is full.
+
+        Raises queue.Full if ``timeout`` seconds pass without room.
+        """
+        started = time.monotonic()
+        self._queue.put((media_id, details, started), timeout=timeout)
+        waited = time.monotonic() - started
+        depth = self._queue.qsize()
+        with self._lock:
+            self._metrics["submitted"] += 1
+            self._metrics["blocked_seconds"] += waited
+            self._metrics["max_depth"] = max(self._metrics["max_depth"], depth)
+
+    def _collect(self, first):
+        """Gather events arriving within the window after ``first``. Returns (batch, stop)."""
+        batch = [first]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                event = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if event is _STOP:
+                return batch, True
+            batch.append(event)
+        return batch, False
+
+    def _run(self):
+        stop = False
+        while not stop:
+            first = self._queue.get()
+            if first is _STOP:
+                break
+            batch, stop = self._collect(first)
+
+            by_media, resumed = {}, []
+            for event in batch:
+                if len(event) == 4:
+                    resumed.append(event)
+                else:
+                    by_media.setdefault(event[0], []).append(event[1])
+            try:
+                sent, unfinished = fan_out(by_media, self.sink, self.budget)
+                for media_id, cursor in unfinished.items():
+                    self._defer(media_id, by_media[media_id], batch[0][2], cursor)
+                for media_id, details, started, cursor in resumed:
+                    more, unfinished = fan_out({media_id: details}, self.sink, self.budget, {media_id: cursor})
+                    sent += more
+                    if unfinished:
+                        self._defer(media_id, details, started, unfinished[media_id])
+            except (sqlite3.Error, redis.RedisError) as e:
+                logger.error(f"Notification Error: {e}")
+                with self._lock:
+                    self._metrics["errors"] += len(batch)
+                continue
+
+            lag = (time.monotonic() - batch[0][2]) * 1000
+            with self._lock:
+                metrics = self._metrics
+                metrics["delivered"] += len(batch) - len(resumed)
+                metrics["notifications"] += sent
+                metrics["batches"] += 1
+                metrics["fanouts"] += len(by_media) + len(resumed)
+                metrics["lag_ms"] = lag
+                metrics["max_lag_ms"] = max(metrics["max_lag_ms"], lag)
+
+    def _defer(self, media_id, details, started, cursor):
+        """Queue the rest of a fan-out that ran out of budget behind the events
+        already waiting. While closing, or if the queue is full, finish it now."""
+        with self._lock:
+            if not self._closing:
+                try:
+                    self._queue.put_nowait((media_id, details, started, cursor))
+                    self._metrics["deferred"] += 1
+                    return
+                except queue.Full:
+                    pass
+        sent, _ = fan_out({media_id: details}, self.sink, budget=None, cursors={media_id: cursor})
+        with self._lock:
+            self._metrics["notifications"] += sent
+
+    def metrics(self):
+        """Counters plus the current queue depth. lag_ms is enqueue-to-delivery
+        time of the oldest event in the latest batch."""
+        with self._lock:
+            return dict(self._metrics, depth=self._queue.qsize())
+
+    def close(self, timeout=None):
+        """Deliver everything queued, then stop the workers."""
+        with self._lock:
+            self._closing = True
+            threads = list(self._threads)
+            self._threads = []
+        for _ in threads:
+            self._queue.put(_STOP)
+        for thread in threads:
+            thread.join(timeout)
+
+
+def publish(events, client=None):
+    """Append (media_id, details) events to the notification stream in one round trip."""
+    pipe = (client or get_redis()).pipeline(transaction=False)
+    now = time.time()
+    for media_id, details in events:
+        pipe.xadd(STREAM_KEY, {"media_id": media_id, "details": json.dumps(details), "ts": now},
+                  maxlen=STREAM_MAXLEN, approximate=True)
+    pipe.execute()
+
+
+def ensure_group(client=None):
+    """Create the consumer group (and stream) if missing, reading from the start."""
+    try:
+        (client or get_redis()).xgroup_create(STREAM_KEY, GROUP, id="0", mkstream=True)
+    except redis.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def default_consumer():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class StreamWorker:
+    """Consumes the notification stream as one member of the consumer group.
+
+    Entries are read ``count`` at a time, grouped per media, delivered with
+    ``fan_out`` and only then acknowledged, so a worker that dies mid-batch
+    leaves its entries pending. Those are re-read when a consumer with the
+    same name restarts, or claimed by any worker once idle for
+    ``claim_idle_ms``. Delivery is at-least-once.
+    """
+
+    def __init__(self, consumer=None, count=STREAM_BATCH, block_ms=BLOCK_MS, claim_idle_ms=CLAIM_IDLE_MS,
+                 sink=log_notification, client=None, budget=FANOUT_BUDGET):
+        self.consumer = consumer or default_consumer()
+        self.budget = budget
+        self.count = count
+        self.block_ms = block_ms
+        self.claim_idle_ms = claim_idle_ms
+        self.sink = sink
+        self.client = client or get_redis()
+        self._stop = threading.Event()
+        self._draining = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._metrics = {"read": 0, "acked": 0, "notifications": 0, "batches": 0, "fanouts": 0,
+                         "deferred": 0, "claimed": 0, "errors": 0, "lag_ms": 0.0, "max_lag_ms": 0.0}
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run, name=f"stream-{self.consumer}", daemon=True)
+            self._thread.start()
+        return self
+
+    def _read(self, start, block):
+        result = self.client.xreadgroup(GROUP, self.consumer, {STREAM_KEY: start}, count=self.count, block=block)
+        return result[0][1] if result else []
+
+    def _recover(self):
+        """Deliver entries this consumer read but never acknowledged before a restart."""
+        start = "0"
+        while not self._stop.is_set():
+            messages = self._read(start, None)
+            if not messages:
+                return
+            start = messages[-1][0]
+            self._deliver(messages)
+
+    def _reclaim(self):
+        """Take over entries left pending by other consumers for too long."""
+        start = "0-0"
+        while not self._stop.is_set():
+            result = self.client.xautoclaim(STREAM_KEY, GROUP, self.consumer, self.claim_idle_ms,
+                                            start_id=start, count=self.count)
+            start, messages = result[0], result[1]
+            if messages:
+                with self._lock:
+                    self._metrics["claimed"] += len(messages)
+                self._deliver(messages)
+            if start == "0-0":
+                return
+
+    def _deliver(self, messages):
+        with self._lock:
+            self._metrics["read"] += len(messages)
+        by_media, resumed = {}, []
+        ids = []
+        oldest = None
+        for entry_id, fields in messages:
+            ids.append(entry_id)
+            if not fields:
+                # Trimmed from the stream while pending; nothing left to deliver
+                continue
+            sent_at = float(fields.get("ts", 0)) or None
+            if "cursor" in fields:
+                resumed.append((int(fields["media_id"]), json.loads(fields["details"]), int(fields["cursor"]), sent_at))
+            else:
+                by_media.setdefault(int(fields["media_id"]), []).append(json.loads(fields["details"]))
+            if sent_at and (oldest is None or sent_at < oldest):
+                oldest = sent_at
+        try:
+            sent, unfinished = fan_out(by_media, self.sink, self.budget) if by_media else (0, {})
+            continuations = [(media_id, by_media[media_id], cursor, oldest) for media_id, cursor in unfinished.items()]
+            for media_id, details, cursor, sent_at in resumed:
+                more, unfinished = fan_out({media_id: details}, self.sink, self.budget, {media_id: cursor})
+                sent += more
+                if unfinished:
+                    continuations.append((media_id, details, unfinished[media_id], sent_at))
+        except sqlite3.Error as e:
+            # Left unacknowledged: reclaimed and retried after claim_idle_ms
+            logger.error(f"Notification Error: {e}")
+            with self._lock:
+                self._metrics["errors"] += len(ids)
+            return
+
+        # Continuations are appended before the entries they came from are
+        # acknowledged, so a crash in between repeats notifications rather than losing them
+        pipe = self.client.pipeline(transaction=False)
+        for media_id, details, cursor, sent_at in continuations:
+            pipe.xadd(STREAM_KEY, {"media_id": media_id, "details": json.dumps(details), "cursor": cursor,
+                                   "ts": sent_at or time.time()}, maxlen=STREAM_MAXLEN, approximate=True)
+        pipe.xack(STREAM_KEY, GROUP, *ids)
+        pipe.execute()
+
+        lag = (time.time() - oldest) * 1000 if oldest else 0.0
+        with self._lock:
+            metrics = self._metrics
+            metrics["acked"] += len(ids)
+            metrics["notifications"] += sent
+            metrics["batches"] += 1
+            metrics["fanouts"] += len(by_media) + len(resumed)
+            metrics["deferred"] += len(continuations)
+            metrics["lag_ms"] = lag
+            metrics["max_lag_ms"] = max(metrics["max_lag_ms"], lag)
+
+    def run(self, drain=False):
+        """Consume until closed; with ``drain``, stop once the stream has nothing new."""
+        recovered = False
+        next_claim = 0.0
+        while not self._stop.is_set():
+            try:
+                if not recovered:
+                    ensure_group(self.client)
+                    self._recover()
+                    recovered = True
+                if time.monotonic() >= next_claim:
+                    self._reclaim()
+                    next_claim = time.monotonic() + self.claim_idle_ms / 2000
+                draining = drain or self._draining.is_set()
+                messages = self._read(">", None if draining else self.block_ms)
+                if messages:
+                    self._deliver(messages)
+                elif draining:
+                    break
+            except redis.RedisError as e:
+                # Unacknowledged entries stay pending on the server; retry shortly
+                logger.error(f"Notification stream error ({self.consumer}): {e}")
+                with self._lock:
+                    self._metrics["errors"] += 1
+                self._stop.wait(self.block_ms / 1000)
+
+    def metrics(self):
+        with self._lock:
+            return dict(self._metrics, consumer=self.consumer)
+
+    def drain(self, timeout=None):
+        """Deliver everything published so far, then stop."""
+        self._draining.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def close(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+def stream_status(client=None):
+    """Return (stream length, entries pending in the group, {consumer: pending})."""
+    client = client or get_redis()
+    ensure_group(client)
+    pending = client.xpending(STREAM_KEY, GROUP)
+    return (client.xlen(STREAM_KEY), pending["pending"],
+            {consumer["name"]: consumer["pending"] for consumer in pending["consumers"]})
+
+
+class StreamNotifier:
+    """Publishes review notifications to the stream for notify-worker processes.
+
+    With ``local_workers`` it also consumes the stream itself, for the
+    in-process Redis stand-in whose stream no other process can see; close
+    then delivers everything published before stopping them.
+    """
+
+    def __init__(self, local_workers=0, client=None, sink=log_notification):
+        self.client = client or get_redis()
+        self._lock = threading.Lock()
+        self._published = 0
+        ensure_group(self.client)
+        self.workers = [StreamWorker(f"{default_consumer()}-{i}", block_ms=100, sink=sink, client=self.client).start()
+                        for i in range(local_workers)]
+
+    def submit(self, media_id, details, timeout=None):
+        self.submit_many([(media_id, details)])
+
+    def submit_many(self, events):
+        events = list(events)
+        if events:
+            publish(events, self.client)
+            with self._lock:
+                self._published += len(events)
+
+    def metrics(self):
+        totals = {"published": self._published, "delivered": 0, "notifications": 0, "fanouts": 0,
+                  "claimed": 0, "errors": 0, "max_lag_ms": 0.0}
+        for worker in self.workers:
+            metrics = worker.metrics()
+            totals["delivered"] += metrics["acked"]
+            for key in ("notifications", "fanouts", "claimed", "errors"):
+                totals[key] += metrics[key]
+            totals["max_lag_ms"] = max(totals["max_lag_ms"], metrics["max_lag_ms"])
+        return totals
+
+    def close(self, timeout=None):
+        for worker in self.workers:
+            worker._draining.set()
+        for worker in self.workers:
+            worker.drain(timeout)
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher(sink=log_notification):
+    """Return the shared dispatcher, starting it (delivering to ``sink``) on first use."""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = NotificationDispatcher(sink=sink).start()
+        return _dispatcher
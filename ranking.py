@@ -0,0 +1,97 @@
+import math
+import time
+
+from defaults import RANKING_MODES
+from migrations import DECAY_EPOCH, DECAY_HALF_LIFE, REFRESH_SCORES_SQL, WILSON_Z
+
+MODES = RANKING_MODES
+# media_stats column holding each mode's score; all are indexed
+SCORE_COLUMNS = {"average": "avg_rating", "bayesian": "bayesian_score", "wilson": "wilson_score",
+                 "decayed": "decayed_score"}
+
+# Weight of the prior, in ratings. None uses the mean number of ratings per
+# rated media, so a typical media is half prior, half its own ratings.
+PRIOR_WEIGHT = None
+# Stored Bayesian and decayed scores use the prior (and decay) as of their
+# last refresh; ranking refreshes them once they are this old
+REFRESH_SECONDS = 24 * 3600
+
+
+def priors(conn):
+    """Return (mean rating over all ratings, prior weight) from media_stats."""
+    rated, ratings, total = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(rating_count), 0), COALESCE(SUM(rating_sum), 0) "
+        "FROM media_stats WHERE rating_count > 0"
+    ).fetchone()
+    if not ratings:
+        return 0.0, 0.0
+    weight = PRIOR_WEIGHT if PRIOR_WEIGHT is not None else ratings / rated
+    return total / ratings, weight
+
+
+def bayesian(count, total, mean, weight):
+    """Average pulled towards ``mean`` as if ``weight`` extra ratings of ``mean`` existed."""
+    return (weight * mean + total) / (weight + count)
+
+
+def wilson(positive, count, z=WILSON_Z):
+    """Lower bound of the Wilson interval for the share of positive ratings.
+
+    ``positive`` counts the histogram's ratings of WILSON_POSITIVE stars or
+    more; the stored wilson_score is the same formula in SQL.
+    """
+    p = positive / count
+    z2 = z * z
+    centre = p + z2 / (2 * count)
+    margin = z * math.sqrt(p * (1 - p) / count + z2 / (4 * count * count))
+    return (centre - margin) / (1 + z2 / count)
+
+
+def decay_factor(now=None):
+    """Scale converting stored decay sums to weights as of ``now``, see migrations.DECAY_EPOCH."""
+    now = time.time() if now is None else now
+    return 2.0 ** (-(now - DECAY_EPOCH) / DECAY_HALF_LIFE)
+
+
+def refresh_scores(conn, now=None):
+    """Recompute the prior as of ``now`` and every stored score. Returns the rows rescored."""
+    now = time.time() if now is None else now
+    mean, weight = priors(conn)
+    conn.execute("INSERT OR REPLACE INTO ranking_priors (id, mean, weight, decay_factor, as_of) VALUES (1, ?, ?, ?, ?)",
+                 (mean, weight, decay_factor(now), now))
+    return conn.execute(REFRESH_SCORES_SQL).rowcount
+
+
+def scores_as_of(conn):
+    """Return when the stored scores' prior was computed, or None if never."""
+    row = conn.execute("SELECT as_of FROM ranking_priors").fetchone()
+    return row[0] if row else None
+
+
+def top_media(conn, limit=5, mode="bayesian", media_type=None, now=None):
+    """Return [(media_id, title, type, score, ratings)] for the ``limit`` best media.
+
+    Scores are stored in media_stats and kept current by triggers, so this
+    reads the first ``limit`` entries of the mode's score index. The prior
+    the Bayesian and decayed scores use is refreshed when older than
+    REFRESH_SECONDS.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown ranking mode {mode!r}, expected one of {', '.join(MODES)}")
+
+    now = time.time() if now is None else now
+    as_of = scores_as_of(conn)
+    if mode in ("bayesian", "decayed") and (as_of is None or now - as_of >= REFRESH_SECONDS):
+        refresh_scores(conn, now)
+
+    column = SCORE_COLUMNS[mode]
+    type_filter = "AND media.type = ?" if media_type else ""
+    # CROSS JOIN keeps media_stats as the outer loop, so a type filter still
+    # walks the score index and stops after ``limit`` matches
+    return conn.execute(f"""
+        SELECT media_stats.media_id, media.title, media.type, media_stats.{column}, media_stats.rating_count
+        FROM media_stats CROSS JOIN media ON media.id = media_stats.media_id
+        WHERE media_stats.{column} IS NOT NULL AND media_stats.rating_count > 0 {type_filter}
+        ORDER BY media_stats.{column} DESC
+        LIMIT ?
+    """, ([media_type] if media_type else []) + [limit]).fetchall()
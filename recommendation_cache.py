@@ -0,0 +1,157 @@
+import sqlite3
+import threading
+import time
+from array import array
+
+import recommender
+from db import db_connection
+from defaults import REFRESH_BATCH_SIZE
+from logger import logger
+
+# Recommendations stored per user; lookups serve any prefix of these
+TOP_N = 20
+BATCH_SIZE = REFRESH_BATCH_SIZE
+# Seconds the worker sleeps when nothing is dirty
+IDLE_DELAY = 1.0
+# Media ids per IN (...) when expanding dirty media to their users
+_EXPAND_CHUNK = 500
+
+
+def _pack(ranked):
+    ids = array("q", (media_id for media_id, _ in ranked))
+    scores = array("f", (score for _, score in ranked))
+    return ids.tobytes(), scores.tobytes()
+
+
+def _unpack(id_blob, score_blob):
+    ids, scores = array("q"), array("f")
+    ids.frombytes(id_blob)
+    scores.frombytes(score_blob)
+    return list(zip(ids, scores))
+
+
+def lookup(conn, user_id, limit=5):
+    """Return the stored [(media_id, score)] for a user, or None if missing or dirty."""
+    row = conn.execute("""
+        SELECT recommendations.media_ids, recommendations.scores, recommendations_dirty.user_id
+        FROM recommendations
+        LEFT JOIN recommendations_dirty ON recommendations_dirty.user_id = recommendations.user_id
+        WHERE recommendations.user_id = ?
+    """, (user_id,)).fetchone()
+    if row is None or row[2] is not None:
+        return None
+    return _unpack(row[0], row[1])[:limit]
+
+
+def _save(conn, results):
+    """Store (user_id, ranked, dirty version) results and clear the dirty marks
+    they answered. A mark re-made since ``version`` was read stays."""
+    now = time.time()
+    conn.executemany(
+        "INSERT OR REPLACE INTO recommendations (user_id, media_ids, scores, refreshed_at) VALUES (?, ?, ?, ?)",
+        [(user_id, *_pack(ranked), now) for user_id, ranked, _ in results],
+    )
+    conn.executemany(
+        "DELETE FROM recommendations_dirty WHERE user_id = ? AND version = ?",
+        [(user_id, version) for user_id, _, version in results if version is not None],
+    )
+
+
+def get(conn, user_id, limit=5):
+    """Return [(media_id, predicted rating)] for a user: one primary-key lookup,
+    computed on demand (and stored) when the entry is missing or dirty."""
+    cached = lookup(conn, user_id, limit)
+    if cached is not None:
+        return cached
+
+    version = conn.execute("SELECT version FROM recommendations_dirty WHERE user_id = ?", (user_id,)).fetchone()
+    ranked = recommender.recommend(conn, user_id, TOP_N)
+    try:
+        _save(conn, [(user_id, ranked, version[0] if version else None)])
+    except sqlite3.OperationalError as e:
+        # Serving the answer matters more than caching it
+        logger.error(f"Could not store recommendations for user {user_id}: {e}")
+    return ranked[:limit]
+
+
+def refresh_dirty(batch_size=BATCH_SIZE):
+    """Recompute one batch of dirty users in a single transaction. Returns how many."""
+    with db_connection() as conn:
+        batch = conn.execute("SELECT user_id, version FROM recommendations_dirty LIMIT ?", (batch_size,)).fetchall()
+        if not batch:
+            return 0
+        model = recommender.get_model(conn)
+        results = []
+        for user_id, version in batch:
+            ratings = recommender.user_ratings(conn, user_id)
+            results.append((user_id, model.recommend(ratings, TOP_N) if ratings else [], version))
+        _save(conn, results)
+    return len(batch)
+
+
+def expand_dirty_media(conn, model):
+    """Mark dirty every user who rated a reviewed-since-last-build media or one of
+    its neighbours, whose predictions the rebuilt ``model`` may change.
+
+    Returns the number of media expanded.
+    """
+    media_ids = [row[0] for row in conn.execute("SELECT media_id FROM recommendations_dirty_media")]
+    affected = set(media_ids)
+    for media_id in media_ids:
+        affected.update(model.neighbors_of(media_id))
+
+    affected = list(affected)
+    for start in range(0, len(affected), _EXPAND_CHUNK):
+        chunk = affected[start:start + _EXPAND_CHUNK]
+        conn.execute(f"""
+            INSERT INTO recommendations_dirty (user_id)
+            SELECT DISTINCT user_id FROM reviews WHERE media_id IN ({', '.join('?' * len(chunk))})
+            ON CONFLICT (user_id) DO UPDATE SET version = version + 1
+        """, chunk)
+    for start in range(0, len(media_ids), _EXPAND_CHUNK):
+        chunk = media_ids[start:start + _EXPAND_CHUNK]
+        conn.execute(f"DELETE FROM recommendations_dirty_media WHERE media_id IN ({', '.join('?' * len(chunk))})", chunk)
+    return len(media_ids)
+
+
+def pending(conn):
+    """Return (dirty users, media waiting for a neighbour rebuild)."""
+    return (conn.execute("SELECT COUNT(*) FROM recommendations_dirty").fetchone()[0],
+            conn.execute("SELECT COUNT(*) FROM recommendations_dirty_media").fetchone()[0])
+
+
+class RecommendationWorker:
+    """Background thread refreshing dirty recommendation entries in batches."""
+
+    def __init__(self, batch_size=BATCH_SIZE, idle_delay=IDLE_DELAY):
+        self.batch_size = batch_size
+        self.idle_delay = idle_delay
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {"batches": 0, "users": 0, "errors": 0}
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="recommendation-worker", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                refreshed = refresh_dirty(self.batch_size)
+            except (sqlite3.Error, RuntimeError) as e:
+                self.stats["errors"] += 1
+                logger.error(f"Recommendation refresh failed: {e}")
+                refreshed = 0
+            if refreshed:
+                self.stats["batches"] += 1
+                self.stats["users"] += refreshed
+            else:
+                self._stop.wait(self.idle_delay)
+
+    def close(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
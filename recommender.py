@@ -0,0 +1,217 @@
+import os
+import threading
+
+from lazy import lazy_import
+
+# Optional, only the cf engine needs it
+np = lazy_import("numpy", optional=True)
+
+MODEL_PATH = "item_neighbors.npz"
+
+# Neighbours kept per media
+NEIGHBORS = 50
+# Similarities from few co-raters are scaled by overlap / (overlap + SHRINK):
+# with one shared user, mean-centered cosine is always exactly +-1
+SIMILARITY_SHRINK = 5.0
+# Added to the similarity total when predicting, so one weak neighbour
+# can't produce a confident prediction
+PREDICTION_DAMPING = 1.0
+
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError("The cf engine needs NumPy: pip install numpy")
+
+
+def _gather(indptr, rows):
+    """Positions of every entry in the given CSR/CSC ``rows``, concatenated."""
+    starts, ends = indptr[rows], indptr[rows + 1]
+    lengths = ends - starts
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return offsets + np.arange(lengths.sum()), lengths
+
+
+class ItemNeighbors:
+    """Top-N item-item similarities stored as CSR arrays.
+
+    ``media_ids[i]`` is the media of row i; its neighbours are
+    ``neighbors[indptr[i]:indptr[i + 1]]`` (row numbers) with weights
+    ``similarity[...]``, most similar first.
+    """
+
+    def __init__(self, media_ids, indptr, neighbors, similarity, max_review_id=0):
+        self.media_ids = media_ids
+        self.indptr = indptr
+        self.neighbors = neighbors
+        self.similarity = similarity
+        self.max_review_id = int(max_review_id)
+        self._row_of = {int(media_id): row for row, media_id in enumerate(media_ids)}
+
+    def __len__(self):
+        return len(self.media_ids)
+
+    def neighbors_of(self, media_id):
+        """Return the media ids of a media's neighbours, most similar first."""
+        row = self._row_of.get(media_id)
+        if row is None:
+            return []
+        return self.media_ids[self.neighbors[self.indptr[row]:self.indptr[row + 1]]].tolist()
+
+    def save(self, path=MODEL_PATH):
+        # Write next to the target and rename, so readers never see half a file
+        temp = f"{path}.tmp.npz"
+        np.savez(temp, media_ids=self.media_ids, indptr=self.indptr, neighbors=self.neighbors,
+                 similarity=self.similarity, max_review_id=self.max_review_id)
+        os.replace(temp, path)
+
+    @classmethod
+    def load(cls, path=MODEL_PATH):
+        with np.load(path) as data:
+            return cls(data["media_ids"], data["indptr"], data["neighbors"], data["similarity"],
+                       data["max_review_id"])
+
+    def recommend(self, ratings, limit=5):
+        """Return [(media_id, predicted rating)] for media the user hasn't rated.
+
+        ``ratings`` maps media_id to the user's rating. Predictions are the
+        user's mean plus the similarity-weighted mean of their centered
+        ratings of each candidate's neighbours.
+        """
+        rated = [(self._row_of[media_id], rating) for media_id, rating in ratings.items() if media_id in self._row_of]
+        if not rated:
+            return []
+        rows = np.fromiter((row for row, _ in rated), dtype=np.int64, count=len(rated))
+        values = np.fromiter((rating for _, rating in rated), dtype=np.float64, count=len(rated))
+        mean = float(np.mean(list(ratings.values())))
+
+        positions, lengths = _gather(self.indptr, rows)
+        candidates = self.neighbors[positions]
+        weights = self.similarity[positions].astype(np.float64)
+        centered = np.repeat(values - mean, lengths)
+
+        n = len(self.media_ids)
+        totals = np.bincount(candidates, weights=weights * centered, minlength=n)
+        support = np.bincount(candidates, weights=weights, minlength=n)
+        scores = np.full(n, -np.inf)
+        reached = support > 0
+        scores[reached] = mean + totals[reached] / (support[reached] + PREDICTION_DAMPING)
+        scores[rows] = -np.inf
+
+        available = int(np.count_nonzero(np.isfinite(scores)))
+        limit = min(limit, available)
+        if limit <= 0:
+            return []
+        best = np.argpartition(-scores, limit - 1)[:limit]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return [(int(self.media_ids[row]), float(scores[row])) for row in best]
+
+
+def build_model(conn, neighbors=NEIGHBORS):
+    """Build item-item neighbour lists from every rated review.
+
+    Ratings are centered on each user's mean, then each media is compared
+    with the media sharing at least one rater (adjusted cosine similarity).
+    """
+    _require_numpy()
+    max_review_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM reviews").fetchone()[0]
+    # One rating per (user, media): repeat reviews are averaged
+    triples = np.array(conn.execute("""
+        SELECT user_id, media_id, AVG(rating) FROM reviews
+        WHERE rating IS NOT NULL
+        GROUP BY user_id, media_id
+    """).fetchall(), dtype=np.float64).reshape(-1, 3)
+
+    user_ids, users = np.unique(triples[:, 0].astype(np.int64), return_inverse=True)
+    media_ids, items = np.unique(triples[:, 1].astype(np.int64), return_inverse=True)
+    n_users, n_items = len(user_ids), len(media_ids)
+    ratings = triples[:, 2]
+
+    user_means = np.bincount(users, weights=ratings, minlength=n_users) / np.bincount(users, minlength=n_users)
+    centered = ratings - user_means[users]
+    norms = np.sqrt(np.bincount(items, weights=centered * centered, minlength=n_items))
+
+    # CSR by user (row = user) and CSC by item (column = media) of the centered matrix
+    by_user = np.lexsort((items, users))
+    user_ptr = np.concatenate(([0], np.cumsum(np.bincount(users, minlength=n_users))))
+    user_items, user_values = items[by_user], centered[by_user]
+    by_item = np.lexsort((users, items))
+    item_ptr = np.concatenate(([0], np.cumsum(np.bincount(items, minlength=n_items))))
+    item_users, item_values = users[by_item], centered[by_item]
+
+    indptr = np.zeros(n_items + 1, dtype=np.int64)
+    kept_neighbors, kept_similarity = [], []
+    for item in range(n_items):
+        raters = item_users[item_ptr[item]:item_ptr[item + 1]]
+        positions, lengths = _gather(user_ptr, raters)
+        others = user_items[positions]
+        products = user_values[positions] * np.repeat(item_values[item_ptr[item]:item_ptr[item + 1]], lengths)
+
+        order = np.argsort(others, kind="stable")
+        others, products = others[order], products[order]
+        partners, starts = np.unique(others, return_index=True)
+        dots = np.add.reduceat(products, starts) if len(starts) else products[:0]
+        overlap = np.diff(np.append(starts, len(others)))
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            similarity = dots / (norms[item] * norms[partners]) * (overlap / (overlap + SIMILARITY_SHRINK))
+        keep = (partners != item) & (similarity > 0) & np.isfinite(similarity)
+        partners, similarity = partners[keep], similarity[keep]
+        if len(partners) > neighbors:
+            top = np.argpartition(-similarity, neighbors - 1)[:neighbors]
+            partners, similarity = partners[top], similarity[top]
+        order = np.argsort(-similarity, kind="stable")
+        kept_neighbors.append(partners[order].astype(np.int32))
+        kept_similarity.append(similarity[order].astype(np.float32))
+        indptr[item + 1] = indptr[item] + len(partners)
+
+    empty = np.zeros(0, dtype=np.int32)
+    return ItemNeighbors(
+        media_ids, indptr,
+        np.concatenate(kept_neighbors) if kept_neighbors else empty,
+        np.concatenate(kept_similarity) if kept_similarity else empty.astype(np.float32),
+        max_review_id,
+    )
+
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_model(conn, path=MODEL_PATH):
+    """Return the neighbour model, loading it from ``path`` or building and saving it on first use."""
+    global _model
+    _require_numpy()
+    with _model_lock:
+        if _model is None:
+            if os.path.exists(path):
+                _model = ItemNeighbors.load(path)
+            else:
+                _model = build_model(conn)
+                _model.save(path)
+        return _model
+
+
+def rebuild_model(conn, path=MODEL_PATH):
+    """Rebuild the neighbour lists from the current reviews and save them."""
+    global _model
+    model = build_model(conn)
+    model.save(path)
+    with _model_lock:
+        _model = model
+    return model
+
+
+def user_ratings(conn, user_id):
+    """Return {media_id: rating} for a user's rated reviews (repeat reviews averaged)."""
+    return dict(conn.execute(
+        "SELECT media_id, AVG(rating) FROM reviews WHERE user_id = ? AND rating IS NOT NULL GROUP BY media_id",
+        (user_id,),
+    ))
+
+
+def recommend(conn, user_id, limit=5):
+    """Return [(media_id, predicted rating)] for ``user_id`` from the item neighbours."""
+    ratings = user_ratings(conn, user_id)
+    if not ratings:
+        return []
+    return get_model(conn).recommend(ratings, limit)
@@ -1,3 +1,513 @@
-import redis
+import fnmatch
+import threading
+import time
+import weakref
+from bisect import bisect_right
+from itertools import islice
+from queue import Queue, Empty
 
-redis_client = redis.Redis(host='localhost', port=6379, decode_responses=True)
+from lazy import lazy_import
+
+redis = lazy_import("redis")
+
+# Built on first use, so commands that never touch Redis don't import it
+redis_client = None
+
+
+def _now():
+    return time.monotonic()
+
+
+class LocalRedis:
+    """In-process stand-in for the subset of Redis commands this app uses.
+
+    Lets the cache layers run (and be checked) without a Redis server.
+    Values are stored as given; expiry is checked lazily on access.
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._expires = {}
+        self._lock = threading.RLock()
+        self._subscribers = {}
+        # Wakes XREADGROUP calls blocked waiting for XADD
+        self._stream_added = threading.Condition(self._lock)
+
+    def _alive(self, name):
+        expires = self._expires.get(name)
+        if expires is not None and expires <= _now():
+            self._data.pop(name, None)
+            self._expires.pop(name, None)
+        return name in self._data
+
+    def get(self, name):
+        with self._lock:
+            return self._data[name] if self._alive(name) else None
+
+    def mget(self, keys, *args):
+        keys = list(keys) if isinstance(keys, (list, tuple)) else [keys]
+        keys.extend(args)
+        with self._lock:
+            return [self.get(key) for key in keys]
+
+    def set(self, name, value, ex=None, px=None, nx=False, xx=False):
+        with self._lock:
+            exists = self._alive(name)
+            if (nx and exists) or (xx and not exists):
+                return None
+            self._data[name] = value
+            self._expires.pop(name, None)
+            if ex is not None:
+                self._expires[name] = _now() + ex
+            elif px is not None:
+                self._expires[name] = _now() + px / 1000
+            return True
+
+    def setex(self, name, time, value):
+        return self.set(name, value, ex=time)
+
+    def delete(self, *names):
+        with self._lock:
+            removed = 0
+            for name in names:
+                if self._alive(name):
+                    removed += 1
+                self._data.pop(name, None)
+                self._expires.pop(name, None)
+            return removed
+
+    def exists(self, *names):
+        with self._lock:
+            return sum(1 for name in names if self._alive(name))
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            value = int(self.get(name) or 0) + amount
+            self._data[name] = str(value)
+            return value
+
+    def expire(self, name, time):
+        with self._lock:
+            if not self._alive(name):
+                return False
+            self._expires[name] = _now() + time
+            return True
+
+    def ttl(self, name):
+        with self._lock:
+            if not self._alive(name):
+                return -2
+            expires = self._expires.get(name)
+            return -1 if expires is None else max(0, int(expires - _now()))
+
+    def keys(self, pattern="*"):
+        with self._lock:
+            return [key for key in list(self._data) if self._alive(key) and fnmatch.fnmatchcase(key, pattern)]
+
+    def flushdb(self):
+        with self._lock:
+            self._data.clear()
+            self._expires.clear()
+            return True
+
+    def rename(self, src, dst):
+        with self._lock:
+            if not self._alive(src):
+                raise redis.ResponseError("no such key")
+            self._data[dst] = self._data.pop(src)
+            self._expires.pop(dst, None)
+            if src in self._expires:
+                self._expires[dst] = self._expires.pop(src)
+            return True
+
+    def _container(self, name, kind):
+        """Return the dict behind a hash or sorted set, creating it if needed."""
+        if not self._alive(name):
+            self._data[name] = {}
+        value = self._data[name]
+        if not isinstance(value, dict):
+            raise redis.ResponseError(f"WRONGTYPE key does not hold a {kind}")
+        return value
+
+    def hset(self, name, key=None, value=None, mapping=None):
+        with self._lock:
+            items = dict(mapping or {})
+            if key is not None:
+                items[key] = value
+            fields = self._container(name, "hash")
+            added = sum(1 for field in items if field not in fields)
+            fields.update((field, str(value)) for field, value in items.items())
+            return added
+
+    def hget(self, name, key):
+        with self._lock:
+            return self._data[name].get(key) if self._alive(name) else None
+
+    def hgetall(self, name):
+        with self._lock:
+            return dict(self._data[name]) if self._alive(name) else {}
+
+    def hincrby(self, name, key, amount=1):
+        with self._lock:
+            fields = self._container(name, "hash")
+            value = int(fields.get(key, 0)) + amount
+            fields[key] = str(value)
+            return value
+
+    def zadd(self, name, mapping):
+        with self._lock:
+            members = self._container(name, "sorted set")
+            added = sum(1 for member in mapping if member not in members)
+            members.update((str(member), float(score)) for member, score in mapping.items())
+            return added
+
+    def zscore(self, name, member):
+        with self._lock:
+            return self._data[name].get(str(member)) if self._alive(name) else None
+
+    def zcard(self, name):
+        with self._lock:
+            return len(self._data[name]) if self._alive(name) else 0
+
+    def zrevrange(self, name, start, end, withscores=False):
+        with self._lock:
+            if not self._alive(name):
+                return []
+            # Highest score first; ties in reverse member order, as Redis does
+            ranked = sorted(self._data[name].items(), key=lambda item: (item[1], item[0]), reverse=True)
+        ranked = ranked[start:None if end == -1 else end + 1]
+        return ranked if withscores else [member for member, _ in ranked]
+
+    # Sets are dicts with None values, kept in insertion order so an SSCAN
+    # cursor (an offset) stays valid while members are added
+
+    def sadd(self, name, *values):
+        with self._lock:
+            members = self._container(name, "set")
+            added = sum(1 for value in values if str(value) not in members)
+            members.update((str(value), None) for value in values)
+            return added
+
+    def sismember(self, name, value):
+        with self._lock:
+            return self._alive(name) and str(value) in self._data[name]
+
+    def smismember(self, name, values, *args):
+        with self._lock:
+            members = self._data[name] if self._alive(name) else {}
+            return [int(str(value) in members) for value in list(values) + list(args)]
+
+    def scard(self, name):
+        with self._lock:
+            return len(self._data[name]) if self._alive(name) else 0
+
+    def smembers(self, name):
+        with self._lock:
+            return set(self._data[name]) if self._alive(name) else set()
+
+    def sscan(self, name, cursor=0, match=None, count=None):
+        with self._lock:
+            if not self._alive(name):
+                return 0, []
+            members = list(islice(self._data[name], int(cursor), int(cursor) + (count or 10)))
+            end = int(cursor) + len(members)
+            return (0 if end >= len(self._data[name]) else end), members
+
+    def _stream(self, name, create=False):
+        if not self._alive(name):
+            if not create:
+                return None
+            self._data[name] = _LocalStream()
+        stream = self._data[name]
+        if not isinstance(stream, _LocalStream):
+            raise redis.ResponseError("WRONGTYPE key does not hold a stream")
+        return stream
+
+    def _group(self, name, groupname):
+        stream = self._stream(name)
+        group = stream.groups.get(groupname) if stream else None
+        if group is None:
+            raise redis.ResponseError(f"NOGROUP No such key '{name}' or consumer group '{groupname}'")
+        return stream, group
+
+    def xadd(self, name, fields, id="*", maxlen=None, approximate=True):
+        with self._lock:
+            entry_id = self._stream(name, create=True).add(fields, maxlen)
+            self._stream_added.notify_all()
+            return entry_id
+
+    def xlen(self, name):
+        with self._lock:
+            stream = self._stream(name)
+            return len(stream.entries) if stream else 0
+
+    def xgroup_create(self, name, groupname, id="$", mkstream=False):
+        with self._lock:
+            stream = self._stream(name, create=mkstream)
+            if stream is None:
+                raise redis.ResponseError("ERR The XGROUP subcommand requires the key to exist")
+            if groupname in stream.groups:
+                raise redis.ResponseError("BUSYGROUP Consumer Group name already exists")
+            stream.groups[groupname] = {"last": stream.last if id == "$" else _parse_stream_id(id), "pending": {}}
+            return True
+
+    def xreadgroup(self, groupname, consumername, streams, count=None, block=None, noack=False):
+        deadline = None if block is None else _now() + block / 1000
+        with self._lock:
+            while True:
+                result = []
+                for name, start in streams.items():
+                    stream, group = self._group(name, groupname)
+                    messages = stream.read_group(group, consumername, start, count, noack)
+                    if messages:
+                        result.append([name, messages])
+                if result or block is None:
+                    return result
+                remaining = None if block == 0 else deadline - _now()
+                if remaining is not None and remaining <= 0:
+                    return []
+                self._stream_added.wait(remaining)
+
+    def xack(self, name, groupname, *ids):
+        with self._lock:
+            _, group = self._group(name, groupname)
+            return sum(1 for entry_id in ids if group["pending"].pop(entry_id, None) is not None)
+
+    def xautoclaim(self, name, groupname, consumername, min_idle_time, start_id="0-0", count=None, justid=False):
+        with self._lock:
+            stream, group = self._group(name, groupname)
+            next_id, claimed, deleted = stream.claim(group, consumername, min_idle_time, start_id, count or 100)
+            return claimed if justid else [next_id, claimed, deleted]
+
+    def xpending(self, name, groupname):
+        with self._lock:
+            _, group = self._group(name, groupname)
+            pending = group["pending"]
+            if not pending:
+                return {"pending": 0, "min": None, "max": None, "consumers": []}
+            ids = sorted(pending, key=_parse_stream_id)
+            per_consumer = {}
+            for consumer, _, _ in pending.values():
+                per_consumer[consumer] = per_consumer.get(consumer, 0) + 1
+            return {"pending": len(ids), "min": ids[0], "max": ids[-1],
+                    "consumers": [{"name": consumer, "pending": n} for consumer, n in per_consumer.items()]}
+
+    def ping(self):
+        return True
+
+    def pipeline(self, transaction=True):
+        return LocalPipeline(self)
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for pubsub in subscribers:
+            pubsub._deliver(channel, message)
+        return len(subscribers)
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        return LocalPubSub(self, ignore_subscribe_messages)
+
+
+def _parse_stream_id(entry_id):
+    if entry_id in ("-", "0"):
+        return (0, 0)
+    ms, _, seq = str(entry_id).partition("-")
+    return (int(ms), int(seq or 0))
+
+
+class _LocalStream:
+    """Entries, consumer groups and pending lists of one LocalRedis stream."""
+
+    def __init__(self):
+        self.entries = []  # (id tuple, id string, fields), oldest first
+        self.by_id = {}
+        self.last = (0, 0)
+        self.groups = {}
+
+    def add(self, fields, maxlen=None):
+        ms = int(time.time() * 1000)
+        self.last = (ms, 0) if ms > self.last[0] else (self.last[0], self.last[1] + 1)
+        entry_id = f"{self.last[0]}-{self.last[1]}"
+        values = {str(key): str(value) for key, value in fields.items()}
+        self.entries.append((self.last, entry_id, values))
+        self.by_id[entry_id] = values
+        if maxlen is not None and len(self.entries) > maxlen:
+            for _, old_id, _ in self.entries[:-maxlen]:
+                del self.by_id[old_id]
+            del self.entries[:-maxlen]
+        return entry_id
+
+    def read_group(self, group, consumer, start, count, noack):
+        if start != ">":
+            # Re-read this consumer's own pending entries after ``start``
+            after = _parse_stream_id(start)
+            ids = sorted((entry_id for entry_id, (owner, _, _) in group["pending"].items()
+                          if owner == consumer and _parse_stream_id(entry_id) > after), key=_parse_stream_id)
+            return [(entry_id, self.by_id.get(entry_id)) for entry_id in ids[:count]]
+
+        first = bisect_right(self.entries, group["last"], key=lambda entry: entry[0])
+        batch = self.entries[first:first + count if count else None]
+        if batch:
+            group["last"] = batch[-1][0]
+        if not noack:
+            now = _now()
+            for _, entry_id, _ in batch:
+                group["pending"][entry_id] = [consumer, now, 1]
+        return [(entry_id, dict(values)) for _, entry_id, values in batch]
+
+    def claim(self, group, consumer, min_idle_time, start_id, count):
+        start = _parse_stream_id(start_id)
+        now = _now()
+        claimed, deleted = [], []
+        ids = sorted((entry_id for entry_id in group["pending"] if _parse_stream_id(entry_id) >= start),
+                     key=_parse_stream_id)
+        for position, entry_id in enumerate(ids):
+            if len(claimed) >= count:
+                return entry_id, claimed, deleted
+            owner = group["pending"][entry_id]
+            if (now - owner[1]) * 1000 < min_idle_time:
+                continue
+            if entry_id not in self.by_id:
+                # Trimmed away while pending
+                del group["pending"][entry_id]
+                deleted.append(entry_id)
+                continue
+            group["pending"][entry_id] = [consumer, now, owner[2] + 1]
+            claimed.append((entry_id, dict(self.by_id[entry_id])))
+        return "0-0", claimed, deleted
+
+
+class LocalPipeline:
+    """Queues LocalRedis calls and runs them atomically on execute()."""
+
+    def __init__(self, client):
+        self._client = client
+        self._calls = []
+
+    def __getattr__(self, name):
+        method = getattr(self._client, name)
+
+        def queue(*args, **kwargs):
+            self._calls.append((method, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        with self._client._lock:
+            results = [method(*args, **kwargs) for method, args, kwargs in self._calls]
+        self._calls = []
+        return results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._calls = []
+
+
+class LocalPubSub:
+    """Same-process publish/subscribe for LocalRedis, shaped like redis-py's PubSub."""
+
+    def __init__(self, client, ignore_subscribe_messages=False):
+        self._client = client
+        self._ignore_subscribe_messages = ignore_subscribe_messages
+        self._messages = Queue()
+        self._channels = set()
+
+    def _deliver(self, channel, data):
+        self._messages.put({"type": "message", "pattern": None, "channel": channel, "data": data})
+
+    def subscribe(self, *channels):
+        with self._client._lock:
+            for channel in channels:
+                self._client._subscribers.setdefault(channel, set()).add(self)
+                self._channels.add(channel)
+                if not self._ignore_subscribe_messages:
+                    self._messages.put({"type": "subscribe", "pattern": None, "channel": channel, "data": len(self._channels)})
+
+    def unsubscribe(self, *channels):
+        with self._client._lock:
+            for channel in channels or list(self._channels):
+                self._client._subscribers.get(channel, set()).discard(self)
+                self._channels.discard(channel)
+
+    def get_message(self, ignore_subscribe_messages=False, timeout=0.0):
+        try:
+            return self._messages.get(timeout=timeout) if timeout else self._messages.get_nowait()
+        except Empty:
+            return None
+
+    def listen(self):
+        while True:
+            yield self._messages.get()
+
+    def close(self):
+        self.unsubscribe()
+
+
+class Script:
+    """A Lua script with an equivalent Python implementation for LocalRedis.
+
+    ``local_impl(client, keys, args)`` runs under the stand-in's lock, which
+    gives it the same atomicity the Lua script has on a real server.
+    """
+
+    def __init__(self, lua, local_impl):
+        self.lua = lua
+        self.local_impl = local_impl
+        self._registered = weakref.WeakKeyDictionary()
+
+    def __call__(self, keys=(), args=(), client=None):
+        client = client or get_redis()
+        if isinstance(client, LocalRedis):
+            with client._lock:
+                return self.local_impl(client, list(keys), list(args))
+
+        script = self._registered.get(client)
+        if script is None:
+            script = self._registered[client] = client.register_script(self.lua)
+        return script(keys=list(keys), args=list(args))
+
+
+_client_lock = threading.Lock()
+
+
+def get_redis():
+    """Return the active Redis client (a real server or the local stand-in)."""
+    global redis_client
+    if redis_client is None:
+        with _client_lock:
+            if redis_client is None:
+                redis_client = redis.Redis(host='localhost', port=6379, decode_responses=True)
+    return redis_client
+
+
+_binary_clients = weakref.WeakKeyDictionary()
+
+
+def get_binary_redis():
+    """Return a client for the active server that returns raw bytes.
+
+    ``redis_client`` decodes responses to str, which would corrupt binary
+    cache payloads; this twin shares its connection settings.
+    """
+    client = get_redis()
+    if isinstance(client, LocalRedis):
+        return client
+
+    binary = _binary_clients.get(client)
+    if binary is None:
+        pool = client.connection_pool
+        kwargs = dict(pool.connection_kwargs, decode_responses=False)
+        binary = redis.Redis(connection_pool=redis.ConnectionPool(connection_class=pool.connection_class, **kwargs))
+        _binary_clients[client] = binary
+    return binary
+
+
+def use_local_redis():
+    """Switch the app to the in-process Redis stand-in."""
+    global redis_client
+    if not isinstance(redis_client, LocalRedis):
+        redis_client = LocalRedis()
+    return redis_client
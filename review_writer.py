@@ -0,0 +1,149 @@
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from queue import Queue, Empty
+
+from db import db_connection
+from logger import logger
+
+INSERT_REVIEW_SQL = """
+    INSERT INTO reviews (user_id, media_id, rating, comment, created_at)
+    VALUES (?, ?, ?, ?, CAST(strftime('%s', 'now') AS INTEGER))
+"""
+
+_STOP = object()
+
+
+def inserted_ids(conn, count):
+    """Ids of the last ``count`` reviews inserted on ``conn`` in its current
+    transaction. The write lock keeps other writers out and AUTOINCREMENT
+    hands out increasing ids, so they are consecutive."""
+    last = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+    return list(range(last - count + 1, last + 1))
+
+
+def validate_review(user_id, media_id, rating, comment):
+    """Return an error message for an invalid review, or None if it is valid."""
+    if not isinstance(user_id, int) or not isinstance(media_id, int):
+        return "User ID and media ID must be integers."
+    if not isinstance(comment, str) or not comment.strip():
+        return "Comment cannot be empty!"
+    if not isinstance(rating, int) or rating < 1 or rating > 5:
+        return "Rating must be between 1 and 5."
+    return None
+
+
+class ReviewWriter:
+    """Background writer that group-commits queued reviews.
+
+    Reviews submitted from any thread are coalesced into a single
+    ``executemany`` transaction once ``max_batch`` rows are waiting or
+    ``max_delay`` seconds have passed since the first one arrived.
+    ``submit`` returns a Future that resolves once the row is committed, or
+    fails with the per-row validation/database error. ``on_commit`` gets
+    the committed rows and their review ids.
+    """
+
+    def __init__(self, max_batch=1000, max_delay=0.05, on_commit=None):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.on_commit = on_commit
+        self._queue = Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.stats = {"batches": 0, "rows": 0, "failed": 0}
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="review-writer", daemon=True)
+                self._thread.start()
+        return self
+
+    def submit(self, user_id, media_id, rating, comment):
+        """Queue a review for writing. Returns a Future."""
+        future = Future()
+        error = validate_review(user_id, media_id, rating, comment)
+        if error:
+            future.set_exception(ValueError(error))
+            return future
+
+        self.start()
+        self._queue.put(((user_id, media_id, rating, comment), future))
+        return future
+
+    def close(self):
+        """Flush pending reviews and stop the writer thread."""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self._write(batch)
+
+    def _write(self, batch):
+        rows = [row for row, _ in batch]
+        try:
+            try:
+                with db_connection() as conn:
+                    conn.executemany(INSERT_REVIEW_SQL, rows)
+                    ids = inserted_ids(conn, len(rows))
+                written = batch
+            except sqlite3.IntegrityError:
+                # Some row violates a constraint; retry one by one to isolate it
+                written, ids = self._write_individually(batch)
+        except sqlite3.Error as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+                    self.stats["failed"] += 1
+            return
+
+        self.stats["batches"] += 1
+        self.stats["rows"] += len(written)
+
+        if written and self.on_commit is not None:
+            try:
+                self.on_commit([row for row, _ in written], ids)
+            except Exception as e:
+                logger.error(f"Review writer post-commit hook failed: {e}")
+
+        for _, future in written:
+            future.set_result(None)
+
+    def _write_individually(self, batch):
+        written, ids = [], []
+        with db_connection() as conn:
+            conn.execute("BEGIN")
+            for row, future in batch:
+                try:
+                    conn.execute("SAVEPOINT review_row")
+                    ids.append(conn.execute(INSERT_REVIEW_SQL, row).lastrowid)
+                    conn.execute("RELEASE review_row")
+                    written.append((row, future))
+                except sqlite3.Error as e:
+                    conn.execute("ROLLBACK TO review_row")
+                    conn.execute("RELEASE review_row")
+                    future.set_exception(e)
+                    self.stats["failed"] += 1
+        return written, ids
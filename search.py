@@ -0,0 +1,88 @@
+import re
+
+# Tokens as FTS5's unicode61 tokenizer sees them: runs of letters/digits
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Markers placed around matched terms by snippet()/highlight(); callers
+# swap them for their own markup after escaping the text
+MATCH_START = "\x02"
+MATCH_END = "\x03"
+
+
+def fts_query(text, prefix=True):
+    """Turn free text into an FTS5 MATCH expression.
+
+    Every word becomes a quoted term (so user input can't inject FTS
+    operators) and, with ``prefix``, the last word also matches as a
+    prefix: "dark kni" finds "The Dark Knight". Returns None when the
+    text has no searchable words.
+    """
+    tokens = _TOKEN_RE.findall(text)
+    if not tokens:
+        return None
+    terms = [f'"{token}"' for token in tokens]
+    if prefix:
+        terms[-1] += "*"
+    return " ".join(terms)
+
+
+def _media_matches(query, media_type):
+    """FROM/WHERE clause and parameters for media matching ``query``,
+    shared by the page query and its count so both apply the same filter."""
+    type_filter = "AND media.type = ?" if media_type else ""
+    clause = f"""
+        FROM media_fts
+        JOIN media ON media.id = media_fts.rowid
+        WHERE media_fts MATCH ? {type_filter}"""
+    return clause, [query] + ([media_type] if media_type else [])
+
+
+def search_media(conn, text, limit=10, offset=0, media_type=None):
+    """Return (id, title, type, score) for media matching ``text``, best first.
+
+    Scores are bm25 values, so lower is a better match.
+    """
+    query = fts_query(text)
+    if query is None:
+        return []
+    clause, params = _media_matches(query, media_type)
+    return conn.execute(f"""
+        SELECT media.id, media.title, media.type, bm25(media_fts) AS score{clause}
+        ORDER BY score
+        LIMIT ? OFFSET ?
+    """, params + [limit, offset]).fetchall()
+
+
+def search_reviews(conn, text, limit=10, offset=0):
+    """Return (review id, user, media, rating, snippet, score) for matching review comments."""
+    query = fts_query(text)
+    if query is None:
+        return []
+    return conn.execute(f"""
+        SELECT reviews.id, users.name, media.title, reviews.rating,
+               snippet(reviews_fts, 0, '{MATCH_START}', '{MATCH_END}', '…', 12),
+               bm25(reviews_fts) AS score
+        FROM reviews_fts
+        JOIN reviews ON reviews.id = reviews_fts.rowid
+        JOIN users ON reviews.user_id = users.id
+        JOIN media ON reviews.media_id = media.id
+        WHERE reviews_fts MATCH ?
+        ORDER BY score
+        LIMIT ? OFFSET ?
+    """, (query, limit, offset)).fetchall()
+
+
+def count_matches(conn, table, text, media_type=None):
+    """Number of rows in an FTS table (media_fts or reviews_fts) matching ``text``.
+
+    ``media_type`` (media_fts only) counts what search_media returns for it.
+    """
+    query = fts_query(text)
+    if query is None:
+        return 0
+    if table == "media_fts":
+        clause, params = _media_matches(query, media_type)
+        return conn.execute(f"SELECT COUNT(*){clause}", params).fetchone()[0]
+    if media_type:
+        raise ValueError(f"media_type only applies to media_fts, not {table}")
+    return conn.execute(f"SELECT COUNT(*) FROM {table} WHERE {table} MATCH ?", (query,)).fetchone()[0]
@@ -0,0 +1,77 @@
+from redis_cache import get_redis
+
+# subscribers:<media_id> holds the names of a media's subscribers. Sets are
+# loaded from SQLite per media on first fan-out and only ever added to, so
+# a subscribe racing a load can't be lost.
+LOADED_KEY = "subscribers:loaded"
+# Members per SSCAN call
+SCAN_COUNT = 1000
+# Media ids per SQLite query when loading sets
+_LOAD_CHUNK = 500
+
+
+def media_key(media_id):
+    return f"subscribers:{media_id}"
+
+
+def subscribers_of(conn, media_ids):
+    """Return {media_id: [subscriber names]} from SQLite, one query per chunk of media."""
+    media_ids = list(media_ids)
+    found = {}
+    for start in range(0, len(media_ids), _LOAD_CHUNK):
+        chunk = media_ids[start:start + _LOAD_CHUNK]
+        rows = conn.execute(f"""
+            SELECT subscriptions.media_id, users.name FROM subscriptions
+            JOIN users ON subscriptions.user_id = users.id
+            WHERE subscriptions.media_id IN ({', '.join('?' * len(chunk))})
+        """, chunk)
+        for media_id, name in rows:
+            found.setdefault(media_id, []).append(name)
+    return found
+
+
+def ensure_loaded(conn, media_ids, client=None):
+    """Load the sets of any of ``media_ids`` not cached yet. Returns how many were loaded."""
+    client = client or get_redis()
+    media_ids = list(media_ids)
+    if not media_ids:
+        return 0
+    flags = client.smismember(LOADED_KEY, [str(media_id) for media_id in media_ids])
+    missing = [media_id for media_id, loaded in zip(media_ids, flags) if not int(loaded)]
+    if not missing:
+        return 0
+
+    found = subscribers_of(conn, missing)
+    pipe = client.pipeline(transaction=False)
+    for media_id, names in found.items():
+        for start in range(0, len(names), SCAN_COUNT):
+            pipe.sadd(media_key(media_id), *names[start:start + SCAN_COUNT])
+    pipe.sadd(LOADED_KEY, *[str(media_id) for media_id in missing])
+    pipe.execute()
+    return len(missing)
+
+
+def add(media_id, name, client=None):
+    """Record a new subscription in the media's cached set."""
+    (client or get_redis()).sadd(media_key(media_id), name)
+
+
+def scan(media_id, cursor=0, count=SCAN_COUNT, client=None):
+    """Return (next cursor, names) for one chunk of a media's subscribers; cursor 0 means done.
+
+    As with any SSCAN, a member can be returned twice.
+    """
+    cursor, names = (client or get_redis()).sscan(media_key(media_id), cursor, count=count)
+    return int(cursor), names
+
+
+def rebuild(client=None):
+    """Drop every cached set so each is reloaded from SQLite on next use. Returns how many were dropped."""
+    client = client or get_redis()
+    loaded = [media_key(media_id) for media_id in client.smembers(LOADED_KEY)]
+    pipe = client.pipeline()
+    for start in range(0, len(loaded), _LOAD_CHUNK):
+        pipe.delete(*loaded[start:start + _LOAD_CHUNK])
+    pipe.delete(LOADED_KEY)
+    pipe.execute()
+    return len(loaded)
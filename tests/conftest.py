@@ -0,0 +1,118 @@
+import os
+import sys
+import threading
+from collections import Counter
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cache  # noqa: E402
+import db  # noqa: E402
+import logger  # noqa: E402
+import notifications  # noqa: E402
+import redis_cache  # noqa: E402
+
+
+@pytest.fixture(autouse=True, scope="session")
+def log_file(tmp_path_factory):
+    """Keep test logging out of the working directory's notifications.log."""
+    path = tmp_path_factory.mktemp("logs") / "notifications.log"
+    logger.configure_logging(path=str(path))
+    yield path
+    logger.shutdown()
+
+
+@pytest.fixture
+def local_redis():
+    """A fresh in-process Redis stand-in for the duration of one test."""
+    previous = redis_cache.redis_client
+    client = redis_cache.redis_client = redis_cache.LocalRedis()
+    cache._clear_local()
+    yield client
+    redis_cache.redis_client = previous
+    cache._clear_local()
+
+
+@pytest.fixture
+def redis_down():
+    """A real client for a port nothing listens on, as when the server is down."""
+    import redis
+
+    previous = redis_cache.redis_client
+    redis_cache.redis_client = redis.Redis(port=1, socket_connect_timeout=0.2, decode_responses=True)
+    cache._clear_local()
+    yield
+    redis_cache.redis_client = previous
+    cache._clear_local()
+
+
+@pytest.fixture
+def redis_server():
+    """A real server from REDIS_TEST_URL, to run the Lua scripts LocalRedis stands in for.
+    Its database is flushed before and after the test."""
+    url = os.environ.get("REDIS_TEST_URL")
+    if not url:
+        pytest.skip("REDIS_TEST_URL is not set")
+    import redis
+
+    client = redis.Redis.from_url(url, decode_responses=True)
+    try:
+        client.flushdb()
+    except redis.RedisError as e:
+        pytest.skip(f"Redis at {url} is unreachable: {e}")
+    yield client
+    client.flushdb()
+    client.close()
+
+
+@pytest.fixture
+def scratch_db(tmp_path):
+    """Point the shared pool at an initialized database in a temporary directory."""
+    path = str(tmp_path / "test.db")
+    db.configure_pool(database=path)
+    db.initialize_db()
+    yield path
+    _close_notifier()
+    db.configure_pool()
+
+
+def _close_notifier():
+    """Deliver notifications queued by the test while its database is still configured."""
+    logic = sys.modules.get("logic")
+    if logic is not None and logic._notifier is not None:
+        logic._notifier.close()
+        logic._notifier = None
+        logic.notifications._dispatcher = None
+
+
+def seed(users=3, media=3):
+    with db.db_connection() as conn:
+        conn.executemany("INSERT INTO users (name) VALUES (?)", [(f"user{i}",) for i in range(users)])
+        conn.executemany("INSERT INTO media (title, type) VALUES (?, 'Movie')", [(f"media{i}",) for i in range(media)])
+
+
+def add_reviews(rows):
+    with db.db_connection() as conn:
+        conn.executemany("INSERT INTO reviews (user_id, media_id, rating, comment) VALUES (?, ?, ?, ?)", rows)
+
+
+def subscribe(pairs):
+    with db.db_connection() as conn:
+        conn.executemany("INSERT INTO subscriptions (user_id, media_id) VALUES (?, ?)", pairs)
+
+
+def review_event(media_id, i):
+    return media_id, notifications.review_details(1, media_id, 1 + i % 5, f"review {i}")
+
+
+class Inbox:
+    """A notification sink recording every (subscriber, media_id, comment) delivered."""
+
+    def __init__(self):
+        self.received = Counter()
+        self._lock = threading.Lock()
+
+    def __call__(self, name, media_id, details):
+        with self._lock:
+            self.received.update((name, media_id, detail["comment"]) for detail in details)
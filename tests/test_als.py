@@ -0,0 +1,77 @@
+import pytest
+
+import als
+import db
+from conftest import add_reviews
+
+np = pytest.importorskip("numpy")
+
+
+def _low_rank(users=30, media=20, seed=1):
+    """A rank-2 rating matrix with every entry observed except the diagonal."""
+    rng = np.random.default_rng(seed)
+    truth = 3 + rng.normal(0, 1, (users, 2)) @ rng.normal(0, 0.7, (2, media))
+    pairs = [(u, m) for u in range(users) for m in range(media) if u != m]
+    return truth, [u + 1 for u, _ in pairs], [m + 1 for _, m in pairs], [truth[u, m] for u, m in pairs]
+
+
+@pytest.mark.parametrize("implicit", [False, True])
+def test_batched_solve_matches_one_solve_per_row(implicit, monkeypatch):
+    # Small blocks, so rows of different lengths land in several padded batches
+    monkeypatch.setattr(als, "BLOCK_RATINGS", 12)
+    rng = np.random.default_rng(0)
+    n_rows, n_cols, k, regularization, alpha = 9, 7, 3, 0.1, als.ALPHA
+    rows = rng.integers(0, n_rows - 1, 40)  # the last row has no ratings
+    cols = rng.integers(0, n_cols, 40)
+    values = rng.integers(1, 6, 40).astype(np.float64)
+    fixed = rng.normal(0, 1, (n_cols, k))
+    indptr, sorted_cols, sorted_values = als._by_row(rows, cols, values, n_rows)
+
+    solved = als._solve_side(indptr, sorted_cols, sorted_values, fixed, regularization, implicit, alpha)
+
+    for row in range(n_rows):
+        y, r = fixed[sorted_cols[indptr[row]:indptr[row + 1]]], sorted_values[indptr[row]:indptr[row + 1]]
+        if not len(r):
+            assert not solved[row].any()
+            continue
+        if implicit:
+            confidence = 1 + alpha * r
+            gram = fixed.T @ fixed + y.T @ ((confidence - 1)[:, None] * y) + regularization * np.eye(k)
+            rhs = y.T @ confidence
+        else:
+            gram = y.T @ y + regularization * len(r) * np.eye(k)
+            rhs = y.T @ r
+        assert solved[row] == pytest.approx(np.linalg.solve(gram, rhs))
+
+
+def test_explicit_model_recovers_held_out_ratings():
+    truth, users, media, ratings = _low_rank()
+    model = als.train(users, media, ratings, factors=2, iterations=30, regularization=0.01)
+
+    held_out = [(u, u) for u in range(20)]
+    predicted = [float(model.item_factors[m] @ model.user_factors[u]) + model.mean for u, m in held_out]
+    error = np.sqrt(np.mean([(p - truth[u, m]) ** 2 for p, (u, m) in zip(predicted, held_out)]))
+    assert error < 0.1
+
+    best, score = model.recommend(1, {m: 3 for m in range(2, 21)}, limit=1)[0]
+    assert best == 1 and score == pytest.approx(truth[0, 0], abs=0.1)
+
+
+def test_saved_factors_and_fold_in(scratch_db, tmp_path, monkeypatch):
+    _, users, media, ratings = _low_rank(users=12, media=8)
+    add_reviews([(u, m, round(r), "x") for u, m, r in zip(users, media, ratings) if 1 <= round(r) <= 5])
+    monkeypatch.setattr(als, "_model", None)
+    prefix = str(tmp_path / "als")
+
+    with db.db_connection() as conn:
+        trained = als.train_model(conn, prefix=prefix, factors=4, iterations=15)
+        served = als.get_model(conn, prefix=prefix)
+        ratings_of_2 = dict(conn.execute("SELECT media_id, rating FROM reviews WHERE user_id = 2"))
+    assert isinstance(served.item_factors, np.memmap)
+    assert served.recommend(2, ratings_of_2) == trained.recommend(2, ratings_of_2)
+    assert [m for m, _ in served.recommend(2, ratings_of_2)] == [m for m in range(1, 9) if m not in ratings_of_2]
+
+    # A user the model never saw gets factors solved from their ratings
+    folded = served.recommend(99, ratings_of_2)
+    assert [m for m, _ in folded] == [m for m, _ in served.recommend(2, ratings_of_2)]
+    assert served.recommend(99, {}) == []
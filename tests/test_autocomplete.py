@@ -0,0 +1,64 @@
+import random
+
+import pytest
+
+import autocomplete
+import logic
+from conftest import seed
+
+
+@pytest.fixture
+def indexes():
+    autocomplete.reset()
+    yield
+    autocomplete.reset()
+
+
+def test_completions_rank_by_reviews_then_name():
+    index = autocomplete.PrefixIndex([(1, "The Dark Knight", 3), (2, "Thelma", 7), (3, "Théodora", 3),
+                                      (4, "Heat", 9), (5, "the dark", 3)])
+    assert index.complete("the") == [(2, "Thelma", 7), (5, "the dark", 3), (1, "The Dark Knight", 3),
+                                     (3, "Théodora", 3)]
+    assert index.complete("THE DARK K") == [(1, "The Dark Knight", 3)]
+    assert index.complete("theo", limit=1) == [(3, "Théodora", 3)]
+    assert index.complete("x") == []
+
+
+def test_memoized_completions_match_a_fresh_index(monkeypatch):
+    # Memoize every prefix so each update has to patch the memo in place
+    monkeypatch.setattr(autocomplete, "SCAN_LIMIT", 0)
+    monkeypatch.setattr(autocomplete, "MEMO_SIZE", 3)
+    rng = random.Random(7)
+    entries = {i: [f"{rng.choice('ab')}{rng.choice('ab')}{i}", rng.randrange(4)] for i in range(1, 30)}
+    index = autocomplete.PrefixIndex((i, name, count) for i, (name, count) in entries.items())
+    prefixes = ["", "a", "b", "aa", "ab", "ba", "bb"]
+
+    for step in range(300):
+        for prefix in prefixes:
+            index.complete(prefix, limit=3)
+        entry_id = rng.randrange(1, len(entries) + 2)
+        if entry_id > len(entries):
+            entries[entry_id] = [f"{rng.choice('ab')}{rng.choice('ab')}{entry_id}", 0]
+            index.add(entry_id, entries[entry_id][0])
+        else:
+            delta = rng.choice([1, 1, 2, -1]) if entries[entry_id][1] else 1
+            entries[entry_id][1] += delta
+            index.bump(entry_id, delta)
+
+        fresh = autocomplete.PrefixIndex((i, name, count) for i, (name, count) in entries.items())
+        for prefix in prefixes:
+            assert index.complete(prefix, limit=3) == fresh.complete(prefix, limit=3), (step, prefix)
+
+
+def test_new_users_media_and_reviews_update_loaded_indexes(local_redis, scratch_db, indexes):
+    seed(users=2, media=2)
+    assert autocomplete.complete("media", "med") == [(1, "media0", 0), (2, "media1", 0)]
+    assert autocomplete.complete("users", "user") == [(1, "user0", 0), (2, "user1", 0)]
+
+    logic.add_media("Medea", "Movie")
+    logic.add_user("userly")
+    logic.add_review(2, 2, 4, "solid")
+    logic.add_review(3, 3, 5, "moving")
+
+    assert autocomplete.complete("media", "me") == [(3, "Medea", 1), (2, "media1", 1), (1, "media0", 0)]
+    assert autocomplete.complete("users", "user", limit=2) == [(2, "user1", 1), (3, "userly", 1)]
@@ -0,0 +1,44 @@
+import benchmarks
+import db
+import logic
+from conftest import seed
+
+
+def test_no_stale_reads_after_writes():
+    result = benchmarks.check_cache_coherence(rounds=50, readers=2)
+    assert result["reads"] == 150
+    assert result["stale_reads"] == 0
+
+
+def test_reviews_are_saved_when_redis_is_down(redis_down, scratch_db, caplog):
+    seed()
+    logic.add_review(1, 2, 4, "fine")
+    logic._after_reviews_committed([(2, 3, 5, "great")], [2])
+
+    with db.db_connection() as conn:
+        assert conn.execute("SELECT user_id, media_id, rating FROM reviews ORDER BY id").fetchall() == [(1, 2, 4)]
+    assert "Cache invalidation failed" in caplog.text
+
+
+def test_a_review_only_invalidates_the_lists_it_belongs_to(local_redis, scratch_db, capsys):
+    seed()
+    queries = [{}, {"media_id": 1}, {"media_id": 2}, {"user_id": 1}, {"user_id": 2}, {"media_id": 2, "user_id": 1}]
+    for query in queries:
+        db.get_reviews(**query)
+    capsys.readouterr()
+
+    logic.add_review(1, 1, 5, "new")
+    capsys.readouterr()
+    served = {}
+    for query in queries:
+        reviews = db.get_reviews(**query)
+        served[tuple(query.items())] = (capsys.readouterr().out.strip(), len(reviews))
+
+    assert served == {
+        (): ("Fetching reviews from Database...", 1),
+        (("media_id", 1),): ("Fetching reviews from Database...", 1),
+        (("media_id", 2),): ("Fetching reviews from the in-process cache...", 0),
+        (("user_id", 1),): ("Fetching reviews from Database...", 1),
+        (("user_id", 2),): ("Fetching reviews from the in-process cache...", 0),
+        (("media_id", 2), ("user_id", 1)): ("Fetching reviews from Database...", 0),
+    }
@@ -0,0 +1,76 @@
+import cache
+import cache_codec
+import db
+from conftest import seed
+
+
+ROWS = [
+    ("alice", "Heat", 5, "great"),
+    ("bob", "Heat", None, None),
+    ("alice", "Fargo", 1, ""),
+    ("carol", "Fargo", 3, "café — ok"),
+]
+
+
+def _round_trip(value, codec, threshold=cache_codec.COMPRESS_THRESHOLD):
+    frame, flags = cache_codec.encode_frame(value, codec, 10.0, 20.0, 0.5, threshold=threshold)
+    envelope, body = cache_codec.decode_frame(frame)
+    assert (envelope["soft"], envelope["hard"], envelope["delta"]) == (10.0, 20.0, 0.5)
+    return cache_codec.decode_value(envelope, body), flags
+
+
+def test_json_round_trip():
+    value = {"rows": [[1, "a"], [2, None]], "total": 2}
+    assert _round_trip(value, cache_codec.JSON)[0] == value
+
+
+def test_review_rows_round_trip_keeps_missing_ratings_and_comments():
+    decoded, _ = _round_trip(ROWS, cache_codec.REVIEW_ROWS)
+    assert decoded == ROWS
+
+
+def test_review_rows_round_trip_empty():
+    assert _round_trip([], cache_codec.REVIEW_ROWS)[0] == []
+
+
+def test_large_frames_are_compressed():
+    rows = ROWS * 1000
+    decoded, flags = _round_trip(rows, cache_codec.REVIEW_ROWS)
+    assert decoded == rows
+    assert flags & (cache_codec.FLAG_ZLIB | cache_codec.FLAG_LZ4)
+
+
+def test_split_frame_reassembles():
+    rows = [(f"user{i}", f"media{i % 7}", i % 5 + 1, f"comment {i}") for i in range(5000)]
+    frame, _ = cache_codec.encode_frame(rows, cache_codec.REVIEW_ROWS, 1.0, 2.0, 0.0, threshold=1 << 30)
+
+    manifest, chunks = cache_codec.split_frame(frame, token=42, chunk_size=1024)
+    assert len(chunks) > 1
+    envelope, manifest_body = cache_codec.decode_frame(manifest)
+    assert envelope["flags"] & cache_codec.FLAG_CHUNKED
+    keys = cache_codec.chunk_keys("cache:q", manifest_body)
+    assert keys == [f"cache:q#42:{i}" for i in range(len(chunks))]
+
+    assert cache_codec.decode_value(envelope, b"".join(chunks)) == rows
+
+
+def test_small_frames_are_not_split():
+    frame, _ = cache_codec.encode_frame(ROWS, cache_codec.REVIEW_ROWS, 1.0, 2.0, 0.0)
+    assert cache_codec.split_frame(frame, token=1) == (frame, [])
+
+
+def test_reviews_read_back_from_each_tier_unchanged(local_redis, scratch_db, capsys):
+    seed(users=2, media=2)
+    with db.db_connection() as conn:
+        conn.executemany("INSERT INTO reviews (user_id, media_id, rating, comment) VALUES (?, ?, ?, ?)",
+                         [(1, 1, 5, "café — ok"), (2, 1, None, "no rating"), (1, 2, 1, "")])
+
+    fresh = db.get_reviews()
+    assert sorted(fresh) == sorted([("user0", "media0", 5, "café — ok"), ("user1", "media0", None, "no rating"),
+                                    ("user0", "media1", 1, "")])
+    assert db.get_reviews() == fresh
+    cache.local_tier.clear()
+    assert db.get_reviews() == fresh
+    assert capsys.readouterr().out.splitlines() == ["Fetching reviews from Database...",
+                                                    "Fetching reviews from the in-process cache...",
+                                                    "Fetching reviews from Redis cache..."]
@@ -0,0 +1,36 @@
+import cache
+import db
+from conftest import seed
+
+
+def test_cached_query_reports_tier_and_follows_invalidation(local_redis):
+    calls = []
+
+    def builder():
+        calls.append(1)
+        return len(calls)
+
+    assert cache.cached_query("q", ["scope"], builder) == (1, None)
+    assert cache.cached_query("q", ["scope"], builder) == (1, "local")
+    cache.local_tier.clear()
+    assert cache.cached_query("q", ["scope"], builder) == (1, "redis")
+
+    cache.invalidate_scopes(["scope"])
+    assert cache.cached_query("q", ["scope"], builder) == (2, None)
+    assert cache.cached_query("q", ["other"], builder) == (3, None)
+
+
+def test_lookup_sees_a_user_added_after_a_cached_miss(local_redis, scratch_db):
+    seed(users=1, media=0)
+    assert db.find_user_id("newcomer") is None
+    with db.db_connection() as conn:
+        user_id = conn.execute("INSERT INTO users (name) VALUES ('newcomer')").lastrowid
+    assert db.find_user_id("newcomer") == user_id
+    assert db.find_user_id("user0") == 1
+
+
+def test_lookups_fall_back_to_sqlite_when_redis_is_down(redis_down, scratch_db):
+    seed(users=2, media=2)
+    assert db.find_user_id("user1") == 2
+    assert db.find_media_id("media0") == 1
+    assert db.find_media_id("missing") is None
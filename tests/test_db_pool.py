@@ -0,0 +1,71 @@
+import threading
+
+import pytest
+
+from db_pool import ConnectionPool
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "pool.db"), size=2, pragmas={"journal_mode": "WAL"})
+    with pool.connection() as conn:
+        conn.execute("CREATE TABLE items (name TEXT)")
+    yield pool
+    pool.close()
+
+
+def _names(pool):
+    with pool.connection() as conn:
+        return [name for name, in conn.execute("SELECT name FROM items ORDER BY rowid")]
+
+
+def test_connections_are_reused_and_nested_blocks_share_a_transaction(pool):
+    with pool.connection() as outer:
+        outer.execute("INSERT INTO items VALUES ('a')")
+        with pool.connection() as inner:
+            assert inner is outer
+            inner.execute("INSERT INTO items VALUES ('b')")
+        assert outer.in_transaction
+    assert _names(pool) == ["a", "b"]
+    assert pool.stats()["misses"] == 1 and pool.stats()["reused"] == 1
+    assert pool.stats()["hits"] >= 1
+
+
+def test_failed_block_rolls_back(pool):
+    with pytest.raises(ValueError):
+        with pool.connection() as conn:
+            conn.execute("INSERT INTO items VALUES ('lost')")
+            raise ValueError("boom")
+    assert _names(pool) == []
+    assert pool.stats()["rollbacks"] == 1
+
+
+def test_threads_get_their_own_connections(pool):
+    barrier = threading.Barrier(4)
+    seen = []
+
+    def worker(i):
+        with pool.connection() as conn:
+            barrier.wait()
+            seen.append(id(conn))
+            conn.execute("INSERT INTO items VALUES (?)", (f"t{i}",))
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(set(seen)) == 4
+    assert sorted(_names(pool)) == ["t0", "t1", "t2", "t3"]
+    # Only ``size`` connections are kept once returned
+    assert pool.stats()["idle"] == 2
+
+
+def test_health_check_drops_broken_connections(pool):
+    with pool.connection() as conn:
+        pass
+    conn.close()
+    assert pool.health_check() == {"healthy": 0, "broken": 1, "idle": 0}
+    with pool.connection() as conn:
+        assert conn.execute("SELECT pow(2, 10)").fetchone() == (1024.0,)
@@ -0,0 +1,74 @@
+import pytest
+
+import notifications
+from conftest import seed, subscribe
+
+
+class Digests(list):
+    def __call__(self, name, media_id, digest):
+        self.append((name, media_id, digest["reviews"], digest["average"], digest["latest"]))
+
+
+def _details(*ratings):
+    return [{"rating": rating, "comment": f"rated {rating}"} for rating in ratings]
+
+
+def test_events_are_summed_per_subscriber_and_media():
+    digests = Digests()
+    sink = notifications.DigestSink(window=60, deliver=digests)
+    sink("ann", 1, _details(5, 3))
+    sink("ann", 1, _details(None))
+    sink("bob", 1, _details(4))
+    sink("ann", 2, _details(1))
+
+    assert sink.flush() == 0
+    assert sink.flush(everything=True) == 3
+    assert digests == [("ann", 1, 3, 4.0, "rated None"), ("bob", 1, 1, 4.0, "rated 4"), ("ann", 2, 1, 1.0, "rated 1")]
+    assert sink.metrics() == {"events": 5, "digests": 3, "early_flushes": 0, "dropped": 0, "max_buffers": 3,
+                              "buffered": 0}
+
+
+def test_window_decides_when_buffers_are_due(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(notifications.time, "monotonic", lambda: clock[0])
+    digests = Digests()
+    sink = notifications.DigestSink(window=60, deliver=digests)
+    sink("ann", 1, _details(5))
+    clock[0] += 30
+    sink("bob", 1, _details(2))
+
+    clock[0] += 29
+    assert sink.flush() == 0
+    clock[0] += 1
+    assert sink.flush() == 1 and digests == [("ann", 1, 1, 5.0, "rated 5")]
+    clock[0] += 30
+    assert sink.flush() == 1 and digests[-1] == ("bob", 1, 1, 2.0, "rated 2")
+
+
+@pytest.mark.parametrize("overflow, delivered, dropped", [
+    ("flush", [("ann", 1, 1, 5.0, "rated 5"), ("bob", 1, 2, 3.0, "rated 4"), ("cat", 1, 1, 1.0, "rated 1")], 0),
+    ("drop", [("ann", 1, 1, 5.0, "rated 5")], 3),
+])
+def test_overflow_policy_bounds_the_buffers(overflow, delivered, dropped):
+    digests = Digests()
+    sink = notifications.DigestSink(window=60, max_buffers=1, overflow=overflow, deliver=digests)
+    sink("ann", 1, _details(5))
+    sink("bob", 1, _details(2, 4))
+    sink("cat", 1, _details(1))
+    sink.close()
+    assert digests == delivered
+    assert sink.metrics()["dropped"] == dropped
+    assert sink.metrics()["max_buffers"] == 1
+
+
+def test_dispatcher_delivers_into_the_digest(local_redis, scratch_db):
+    seed(users=2, media=1)
+    subscribe([(1, 1), (2, 1)])
+    digests = Digests()
+    sink = notifications.DigestSink(window=60, deliver=digests).start()
+    dispatcher = notifications.NotificationDispatcher(workers=2, sink=sink).start()
+    dispatcher.submit_many((1, notifications.review_details(1, 1, rating, f"rated {rating}")) for rating in (2, 4, 3))
+    dispatcher.close()
+    sink.close()
+
+    assert sorted(digests) == [("user0", 1, 3, 3.0, "rated 3"), ("user1", 1, 3, 3.0, "rated 3")]
@@ -0,0 +1,55 @@
+import queue
+import time
+from collections import Counter
+
+import pytest
+
+import notifications
+import subscribers
+from conftest import Inbox, review_event, seed, subscribe
+
+
+def test_every_subscriber_gets_every_review_once(local_redis, scratch_db):
+    seed(users=4, media=3)
+    subscribe([(1, 1), (2, 1), (3, 1), (2, 2), (4, 2)])
+    inbox = Inbox()
+    dispatcher = notifications.NotificationDispatcher(workers=3, sink=inbox).start()
+    events = [review_event(1 + i % 3, i) for i in range(60)]
+    dispatcher.submit_many(events)
+    dispatcher.close()
+
+    followers = {1: ["user0", "user1", "user2"], 2: ["user1", "user3"], 3: []}
+    assert inbox.received == Counter({(name, media_id, details["comment"]): 1
+                                      for media_id, details in events for name in followers[media_id]})
+    metrics = dispatcher.metrics()
+    assert metrics["delivered"] == 60 and metrics["errors"] == 0
+    # Events on the same media arriving together share one fan-out
+    assert metrics["fanouts"] < 60
+
+
+def test_full_queue_pushes_back_on_the_producer(scratch_db):
+    dispatcher = notifications.NotificationDispatcher(workers=1, max_queue=2)
+    dispatcher.submit(*review_event(1, 0))
+    dispatcher.submit(*review_event(1, 1))
+    with pytest.raises(queue.Full):
+        dispatcher.submit(*review_event(1, 2), timeout=0.05)
+    assert dispatcher.metrics()["depth"] == 2
+
+
+def test_large_fan_out_is_resumed_behind_other_work(local_redis, scratch_db):
+    followers = 2 * subscribers.SCAN_COUNT + 500
+    seed(users=followers, media=2)
+    subscribe([(user, 1) for user in range(1, followers + 1)] + [(1, 2)])
+    inbox = Inbox()
+    # No time budget at all: every fan-out stops after its first SSCAN chunk
+    dispatcher = notifications.NotificationDispatcher(workers=1, sink=inbox, budget=1e-9).start()
+    dispatcher.submit(*review_event(1, 0))
+    dispatcher.submit(*review_event(2, 1))
+    deadline = time.monotonic() + 5
+    while dispatcher.metrics()["notifications"] < followers + 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    dispatcher.close()
+
+    assert inbox.received == Counter({**{(f"user{user}", 1, "review 0"): 1 for user in range(followers)},
+                                      ("user0", 2, "review 1"): 1})
+    assert dispatcher.metrics()["deferred"] == 2
@@ -0,0 +1,76 @@
+import os
+
+import pytest
+
+import db
+import fuzzy
+import logic
+
+TITLES = ["The Dark Knight", "Dark Waters", "Amélie", "Heat", "Into the Dark", "Knight Rider"]
+
+
+@pytest.fixture
+def shared_index(monkeypatch):
+    """Start each test without a loaded shared index."""
+    monkeypatch.setattr(fuzzy, "_index", None)
+
+
+def _index(titles=TITLES):
+    index = fuzzy.TrigramIndex()
+    for media_id, title in enumerate(titles, 1):
+        index.add(media_id, title)
+    return index
+
+
+def _add_media(titles=TITLES):
+    with db.db_connection() as conn:
+        conn.executemany("INSERT INTO media (title, type) VALUES (?, 'Movie')", [(title,) for title in titles])
+
+
+def test_search_tolerates_typos_and_diacritics():
+    index = _index()
+    assert index.search("dark knigt") == [(1, "The Dark Knight", 1)]
+    assert index.search("heet") == [(4, "Heat", 1)]
+    assert index.search("AMELIE") == [(3, "Amélie", 0)]
+    assert index.search("knight") == [(6, "Knight Rider", 0), (1, "The Dark Knight", 0)]
+    # Words of three letters or fewer must match exactly
+    assert index.search("hat") == []
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / "media.trigrams")
+    _index().save(path)
+
+    loaded = fuzzy.TrigramIndex.load(path)
+    assert len(loaded) == len(TITLES)
+    assert loaded.search("drak waters") == [(2, "Dark Waters", 1)]
+    loaded.add(7, "Darker Waters")
+    assert [title for _, title, _ in loaded.search("darker")] == ["Darker Waters"]
+
+
+def test_snapshot_of_a_different_database_is_rebuilt(scratch_db, shared_index):
+    _add_media()
+    with db.db_connection() as conn:
+        fuzzy.get_index(conn)
+        path = fuzzy.snapshot_path(conn)
+    assert os.path.exists(path)
+
+    # Same ids, different titles: as if the database had been replaced
+    with db.db_connection() as conn:
+        conn.execute("UPDATE media SET title = 'Heathers' WHERE title = 'Heat'")
+    fuzzy._index = None
+    with db.db_connection() as conn:
+        index = fuzzy.get_index(conn)
+    assert index.search("heathers") == [(4, "Heathers", 0)]
+
+
+def test_unmatched_search_suggests_close_titles(local_redis, scratch_db, shared_index, capsys):
+    _add_media()
+    logic.search_media("Amelei")
+    out = capsys.readouterr().out
+    assert "No media found matching 'Amelei'" in out
+    assert "Did you mean?" in out and "Amélie" in out
+
+    logic.add_media("Hidden Figures", "Movie")
+    logic.search_media("Hiden Figures")
+    assert "Hidden Figures" in capsys.readouterr().out
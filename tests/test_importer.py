@@ -0,0 +1,65 @@
+import json
+import sqlite3
+
+import pytest
+
+import db
+import importer
+
+
+def _write_jsonl(path, records):
+    path.write_text("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records), encoding="utf-8")
+    return str(path)
+
+
+def _reviews():
+    with db.db_connection() as conn:
+        return conn.execute("SELECT user_id, media_id, rating, comment FROM reviews ORDER BY id").fetchall()
+
+
+def test_non_ascii_names_resolve(scratch_db, tmp_path):
+    with db.db_connection() as conn:
+        conn.execute("INSERT INTO users (name) VALUES ('Émile')")
+        conn.execute("INSERT INTO media (title, type) VALUES ('Amélie', 'Movie')")
+
+    path = _write_jsonl(tmp_path / "reviews.jsonl", [
+        {"user": "Émile", "media": "Amélie", "rating": 5, "comment": "exact"},
+        {"user": "ÉMILE", "media": "amélie", "rating": 4, "comment": "ASCII letters folded"},
+    ])
+    stats = importer.import_reviews(path)
+
+    assert (stats.inserted, stats.failed) == (2, 0), stats.errors
+    assert _reviews() == [(1, 1, 5, "exact"), (1, 1, 4, "ASCII letters folded")]
+
+
+def test_failed_chunk_resumes_from_checkpoint(scratch_db, tmp_path, monkeypatch):
+    with db.db_connection() as conn:
+        conn.execute("INSERT INTO users (name) VALUES ('ann')")
+        conn.execute("INSERT INTO media (title, type) VALUES ('Heat', 'Movie')")
+    path = _write_jsonl(tmp_path / "reviews.jsonl",
+                        [{"user_id": 1, "media_id": 1, "rating": 1 + i % 5, "comment": f"row {i}"} for i in range(10)])
+
+    # The second chunk fails after its rows were inserted; its transaction rolls back
+    real_inserted_ids = importer.inserted_ids
+    calls = []
+
+    def failing_inserted_ids(conn, count):
+        calls.append(count)
+        if len(calls) == 2:
+            raise sqlite3.OperationalError("disk I/O error")
+        return real_inserted_ids(conn, count)
+
+    monkeypatch.setattr(importer, "inserted_ids", failing_inserted_ids)
+    with pytest.raises(sqlite3.OperationalError):
+        importer.import_reviews(path, chunk_size=4)
+
+    assert [comment for *_, comment in _reviews()] == [f"row {i}" for i in range(4)]
+    offset = importer.read_checkpoint(path)
+    with open(path, "rb") as f:
+        assert offset == len(b"".join(f.readlines()[:4]))
+
+    monkeypatch.undo()
+    stats = importer.import_reviews(path, offset=offset, chunk_size=4)
+    assert (stats.inserted, stats.failed) == (6, 0)
+    assert [comment for *_, comment in _reviews()] == [f"row {i}" for i in range(10)]
+    assert importer.read_checkpoint(path) == 0
@@ -0,0 +1,104 @@
+import pytest
+
+import db
+import leaderboard
+
+MEDIA = [("Heat", "Movie"), ("Fargo", "Movie"), ("Dark", "WebShow"), ("Hurt", "Song")]
+CLEAN = {"checked": 4, "missing": 0, "wrong_score": 0, "wrong_counts": 0, "wrong_type": 0, "extra": 0}
+
+
+def _review(client, user_id, media_id, rating):
+    """Commit a review and record it, as add_review does. Returns (review id, recorded)."""
+    with db.db_connection() as conn:
+        review_id = conn.execute("INSERT INTO reviews (user_id, media_id, rating, comment) VALUES (?, ?, ?, 'x')",
+                                 (user_id, media_id, rating)).lastrowid
+    return review_id, leaderboard.record_reviews([(review_id, media_id, rating)], client=client)
+
+
+def _dump(client):
+    """Every leaderboard key, normalized to what a real server returns."""
+    hashes = [leaderboard.SUMS_KEY, leaderboard.COUNTS_KEY, leaderboard.TYPES_KEY]
+    boards = [leaderboard.GLOBAL_KEY] + [leaderboard.type_key(t) for t in leaderboard.MEDIA_TYPES]
+    state = {key: {str(k): str(v) for k, v in client.hgetall(key).items()} for key in hashes}
+    state.update({key: [(str(m), float(s)) for m, s in client.zrevrange(key, 0, -1, withscores=True)]
+                  for key in boards})
+    state[leaderboard.APPLIED_KEY] = sorted(str(m) for m in client.smembers(leaderboard.APPLIED_KEY))
+    for key in (leaderboard.HIGH_WATER_KEY, leaderboard.BUILT_KEY):
+        value = client.get(key)
+        state[key] = None if value is None else str(value)
+    state[leaderboard.STAGING_KEY] = bool(client.exists(leaderboard.STAGING_KEY))
+    return state
+
+
+def _run(client, path, monkeypatch):
+    """Record reviews across two rebuilds, each raced by a concurrent review.
+    Returns (check report, top lists, every key)."""
+    db.configure_pool(database=str(path))
+    try:
+        db.initialize_db()
+        with db.db_connection() as conn:
+            conn.executemany("INSERT INTO users (name) VALUES (?)", [("ann",), ("bob",), ("cat",)])
+            conn.executemany("INSERT INTO media (title, type) VALUES (?, ?)", MEDIA)
+        for media_id, (_, media_type) in enumerate(MEDIA, 1):
+            leaderboard.add_media(media_id, media_type, client=client)
+
+        assert [_review(client, *review)[1] for review in [(1, 1, 5), (2, 1, 4), (1, 3, 2), (3, 4, None), (1, 2, 3)]] \
+            == [1, 1, 1, 0, 1]
+
+        # Committed after the snapshot but recorded before staging begins:
+        # only the old boards see it, so the swap has to replay it
+        real_snapshot = leaderboard._snapshot
+
+        def snapshot_then_review(conn):
+            snapshot = real_snapshot(conn)
+            _review(client, 2, 3, 5)
+            return snapshot
+
+        monkeypatch.setattr(leaderboard, "_snapshot", snapshot_then_review)
+        with db.db_connection() as conn:
+            leaderboard.rebuild(conn, client)
+        monkeypatch.undo()
+
+        # Recorded while the new boards are staged, after the replay was read
+        real_swap = leaderboard._swap
+
+        def review_then_swap(keys, args, client=None):
+            _review(client, 3, 2, 1)
+            return real_swap(keys, args, client=client)
+
+        monkeypatch.setattr(leaderboard, "_swap", review_then_swap)
+        with db.db_connection() as conn:
+            leaderboard.rebuild(conn, client)
+        monkeypatch.undo()
+
+        # Reviews the boards already have are not counted twice
+        assert leaderboard.record_reviews([(6, 3, 5), (7, 2, 1)], client=client) == 0
+        assert _review(client, 3, 1, 1)[1] == 1
+
+        with db.db_connection() as conn:
+            report = leaderboard.check(conn, client)
+            tops = {media_type: leaderboard.top(conn, 10, media_type, client)
+                    for media_type in (None,) + leaderboard.MEDIA_TYPES}
+        return report, tops, _dump(client)
+    finally:
+        db.configure_pool()
+
+
+def test_boards_follow_sqlite_through_racing_rebuilds(local_redis, tmp_path, monkeypatch):
+    report, tops, _ = _run(local_redis, tmp_path / "board.db", monkeypatch)
+    assert report == CLEAN
+    assert tops == {
+        None: [(3, 3.5), (1, pytest.approx(10 / 3)), (2, 2.0), (4, 0.0)],
+        "Movie": [(1, pytest.approx(10 / 3)), (2, 2.0)],
+        "WebShow": [(3, 3.5)],
+        "Song": [(4, 0.0)],
+    }
+
+
+def test_lua_scripts_match_the_local_twin(redis_server, tmp_path, monkeypatch):
+    import redis_cache
+
+    local = _run(redis_cache.LocalRedis(), tmp_path / "local.db", monkeypatch)
+    server = _run(redis_server, tmp_path / "server.db", monkeypatch)
+    assert server[0] == CLEAN
+    assert server == local
@@ -0,0 +1,72 @@
+import logging
+import time
+
+import pytest
+
+import logger
+
+log = logging.getLogger("tests.logger")
+
+
+@pytest.fixture
+def configure(log_file):
+    """Reconfigure logging for one test, then go back to the session's log file."""
+    yield logger.configure_logging
+    logger.configure_logging(path=str(log_file))
+
+
+def _wait_written(count):
+    deadline = time.monotonic() + 5
+    while logger.log_stats()["written"] < count and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+
+def test_shutdown_writes_everything_queued_and_counts_drops(configure, tmp_path):
+    path = tmp_path / "app.log"
+    configure(path=str(path), queue_size=10)
+
+    # Stall the writer on the file so the queue fills up behind it
+    with logger._file_handler.lock:
+        for i in range(100):
+            log.info("record %d", i)
+        dropped = logger.log_stats()["dropped"]
+    logger.shutdown()
+
+    lines = path.read_text(encoding="utf-8").splitlines()
+    written = [int(line.rsplit(" ", 1)[1]) for line in lines[:-1]]
+    assert dropped >= 80
+    assert len(written) == 100 - dropped
+    assert written == sorted(written)
+    assert lines[-1].endswith(f"WARNING - {dropped} log records dropped: the log queue was full")
+    assert logger.log_stats()["written"] == 0
+
+
+def test_rotates_by_size_keeping_backup_count_files(configure, tmp_path):
+    path = tmp_path / "app.log"
+    configure(path=str(path), max_bytes=300, rotate_seconds=0, backup_count=2)
+    for i in range(30):
+        log.info("line %02d %s", i, "x" * 40)
+        _wait_written(i + 1)
+    rotations = logger.log_stats()["rotations"]
+    logger.shutdown()
+
+    assert rotations >= 5
+    files = [path, tmp_path / "app.log.1", tmp_path / "app.log.2"]
+    assert all(0 < file.stat().st_size <= 300 for file in files)
+    assert not (tmp_path / "app.log.3").exists()
+    assert "line 29" in path.read_text(encoding="utf-8")
+
+
+def test_rotates_by_age(configure, tmp_path):
+    path = tmp_path / "app.log"
+    configure(path=str(path), max_bytes=0, rotate_seconds=3600)
+    log.info("yesterday")
+    _wait_written(1)
+    logger._file_handler._opened_at -= 3600
+    log.info("today")
+    _wait_written(2)
+    assert logger.log_stats()["rotations"] == 1
+    logger.shutdown()
+
+    assert "yesterday" in (tmp_path / "app.log.1").read_text(encoding="utf-8")
+    assert "today" in path.read_text(encoding="utf-8") and "yesterday" not in path.read_text(encoding="utf-8")
@@ -0,0 +1,53 @@
+import db
+import migrations
+from conftest import add_reviews, seed
+
+REVIEWS = [(1, 1, 5, "a"), (2, 1, 4, "b"), (3, 1, None, "c"), (1, 2, 1, "d"), (2, 3, 3, "e")]
+
+
+def _stats():
+    with db.db_connection() as conn:
+        return conn.execute(
+            "SELECT media_id, review_count, rating_count, rating_sum, r1, r2, r3, r4, r5 FROM media_stats ORDER BY media_id"
+        ).fetchall()
+
+
+def _expected_stats():
+    with db.db_connection() as conn:
+        return conn.execute("""
+            SELECT media.id, COUNT(reviews.id), COUNT(reviews.rating), COALESCE(SUM(reviews.rating), 0),
+                   COUNT(CASE WHEN rating = 1 THEN 1 END), COUNT(CASE WHEN rating = 2 THEN 1 END),
+                   COUNT(CASE WHEN rating = 3 THEN 1 END), COUNT(CASE WHEN rating = 4 THEN 1 END),
+                   COUNT(CASE WHEN rating = 5 THEN 1 END)
+            FROM media LEFT JOIN reviews ON reviews.media_id = media.id
+            GROUP BY media.id ORDER BY media.id
+        """).fetchall()
+
+
+def test_triggers_keep_media_stats_in_sync(scratch_db):
+    seed()
+    add_reviews(REVIEWS)
+    with db.db_connection() as conn:
+        conn.execute("UPDATE reviews SET rating = 2 WHERE comment = 'a'")
+        conn.execute("DELETE FROM reviews WHERE comment = 'e'")
+
+    assert _stats() == _expected_stats()
+    assert db.rebuild_media_stats() == (3, 0)
+
+
+def test_upgrade_backfills_existing_reviews(tmp_path, monkeypatch):
+    # A database created before the aggregate tables existed
+    monkeypatch.setattr(migrations, "MIGRATIONS", migrations.MIGRATIONS[:3])
+    db.configure_pool(database=str(tmp_path / "old.db"))
+    try:
+        db.initialize_db()
+        seed()
+        add_reviews(REVIEWS)
+        monkeypatch.undo()
+
+        applied = db.migrate_db()
+        assert [version for version, _ in applied] == [version for version, _, _ in migrations.MIGRATIONS[3:]]
+        assert _stats() == _expected_stats()
+        assert db.rebuild_media_stats() == (3, 0)
+    finally:
+        db.configure_pool()
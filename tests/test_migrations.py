@@ -0,0 +1,14 @@
+import db
+import migrations
+
+
+def test_fresh_database_reaches_latest_version(scratch_db):
+    with db.db_connection() as conn:
+        assert migrations.get_schema_version(conn) == migrations.MIGRATIONS[-1][0]
+    assert db.migrate_db() == []
+
+
+def test_planned_queries_use_indexes(scratch_db):
+    for name, plan, indexes in db.get_query_plans():
+        assert indexes, f"{name} does not use an index: {plan}"
+
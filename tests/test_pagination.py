@@ -0,0 +1,45 @@
+import db
+import logic
+from conftest import seed
+
+
+def _add_reviews(count):
+    seed()
+    with db.db_connection() as conn:
+        conn.executemany("INSERT INTO reviews (user_id, media_id, rating, comment) VALUES (?, ?, ?, ?)",
+                         [(1 + i % 3, 1 + i % 3, 1 + i % 5, f"review {i}") for i in range(count)])
+
+
+def test_pages_follow_review_ids(scratch_db):
+    _add_reviews(12)
+    pages = list(db.iter_review_pages(page_size=5))
+    assert [len(page) for page in pages] == [5, 5, 2]
+    assert [row[0] for page in pages for row in page] == list(range(1, 13))
+    assert pages[0][0] == (1, "user0", "media0", 1, "review 0")
+
+
+def test_after_and_limit_walk_the_listing_without_gaps(scratch_db):
+    _add_reviews(12)
+    seen, after = [], 0
+    while True:
+        rows = [row for page in db.iter_review_pages(after_id=after, limit=5, page_size=2) for row in page]
+        if not rows:
+            break
+        assert len(rows) <= 5
+        seen += [row[0] for row in rows]
+        after = rows[-1][0]
+    assert seen == list(range(1, 13))
+
+
+def test_listing_prints_where_the_next_page_starts(scratch_db, capsys):
+    _add_reviews(12)
+    logic.list_reviews(after=3, limit=4, stream=True, page_size=2)
+    out = capsys.readouterr().out
+    assert "review 3" in out and "review 6" in out
+    assert "review 2" not in out and "review 7" not in out
+    assert "Next page: --after 7" in out
+
+    logic.list_reviews(after=7, limit=10)
+    out = capsys.readouterr().out
+    assert "review 11" in out
+    assert "Next page" not in out
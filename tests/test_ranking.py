@@ -0,0 +1,84 @@
+import pytest
+
+import db
+import ranking
+from conftest import add_reviews, seed
+from migrations import DECAY_HALF_LIFE, WILSON_POSITIVE
+
+NOW = 1800000000
+DAY = 24 * 3600
+MEDIA = [("Solo", "Movie"), ("Crowd", "Movie"), ("Old Hit", "Song"), ("Mixed", "WebShow"), ("Unrated", "Movie")]
+# (media_id, rating, days before NOW)
+RATINGS = ([(1, 5, 1)] + [(2, rating, 1) for rating in (5, 5, 4, 5, 4, 5, 4, 5)]
+           + [(3, rating, 365) for rating in (5, 5, 5, 5, 4, 5)] + [(4, rating, 2) for rating in (1, 2, 3)])
+
+
+@pytest.fixture
+def catalog(scratch_db):
+    with db.db_connection() as conn:
+        conn.execute("INSERT INTO users (name) VALUES ('ann')")
+        conn.executemany("INSERT INTO media (title, type) VALUES (?, ?)", MEDIA)
+        conn.executemany("INSERT INTO reviews (user_id, media_id, rating, comment, created_at) VALUES (1, ?, ?, 'x', ?)",
+                         [(media_id, rating, NOW - days * DAY) for media_id, rating, days in RATINGS])
+
+
+def _titles(mode, media_type=None):
+    with db.db_connection() as conn:
+        return [title for _, title, *_ in ranking.top_media(conn, 10, mode, media_type, now=NOW)]
+
+
+def test_modes_rank_confidence_and_recency(catalog):
+    assert _titles("average") == ["Solo", "Old Hit", "Crowd", "Mixed"]
+    # One 5-star rating is weak evidence next to eight high ones
+    assert _titles("bayesian") == ["Old Hit", "Crowd", "Solo", "Mixed"]
+    # Every rating of 4 or more counts as positive, so 8 of 8 beats 6 of 6
+    assert _titles("wilson") == ["Crowd", "Old Hit", "Solo", "Mixed"]
+    # A year of decay leaves Old Hit's ratings worth a fraction of one
+    assert _titles("decayed") == ["Crowd", "Solo", "Old Hit", "Mixed"]
+    assert _titles("wilson", "Movie") == ["Crowd", "Solo"]
+
+
+def test_stored_scores_match_the_formulas(catalog):
+    with db.db_connection() as conn:
+        ranking.top_media(conn, 1, "bayesian", now=NOW)
+        mean, weight = ranking.priors(conn)
+        stored = {media_id: scores for media_id, *scores in conn.execute(
+            "SELECT media_id, bayesian_score, wilson_score, decayed_score FROM media_stats WHERE rating_count > 0")}
+
+    assert weight == len(RATINGS) / 4
+    for media_id, (bayesian, wilson, decayed) in stored.items():
+        ratings = [(rating, days) for m, rating, days in RATINGS if m == media_id]
+        total = sum(rating for rating, _ in ratings)
+        positive = sum(rating >= WILSON_POSITIVE for rating, _ in ratings)
+        weights = [2.0 ** (-days * DAY / DECAY_HALF_LIFE) for _, days in ratings]
+        assert bayesian == pytest.approx(ranking.bayesian(len(ratings), total, mean, weight))
+        assert wilson == pytest.approx(ranking.wilson(positive, len(ratings)))
+        assert decayed == pytest.approx(ranking.bayesian(
+            sum(weights), sum(w * rating for w, (rating, _) in zip(weights, ratings)), mean, weight))
+
+
+def test_prior_is_refreshed_once_stale(catalog):
+    with db.db_connection() as conn:
+        ranking.top_media(conn, 1, "bayesian", now=NOW)
+        conn.execute("INSERT INTO reviews (user_id, media_id, rating, comment) VALUES (1, 4, 1, 'x')")
+        ranking.top_media(conn, 1, "bayesian", now=NOW + ranking.REFRESH_SECONDS - 1)
+        assert ranking.scores_as_of(conn) == NOW
+        ranking.top_media(conn, 1, "bayesian", now=NOW + ranking.REFRESH_SECONDS)
+        assert ranking.scores_as_of(conn) == NOW + ranking.REFRESH_SECONDS
+        assert ranking.priors(conn)[1] == (len(RATINGS) + 1) / 4
+
+
+def test_unknown_mode_is_rejected(catalog):
+    with db.db_connection() as conn, pytest.raises(ValueError, match="Unknown ranking mode"):
+        ranking.top_media(conn, 5, "median")
+
+
+def test_stored_scores_follow_new_reviews(scratch_db):
+    seed()
+    add_reviews([(1, 1, 5, "a"), (2, 1, 4, "b"), (3, 1, None, "c"), (1, 2, 1, "d"), (2, 3, 3, "e")])
+    with db.db_connection() as conn:
+        before = conn.execute("SELECT wilson_score FROM media_stats WHERE media_id = 2").fetchone()[0]
+        conn.execute("INSERT INTO reviews (user_id, media_id, rating, comment) VALUES (3, 2, 5, 'f')")
+        after = conn.execute("SELECT wilson_score FROM media_stats WHERE media_id = 2").fetchone()[0]
+    assert before == 0
+    assert after > before
@@ -0,0 +1,92 @@
+import pytest
+
+import db
+import recommendation_cache
+import recommender
+from conftest import add_reviews
+
+pytest.importorskip("numpy")
+
+# Users 1-4 love media 1-3 and dislike 4-6, users 5-8 the other way round
+CLUSTERS = [(user, media, 5 if (user <= 4) == (media <= 3) else 1)
+            for user in range(1, 9) for media in range(1, 7) if (user + media) % 4]
+
+
+@pytest.fixture
+def model(scratch_db, tmp_path, monkeypatch):
+    """Clustered ratings, a neighbour model saved in tmp_path and no dirty marks."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(recommender, "_model", None)
+    add_reviews([(user, media, rating, "x") for user, media, rating in CLUSTERS])
+    with db.db_connection() as conn:
+        conn.execute("DELETE FROM recommendations_dirty")
+        conn.execute("DELETE FROM recommendations_dirty_media")
+        return recommender.rebuild_model(conn)
+
+
+@pytest.fixture
+def computed(monkeypatch):
+    """Count on-demand computations."""
+    calls = []
+    real_recommend = recommender.recommend
+
+    def recommend(conn, user_id, limit=5):
+        calls.append(user_id)
+        return real_recommend(conn, user_id, limit)
+
+    monkeypatch.setattr(recommender, "recommend", recommend)
+    return calls
+
+
+def _dirty():
+    with db.db_connection() as conn:
+        return dict(conn.execute("SELECT user_id, version FROM recommendations_dirty"))
+
+
+def test_stored_entry_serves_until_the_user_reviews_again(model, computed):
+    expected = model.recommend({media: rating for user, media, rating in CLUSTERS if user == 2})
+    with db.db_connection() as conn:
+        first = recommendation_cache.get(conn, 2)
+        assert [media_id for media_id, _ in first] == [media_id for media_id, _ in expected] == [2, 6]
+        assert [score for _, score in first] == pytest.approx([score for _, score in expected])
+        # Later reads come from the stored entry, scores as float32
+        assert recommendation_cache.get(conn, 2, limit=1) == [(2, pytest.approx(expected[0][1]))]
+        assert computed == [2]
+
+    add_reviews([(2, 6, 5, "changed my mind")])
+    assert _dirty() == {2: 0}
+    with db.db_connection() as conn:
+        assert recommendation_cache.lookup(conn, 2) is None
+        assert [media_id for media_id, _ in recommendation_cache.get(conn, 2)] == [2]
+        assert recommendation_cache.lookup(conn, 2) is not None
+    assert computed == [2, 2]
+    assert _dirty() == {}
+
+
+def test_mark_made_during_a_refresh_survives_it(model):
+    add_reviews([(2, 1, 4, "again")])
+    with db.db_connection() as conn:
+        version = conn.execute("SELECT version FROM recommendations_dirty WHERE user_id = 2").fetchone()[0]
+    # Another review lands while the refresh is computing
+    add_reviews([(2, 2, 4, "and again")])
+    with db.db_connection() as conn:
+        recommendation_cache._save(conn, [(2, [(3, 4.5)], version)])
+    assert _dirty() == {2: version + 1}
+
+    assert recommendation_cache.refresh_dirty() == 1
+    assert _dirty() == {}
+
+
+def test_rebuild_marks_raters_of_neighbouring_media(model):
+    add_reviews([(1, 2, 5, "more")])
+    assert _dirty() == {1: 0}
+    with db.db_connection() as conn:
+        assert recommendation_cache.pending(conn) == (1, 1)
+        rebuilt = recommender.rebuild_model(conn)
+        assert recommendation_cache.expand_dirty_media(conn, rebuilt) == 1
+        assert recommendation_cache.pending(conn) == (len(set(user for user, media, _ in CLUSTERS if media <= 3)), 0)
+
+    assert recommendation_cache.refresh_dirty(batch_size=2) == 2
+    while recommendation_cache.refresh_dirty(batch_size=2):
+        pass
+    assert _dirty() == {}
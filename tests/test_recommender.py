@@ -0,0 +1,70 @@
+import math
+import random
+
+import pytest
+
+import db
+import recommender
+from conftest import add_reviews
+
+np = pytest.importorskip("numpy")
+
+# Users 1-4 love media 1-3 and dislike 4-6, users 5-8 the other way round
+CLUSTERS = [(user, media, 5 if (user <= 4) == (media <= 3) else 1)
+            for user in range(1, 9) for media in range(1, 7) if (user + media) % 4]
+
+
+def _rate(triples):
+    add_reviews([(user, media, rating, "x") for user, media, rating in triples])
+
+
+def _model():
+    with db.db_connection() as conn:
+        return recommender.build_model(conn)
+
+
+def test_recommends_what_similar_tastes_liked(scratch_db):
+    _rate(CLUSTERS)
+    model = _model()
+    assert set(model.neighbors_of(1)) == {2, 3}
+    assert set(model.neighbors_of(5)) == {4, 6}
+
+    ranked = model.recommend({1: 5, 4: 1}, limit=4)
+    assert {media_id for media_id, _ in ranked[:2]} == {2, 3}
+    assert {media_id for media_id, _ in ranked[2:]} == {5, 6}
+    assert all(score > 3 for _, score in ranked[:2]) and all(score < 3 for _, score in ranked[2:])
+
+
+def test_similarities_match_adjusted_cosine(scratch_db):
+    rng = random.Random(3)
+    ratings = {(user, media): rng.randint(1, 5) for user in range(1, 16) for media in range(1, 11) if rng.random() < 0.5}
+    _rate((user, media, rating) for (user, media), rating in ratings.items())
+    model = _model()
+
+    means = {user: np.mean([r for (u, _), r in ratings.items() if u == user]) for user, _ in ratings}
+    centered = {(user, media): rating - means[user] for (user, media), rating in ratings.items()}
+
+    def similarity(a, b):
+        shared = [user for user, media in centered if media == a and (user, b) in centered]
+        dot = sum(centered[user, a] * centered[user, b] for user in shared)
+        norm_a = math.sqrt(sum(v * v for (_, media), v in centered.items() if media == a))
+        norm_b = math.sqrt(sum(v * v for (_, media), v in centered.items() if media == b))
+        return dot / (norm_a * norm_b) * len(shared) / (len(shared) + recommender.SIMILARITY_SHRINK)
+
+    for row, media_id in enumerate(model.media_ids):
+        expected = {other: similarity(media_id, other) for other in model.media_ids if other != media_id}
+        start, end = model.indptr[row], model.indptr[row + 1]
+        got = dict(zip(model.media_ids[model.neighbors[start:end]].tolist(), model.similarity[start:end].tolist()))
+        assert set(got) == {other for other, value in expected.items() if value > 0}
+        for other, value in got.items():
+            assert value == pytest.approx(expected[other], rel=1e-5)
+
+
+def test_saved_model_recommends_the_same(scratch_db, tmp_path):
+    _rate(CLUSTERS)
+    model = _model()
+    path = str(tmp_path / "neighbors.npz")
+    model.save(path)
+    loaded = recommender.ItemNeighbors.load(path)
+    assert loaded.max_review_id == len(CLUSTERS)
+    assert loaded.recommend({2: 4, 6: 2}) == model.recommend({2: 4, 6: 2})
@@ -0,0 +1,58 @@
+import sqlite3
+
+import pytest
+
+import db
+import review_writer
+from conftest import seed
+
+
+def _ratings():
+    with db.db_connection() as conn:
+        return conn.execute("SELECT id, rating, comment FROM reviews ORDER BY id").fetchall()
+
+
+def test_batch_commits_and_resolves_every_future(scratch_db):
+    seed()
+    committed = []
+    writer = review_writer.ReviewWriter(max_batch=10, max_delay=0.5,
+                                        on_commit=lambda rows, ids: committed.append((rows, ids)))
+    futures = [writer.submit(1 + i % 3, 1, 1 + i % 5, f"review {i}") for i in range(10)]
+    for future in futures:
+        assert future.result(timeout=5) is None
+    writer.close()
+
+    assert writer.stats == {"batches": 1, "rows": 10, "failed": 0}
+    [(rows, ids)] = committed
+    assert ids == [review_id for review_id, _, _ in _ratings()]
+    assert [comment for *_, comment in rows] == [f"review {i}" for i in range(10)]
+
+
+def test_invalid_review_fails_without_reaching_the_queue(scratch_db):
+    writer = review_writer.ReviewWriter()
+    future = writer.submit(1, 1, 6, "too good")
+    with pytest.raises(ValueError, match="between 1 and 5"):
+        future.result(timeout=1)
+    assert writer._thread is None
+
+
+def test_constraint_violation_fails_only_its_own_row(scratch_db, monkeypatch):
+    seed()
+    # Let a row the CHECK constraint rejects reach the batch
+    monkeypatch.setattr(review_writer, "validate_review", lambda *row: None)
+    committed = []
+    writer = review_writer.ReviewWriter(max_batch=3, max_delay=0.5,
+                                        on_commit=lambda rows, ids: committed.append(ids))
+    good = writer.submit(1, 1, 4, "fine")
+    bad = writer.submit(2, 1, 9, "out of range")
+    other = writer.submit(3, 1, 2, "meh")
+
+    assert good.result(timeout=5) is None
+    assert other.result(timeout=5) is None
+    with pytest.raises(sqlite3.IntegrityError):
+        bad.result(timeout=5)
+    writer.close()
+
+    assert [(rating, comment) for _, rating, comment in _ratings()] == [(4, "fine"), (2, "meh")]
+    assert committed == [[review_id for review_id, _, _ in _ratings()]]
+    assert writer.stats == {"batches": 1, "rows": 2, "failed": 1}
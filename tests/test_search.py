@@ -0,0 +1,68 @@
+import db
+import logic
+import search
+
+TITLES = [("Dark Waters", "Movie"), ("The Dark Knight", "Movie"), ("Dark", "WebShow"),
+          ("Dark Horse", "Song"), ("Into the Dark", "Song")]
+
+
+def _add_media(titles=TITLES):
+    with db.db_connection() as conn:
+        conn.executemany("INSERT INTO media (title, type) VALUES (?, ?)", titles)
+
+
+def _titles(text, **options):
+    with db.db_connection() as conn:
+        return sorted(title for _, title, _, _ in search.search_media(conn, text, **options))
+
+
+def test_count_matches_applies_the_type_filter(scratch_db):
+    _add_media()
+    with db.db_connection() as conn:
+        assert search.count_matches(conn, "media_fts", "dark") == 5
+        assert search.count_matches(conn, "media_fts", "dark", media_type="Movie") == 2
+        assert search.count_matches(conn, "media_fts", "dark", media_type="Song") == 2
+    assert _titles("dark", media_type="Movie") == ["Dark Waters", "The Dark Knight"]
+
+
+def _search_output(capsys, text, **options):
+    logic.search_catalog(text, **options)
+    return " ".join(capsys.readouterr().out.split())
+
+
+def test_search_with_type_pages_over_that_type_only(scratch_db, capsys):
+    _add_media()
+
+    first = _search_output(capsys, "dark", page=1, per_page=1, media_type="Movie", include_reviews=False)
+    assert "(page 1, 2 total)" in first
+    assert "Next page: --page 2" in first
+
+    second = _search_output(capsys, "dark", page=2, per_page=1, media_type="Movie", include_reviews=False)
+    assert "(page 2, 2 total)" in second
+    assert "Next page" not in second
+
+    assert ("Dark Waters" in first) != ("Dark Waters" in second)
+    assert ("The Dark Knight" in first) != ("The Dark Knight" in second)
+    assert not any(other in first + second for other in ("WebShow", "Song"))
+
+
+def test_fts_index_follows_updates_and_deletes(scratch_db):
+    _add_media([("Midnight Garden", "Movie"), ("Silent Harbor", "Movie")])
+    with db.db_connection() as conn:
+        conn.execute("INSERT INTO users (name) VALUES ('ann')")
+        conn.execute("INSERT INTO reviews (user_id, media_id, rating, comment) VALUES (1, 1, 5, 'gorgeous colours')")
+
+    with db.db_connection() as conn:
+        conn.execute("UPDATE media SET title = 'Midnight Orchard' WHERE id = 1")
+        conn.execute("DELETE FROM media WHERE id = 2")
+        conn.execute("UPDATE reviews SET comment = 'dreary pacing' WHERE id = 1")
+
+    assert _titles("garden") == []
+    assert _titles("orchard") == ["Midnight Orchard"]
+    assert _titles("harbor") == []
+    with db.db_connection() as conn:
+        assert search.search_reviews(conn, "gorgeous") == []
+        assert [row[0] for row in search.search_reviews(conn, "drear")] == [1]
+
+        conn.execute("DELETE FROM reviews WHERE id = 1")
+        assert search.count_matches(conn, "reviews_fts", "dreary") == 0
@@ -0,0 +1,39 @@
+import benchmarks
+import cache
+
+
+def test_fence_refuses_a_late_writer(local_redis):
+    key, lock_key = "cache:fenced", "lock:cache:fenced"
+    local_redis.set(lock_key, "2")
+
+    assert not cache._store_if_fenced(keys=[key, lock_key], args=["1", "stale", 60], client=local_redis)
+    assert local_redis.get(key) is None
+    assert cache._store_if_fenced(keys=[key, lock_key], args=["2", "fresh", 60], client=local_redis)
+    assert local_redis.get(key) == "fresh"
+
+    assert not cache._release_lock(keys=[lock_key], args=["1"], client=local_redis)
+    assert local_redis.get(lock_key) == "2"
+    assert cache._release_lock(keys=[lock_key], args=["2"], client=local_redis)
+    assert local_redis.get(lock_key) is None
+
+
+def test_rebuild_that_lost_its_lock_is_fenced_out(local_redis):
+    key = "cache:slow"
+
+    def builder():
+        # Our lock expired and another process took over with a newer token
+        token = local_redis.incr(f"fence:{key}")
+        local_redis.set(f"lock:{key}", token)
+        return "late"
+
+    before = cache.rebuild_stats["fenced_out"]
+    assert cache._rebuild(key, builder, 60, cache.cache_codec.JSON) == "late"
+    assert cache.rebuild_stats["fenced_out"] == before + 1
+    assert local_redis.get(key) is None
+
+
+def test_single_flight_and_stale_while_revalidate():
+    result = benchmarks.check_stampede(callers=16)
+    assert result["cold_builds"] == 1
+    assert result["stale_builds"] == 1
+    assert result["stale_max_wait_ms"] < 150
@@ -0,0 +1,71 @@
+import sqlite3
+import time
+
+import notifications
+from conftest import Inbox, review_event, seed, subscribe
+
+
+def _setup(count=6):
+    seed(users=2, media=2)
+    subscribe([(1, 1), (2, 1), (2, 2)])
+    events = [review_event(1 + i % 2, i) for i in range(count)]
+    notifications.ensure_group()
+    notifications.publish(events)
+    return events
+
+
+def _expected(events):
+    followers = {1: ["user0", "user1"], 2: ["user1"]}
+    return {(name, media_id, details["comment"]): 1 for media_id, details in events for name in followers[media_id]}
+
+
+def test_worker_delivers_then_acknowledges(local_redis, scratch_db):
+    events = _setup()
+    inbox = Inbox()
+    worker = notifications.StreamWorker("w1", count=4, sink=inbox)
+    worker.run(drain=True)
+
+    assert inbox.received == _expected(events)
+    assert notifications.stream_status() == (6, 0, {})
+    assert worker.metrics()["acked"] == 6
+
+
+def test_restarted_consumer_delivers_what_it_read_before_dying(local_redis, scratch_db):
+    events = _setup()
+    # Read but never delivered nor acknowledged, as if the process died
+    notifications.StreamWorker("w1", count=10)._read(">", None)
+    assert notifications.stream_status()[1:] == (6, {"w1": 6})
+
+    inbox = Inbox()
+    notifications.StreamWorker("w1", sink=inbox).run(drain=True)
+    assert inbox.received == _expected(events)
+    assert notifications.stream_status()[1] == 0
+
+
+def test_idle_entries_of_a_dead_consumer_are_claimed(local_redis, scratch_db):
+    events = _setup()
+    notifications.StreamWorker("dead", count=10)._read(">", None)
+
+    inbox = Inbox()
+    patient = notifications.StreamWorker("w2", sink=inbox, claim_idle_ms=60000)
+    patient.run(drain=True)
+    assert inbox.received == {}
+
+    time.sleep(0.02)
+    worker = notifications.StreamWorker("w2", sink=inbox, claim_idle_ms=10)
+    worker.run(drain=True)
+    assert inbox.received == _expected(events)
+    assert worker.metrics()["claimed"] == 6
+    assert notifications.stream_status()[1] == 0
+
+
+def test_failed_delivery_stays_pending(local_redis, scratch_db):
+    _setup()
+
+    def broken_sink(name, media_id, details):
+        raise sqlite3.OperationalError("database is locked")
+
+    worker = notifications.StreamWorker("w1", sink=broken_sink)
+    worker.run(drain=True)
+    assert worker.metrics()["errors"] == 6 and worker.metrics()["acked"] == 0
+    assert notifications.stream_status()[1:] == (6, {"w1": 6})
@@ -0,0 +1,55 @@
+from collections import Counter
+
+import db
+import logic
+import notifications
+import subscribers
+from conftest import Inbox, seed, subscribe
+
+
+def _names(media_id):
+    cursor, names = 0, []
+    while True:
+        cursor, chunk = subscribers.scan(media_id, cursor)
+        names += chunk
+        if not cursor:
+            return sorted(names)
+
+
+def test_sets_load_once_and_follow_new_subscriptions(local_redis, scratch_db):
+    seed(users=3, media=3)
+    subscribe([(1, 1), (2, 1), (3, 2)])
+    with db.db_connection() as conn:
+        assert subscribers.ensure_loaded(conn, [1, 2, 3]) == 3
+        assert subscribers.ensure_loaded(conn, [1, 2, 3]) == 0
+    assert (_names(1), _names(2), _names(3)) == (["user0", "user1"], ["user2"], [])
+
+    logic.subscribe_user("user2", "media0")
+    logic.subscribe_user("user0", "media2")
+    assert (_names(1), _names(3)) == (["user0", "user1", "user2"], ["user0"])
+
+    assert subscribers.rebuild() == 3
+    with db.db_connection() as conn:
+        assert subscribers.ensure_loaded(conn, [1, 3]) == 2
+    assert (_names(1), _names(3)) == (["user0", "user1", "user2"], ["user0"])
+
+
+def test_scan_walks_a_large_set_in_chunks(local_redis, scratch_db):
+    followers = subscribers.SCAN_COUNT * 2 + 1
+    seed(users=followers, media=1)
+    subscribe([(user, 1) for user in range(1, followers + 1)])
+    with db.db_connection() as conn:
+        subscribers.ensure_loaded(conn, [1])
+
+    cursor, first = subscribers.scan(1)
+    assert cursor and len(first) == subscribers.SCAN_COUNT
+    assert _names(1) == sorted(f"user{i}" for i in range(followers))
+
+
+def test_fan_out_reads_sqlite_when_redis_is_down(redis_down, scratch_db):
+    seed(users=2, media=1)
+    subscribe([(1, 1), (2, 1)])
+    inbox = Inbox()
+    sent, unfinished = notifications.fan_out({1: [{"comment": "hi"}]}, inbox)
+    assert (sent, unfinished) == (2, {})
+    assert inbox.received == Counter({("user0", 1, "hi"): 1, ("user1", 1, "hi"): 1})